@@ -0,0 +1,128 @@
+import time
+import typing
+
+import common
+
+
+class DesktopNotifier:
+    APP_NAME = common.SERVICE_NAME
+    EXPIRE_TIMEOUT_MS = 10000
+    CALL_TIMEOUT_S = 1.0
+    URGENCY_NORMAL = 1
+    URGENCY_CRITICAL = 2
+
+    def __init__(self, bus: str = 'SESSION'):
+        self.bus = bus
+        # one connection for process lifetime, reopened after errors
+        self.connection = None
+
+    def notify(self, summary: str, critical: bool, replaces_id: int = 0) -> int:
+        hints = {'urgency': ('y', self.URGENCY_CRITICAL if critical else self.URGENCY_NORMAL)}
+        body = (self.APP_NAME, replaces_id, '', summary, '', [], hints, self.EXPIRE_TIMEOUT_MS)
+        reply = self._call('Notify', 'susssasa{sv}i', body)
+        return reply[0] if reply else 0
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def _call(self, method: str, signature: str, body: tuple) -> typing.Optional[tuple]:
+        try:
+            common.import_module('jeepney.io.blocking')
+            common.import_module('jeepney.wrappers')
+            jeepney = common.import_module('jeepney')
+            if self.connection is None:
+                self.connection = jeepney.io.blocking.open_dbus_connection(bus=self.bus)
+            address = jeepney.DBusAddress(
+                '/org/freedesktop/Notifications',
+                bus_name='org.freedesktop.Notifications',
+                interface='org.freedesktop.Notifications',
+            )
+            message = jeepney.new_method_call(address, method, signature, body)
+            reply = self.connection.send_and_get_reply(message, timeout=self.CALL_TIMEOUT_S)
+            return jeepney.wrappers.unwrap_msg(reply)
+        except Exception as e:
+            common.log.error('notification error', method, e)
+            self.close()
+        return None
+
+
+class ActiveAlarm:
+    def __init__(self, alarm: common.Alarm):
+        self.alarm = alarm
+        # a raise soon after the last notification of a flapping alarm is not notified, nor is its clear
+        self.notified = False
+
+
+class AlarmDispatcher:
+    REPEAT_PERIOD_S = 300
+
+    def __init__(self, notifier: typing.Optional[DesktopNotifier] = None):
+        self.notifier = notifier
+        self.active: typing.Dict[str, ActiveAlarm] = {}
+        # name -> monotonic time of the last raise notification and the notification id, kept after the clear,
+        # so an alarm is notified at most every REPEAT_PERIOD_S however often it flaps
+        self.notified: typing.Dict[str, typing.Tuple[float, int]] = {}
+        # listener(alarm, cleared)
+        self.listeners: typing.List[typing.Callable[[common.Alarm, bool], None]] = []
+
+    def add_listener(self, listener: typing.Callable[[common.Alarm, bool], None]):
+        self.listeners.append(listener)
+
+    def get_active(self) -> typing.List[common.Alarm]:
+        return [active.alarm for active in self.active.values()]
+
+    def update(self, alarms: typing.Iterable[common.Alarm]):
+        now = time.monotonic()
+        current = {alarm.name: alarm for alarm in alarms}
+
+        for name, alarm in current.items():
+            active = self.active.get(name)
+            if active is None:
+                common.log.info('alarm', alarm)
+                active = self.active[name] = ActiveAlarm(alarm)
+                self._emit(alarm, cleared=False)
+            else:
+                # keep the latest message
+                active.alarm = alarm
+            if name not in self.notified or now - self.notified[name][0] >= self.REPEAT_PERIOD_S:
+                self._notify(active, critical=True, now=now)
+
+        for name in [name for name in self.active if name not in current]:
+            active = self.active.pop(name)
+            common.log.info('alarm cleared', active.alarm)
+            active.alarm = common.Alarm(name, '{} cleared'.format(active.alarm))
+            if active.notified:
+                self._notify(active, critical=False, now=now)
+            self._emit(active.alarm, cleared=True)
+
+        self.notified = {name: notified for name, notified in self.notified.items()
+                         if name in self.active or now - notified[0] < self.REPEAT_PERIOD_S}
+
+    def close(self):
+        if self.notifier:
+            self.notifier.close()
+
+    def _notify(self, active: ActiveAlarm, critical: bool, now: float):
+        name = active.alarm.name
+        # a clear keeps the time of the raise, a raise replaces the notification of the last clear
+        notify_time, notification_id = self.notified.get(name, (now, 0))
+        if self.notifier:
+            notification_id = self.notifier.notify(str(active.alarm), critical, notification_id)
+        if critical:
+            notify_time = now
+            active.notified = True
+        self.notified[name] = (notify_time, notification_id)
+
+    def _emit(self, alarm: common.Alarm, cleared: bool):
+        for listener in self.listeners:
+            try:
+                listener(alarm, cleared)
+            except Exception as e:
+                common.log.error('alarm listener error', e)
+
+
+def create_dispatcher(args) -> AlarmDispatcher:
+    """The dispatcher of every front end, alarms go to the desktop next to the front end's own view of them."""
+    return AlarmDispatcher(DesktopNotifier() if not args.no_notify else None)
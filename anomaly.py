@@ -0,0 +1,170 @@
+import math
+import time
+import typing
+
+import common
+import rules
+import sampling
+
+# alarm name, metric of HardMonitorInfo, smallest deviation worth an alarm in the metric unit
+METRICS = (
+    ('CPU load', 'cpu.loadavg_current', 0.5),
+    ('CPU temp', 'cpu.temp_c', 5),
+    ('GPU power', 'gpu.power_w', 5),
+    ('Memory', 'memory.used_gb', 0.5),
+    ('Swap', 'memory.swap_gb', 0.25),
+    ('Disk read', 'disk.read_mbps', 2),
+    ('Disk write', 'disk.write_mbps', 2),
+    ('Net recv', 'network.recv_mbps', 1),
+    ('Net send', 'network.send_mbps', 1),
+)
+
+# smoothing of the samples, a short spike is not an anomaly
+LEVEL_S = 300
+# memory of the baseline the level is compared to
+BASELINE_S = 6 * 3600
+# hour of day baselines, every slot gets samples one hour per day
+SLOTS = 24
+SEASON_S = 7 * 3600
+# baseline weight before it is trusted, the same for the slots
+WARMUP_WEIGHT = 0.5
+# baselines still adapt to a lasting shift, slower while it is suspected or reported
+ACTIVE_ADAPT = 0.1
+
+Z_LIMIT = 4.0
+Z_CLEAR = 2.5
+FOR_S = 120
+
+
+class Baseline:
+    """EWMA mean and variance of a level, the sum of the weights is kept for bias correction and warmup."""
+
+    def __init__(self):
+        self.mean = 0.0
+        self.var = 0.0
+        self.weight = 0.0
+
+    def update(self, level: float, alpha: float):
+        # bias corrected: the first samples are weighted as if the baseline started at them
+        rate = alpha / (self.weight * (1 - alpha) + alpha) if self.weight + alpha > 0 else 0
+        delta = level - self.mean
+        self.mean += rate * delta
+        self.var = (1 - rate) * self.var + rate * (1 - rate) * delta * delta
+        self.weight = self.weight * (1 - alpha) + alpha
+
+
+class Metric:
+    def __init__(self, name: str, metric: rules.Metric, min_delta: float):
+        self.name = name
+        self.metric = metric
+        self.min_delta = min_delta
+
+        self.level: typing.Optional[float] = None
+        self.baseline = Baseline()
+        self.slots = [Baseline() for _ in range(SLOTS)]
+
+        self.z = 0.0
+        self.expected = 0.0
+        self.active = False
+        self.pending_since: typing.Optional[float] = None
+
+    def update(self, value: typing.Optional[float], now: float, dt: float, slot: int):
+        if value is None or math.isnan(value):
+            # a missing sample keeps the state, a pending alarm starts over
+            self.z = 0.0
+            self.pending_since = None
+            return
+
+        if self.level is None:
+            self.level = value
+        self.level += -math.expm1(-dt / LEVEL_S) * (value - self.level)
+
+        self._score(self.slots[slot])
+        self._trigger(now)
+
+        # an anomaly must not become its own baseline before it is reported
+        adapt = ACTIVE_ADAPT if self.active or abs(self.z) >= Z_CLEAR else 1.0
+        # the first sample only seeds the level
+        if dt > 0:
+            self.baseline.update(self.level, -math.expm1(-dt / BASELINE_S) * adapt)
+            self.slots[slot].update(self.level, -math.expm1(-dt / SEASON_S) * adapt)
+
+    def _score(self, slot: Baseline):
+        seasonal = slot.weight >= WARMUP_WEIGHT
+        baseline = slot if seasonal else self.baseline
+        self.expected = baseline.mean
+        deviation = self.level - baseline.mean
+        trusted = seasonal or self.baseline.weight >= WARMUP_WEIGHT
+        if trusted and baseline.var > 0 and abs(deviation) >= self.min_delta:
+            self.z = deviation / math.sqrt(baseline.var)
+        else:
+            self.z = 0.0
+
+    def _trigger(self, now: float):
+        z = abs(self.z)
+        if not (z < Z_CLEAR if self.active else z >= Z_LIMIT):
+            self.pending_since = None
+            return
+        if self.pending_since is None:
+            self.pending_since = now
+        # clear without delay, a level is already smoothed over LEVEL_S
+        if self.active or now - self.pending_since >= FOR_S:
+            self.active = not self.active
+            self.pending_since = None
+
+    def get_alarm(self) -> common.Alarm:
+        return common.Alarm('Anomaly {}'.format(self.name), '{} {} {:.3g} expected {:.3g} z {:+.1f}'.format(
+            self.name, 'high' if self.z > 0 else 'low', self.level, self.expected, self.z))
+
+    def load(self, dump: typing.Dict[str, typing.Any]):
+        self.baseline.mean, self.baseline.var, self.baseline.weight = dump['baseline']
+        for slot, mean, var, weight in zip(self.slots, *dump['slots']):
+            slot.mean, slot.var, slot.weight = mean, var, weight
+
+    def dump(self) -> typing.Dict[str, typing.Any]:
+        return {
+            'baseline': [self.baseline.mean, self.baseline.var, self.baseline.weight],
+            'slots': [[slot.mean for slot in self.slots], [slot.var for slot in self.slots],
+                      [slot.weight for slot in self.slots]],
+        }
+
+
+class Detector:
+    """
+    Streaming anomaly detection of the METRICS, a few floats of state per metric and hour slot.
+    Every sample updates an EWMA level, a baseline EWMA mean and variance of the level and the hour of day slot
+    baseline, O(1) per sample and metric.
+    The z score of the level against the hour slot, or the whole day baseline while the slot warms up,
+    raises an alarm after FOR_S above Z_LIMIT when the deviation is at least the metric's minimal delta.
+    """
+
+    def __init__(self, metrics: typing.Sequence[typing.Tuple[str, str, float]] = METRICS):
+        self.metrics = [Metric(name, metric, min_delta) for name, metric, min_delta in metrics]
+        self.last_time: typing.Optional[float] = None
+
+    def update(self, info, now: float) -> typing.List[common.Alarm]:
+        dt = now - self.last_time if self.last_time is not None else 0.0
+        if dt < 0:
+            return self._alarms()
+        self.last_time = now
+        slot = time.localtime(sampling.monotonic_to_wall(now)).tm_hour * SLOTS // 24
+
+        for metric in self.metrics:
+            metric.update(rules.get_metric(info, metric.metric), now, dt, slot)
+        return self._alarms()
+
+    def _alarms(self) -> typing.List[common.Alarm]:
+        return [metric.get_alarm() for metric in self.metrics if metric.active]
+
+    def load(self, dump: typing.Dict[str, typing.Any]):
+        for metric in self.metrics:
+            metric_dump = dump.get(metric.metric)
+            if metric_dump:
+                metric.load(metric_dump)
+
+    def dump(self) -> typing.Dict[str, typing.Any]:
+        return {metric.metric: metric.dump() for metric in self.metrics}
+
+    def __str__(self):
+        return '[{}]'.format(' '.join(
+            '{} {:+.1f}'.format(metric.name, metric.z) for metric in self.metrics if abs(metric.z) >= Z_CLEAR))
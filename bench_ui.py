@@ -0,0 +1,230 @@
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+import typing
+
+# before the first Qt import, the benchmark needs no display
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+from PyQt5.QtCore import QT_VERSION_STR, QtMsgType, qInstallMessageHandler
+from PyQt5.QtWidgets import QApplication
+import pyqtgraph as pg
+
+import alarm
+import common
+import graph
+import segments
+import snapshot
+import ui
+
+# fields kept constant, graph ranges are taken from them
+CONSTANT_FIELDS = {
+    'cpu.cpu_count': 16,
+    'memory.total_gb': 32,
+    'gpu.power_cap_w': 120,
+    'gpu.temp_crit_c': 100,
+    'battery.charge_full_wh': 50,
+    'battery.charge_status': 0,
+}
+# upper bound of the random walk of the other fields
+FIELD_MAX = {
+    'cpu.loadavg_current': 16,
+    'cpu.loadavg_1m': 16,
+    'memory.used_gb': 32,
+    'memory.swap_gb': 8,
+    'network.recv_mbps': 100,
+    'network.send_mbps': 20,
+    'disk.read_mbps': 500,
+    'disk.write_mbps': 500,
+    'battery.charge_now_wh': 50,
+}
+DEFAULT_FIELD_MAX = 100
+# random walk step relative to the field bound
+STEP_RATIO = 0.05
+WARMUP_UPDATES = 50
+
+
+class SyntheticMonitor:
+    """
+    SnapshotInfo with random walk values and texts of a realistic width, the time advances by period_s per update.
+    """
+
+    def __init__(self, period_s: float, cores: int, seed: int = 0):
+        self.period_s = period_s
+        self.cores = cores
+        self.rng = np.random.default_rng(seed)
+        self.high = np.array([
+            CONSTANT_FIELDS.get(field, FIELD_MAX.get(field, DEFAULT_FIELD_MAX)) for field in segments.FIELDS
+        ], dtype=float)
+        self.constant = np.array([field in CONSTANT_FIELDS for field in segments.FIELDS])
+        self.values = self.high / 2
+        self.values[self.constant] = self.high[self.constant]
+        self.time_s = time.monotonic()
+
+    def get_info(self) -> snapshot.SnapshotInfo:
+        self.time_s += self.period_s
+        step = self.rng.normal(0, STEP_RATIO, len(self.values)) * self.high
+        self.values = np.where(self.constant, self.values, np.clip(self.values + step, 0, self.high))
+
+        texts = []
+        for segment in segments.SEGMENTS:
+            values = [value for field, value in zip(segments.FIELDS, self.values) if field in segment.fields]
+            if not values:
+                # text only segments, process names and the clock
+                values = self.rng.uniform(0, 100, 4)
+            texts.append('[{}]'.format(' '.join(common.convert_4(value) for value in values)))
+
+        info = snapshot.SnapshotInfo(self.time_s, self.values, texts, '')
+        info.cpu.core_load_list = self.rng.uniform(0, 1, self.cores).tolist()
+        return info
+
+
+def on_qt_message(message_type: QtMsgType, context, message: str):
+    # the offscreen plugin warns about every window flag and resize it can't support
+    if message_type not in (QtMsgType.QtDebugMsg, QtMsgType.QtInfoMsg, QtMsgType.QtWarningMsg):
+        sys.stderr.write(message + '\n')
+
+
+def get_percentile(values: typing.Sequence[float], percent: float) -> float:
+    return float(np.percentile(values, percent)) if values else 0.0
+
+
+def run_case(app: QApplication, args, graph_time: int, graph_height: int,
+             renderer: str) -> typing.Dict[str, typing.Any]:
+    config = graph.GraphConfig(
+        period_s=args.period, graph_height=graph_height, total_time_s=graph_time, cpu_heatmap=args.cpu_heatmap)
+    window = ui.Window(config, alarm.AlarmDispatcher(), renderer)
+    window.show()
+    monitor = SyntheticMonitor(args.period, args.cores)
+
+    def update():
+        # the same work as ui.Backend.print without the collectors
+        window.resize(1, 1)
+        info = monitor.get_info()
+        start = time.perf_counter()
+        window.graph_list.update(info)
+        window.notify(info.alarms)
+        middle = time.perf_counter()
+        # layout and paint of the offscreen backing store
+        app.processEvents()
+        return middle - start, time.perf_counter() - middle
+
+    for _ in range(WARMUP_UPDATES):
+        update()
+
+    gc.collect()
+    update_ms = []
+    paint_ms = []
+    for _ in range(args.updates):
+        update_s, paint_s = update()
+        update_ms.append(update_s * 1000)
+        paint_ms.append(paint_s * 1000)
+
+    # allocations in a separate pass, tracemalloc slows every allocation down
+    tracemalloc.start()
+    start_size, _ = tracemalloc.get_traced_memory()
+    peak_list = []
+    for _ in range(args.alloc_updates):
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        update()
+        peak_list.append(tracemalloc.get_traced_memory()[1] - size)
+    end_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    window.close()
+    window.deleteLater()
+    app.processEvents()
+
+    return {
+        'renderer': renderer,
+        'graph_time': graph_time,
+        'graph_height': graph_height,
+        'cpu_heatmap': args.cpu_heatmap,
+        'updates': args.updates,
+        'update_ms_median': statistics.median(update_ms),
+        'update_ms_p95': get_percentile(update_ms, 95),
+        'paint_ms_median': statistics.median(paint_ms),
+        'paint_ms_p95': get_percentile(paint_ms, 95),
+        'alloc_peak_kb_median': statistics.median(peak_list) / 1024 if peak_list else 0,
+        'alloc_retained_b_per_update': (end_size - start_size) / args.alloc_updates if args.alloc_updates else 0,
+    }
+
+
+def get_key(result: typing.Dict[str, typing.Any]) -> tuple:
+    return result['renderer'], result['graph_time'], result['graph_height'], result.get('cpu_heatmap', False)
+
+
+def get_versions() -> typing.Dict[str, str]:
+    return {
+        'python': platform.python_version(),
+        'qt': QT_VERSION_STR,
+        'pyqtgraph': pg.__version__,
+        'numpy': np.__version__,
+    }
+
+
+def print_results(results: typing.List[typing.Dict[str, typing.Any]], baseline: typing.Dict[tuple, dict]):
+    print('{:8} {:>6} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+        'renderer', 'time', 'height', 'update ms', 'p95', 'paint ms', 'p95', 'peak kB', 'retained B'))
+    for result in results:
+        print('{:8} {:6} {:6} {:10.3f} {:10.3f} {:10.3f} {:10.3f} {:10.1f} {:12.1f}'.format(
+            result['renderer'], result['graph_time'], result['graph_height'],
+            result['update_ms_median'], result['update_ms_p95'], result['paint_ms_median'], result['paint_ms_p95'],
+            result['alloc_peak_kb_median'], result['alloc_retained_b_per_update']))
+        base = baseline.get(get_key(result))
+        if base:
+            print('{:22} {:>10} {:>10} {:>10} {:>10}'.format('', *(
+                '{:+.0%}'.format(result[name] / base[name] - 1) if base[name] else '-'
+                for name in ('update_ms_median', 'update_ms_p95', 'paint_ms_median', 'paint_ms_p95'))))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='bench_ui', description='Offscreen benchmark of the panel update and paint with synthetic snapshots')
+    parser.add_argument('--graph_time', type=int, nargs='+', default=[600, 3600], help='Total graph timeline sec')
+    parser.add_argument('--graph_height', type=int, nargs='+', default=[17, 40], help='Graph height pixels')
+    parser.add_argument('--renderer', type=str, nargs='+', default=['plot', 'strip'], choices=('plot', 'strip'))
+    parser.add_argument('--cpu-heatmap', action='store_true', help='Per core heatmap under the cpu graph.')
+    parser.add_argument('--cores', type=int, default=16, help='Cores of the synthetic heatmap.')
+    parser.add_argument('-p', '--period', type=float, default=2.0, help='Synthetic time step of an update.')
+    parser.add_argument('-n', '--updates', type=int, default=1000, help='Measured updates per case.')
+    parser.add_argument('--alloc-updates', type=int, default=200, help='Updates traced for allocations per case.')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Append results as json lines.')
+    parser.add_argument('--compare', type=str, default=None, help='Json lines of a previous run to compare to.')
+    args = parser.parse_args()
+    common.log.init('ERROR', None)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = {get_key(result): result for result in map(json.loads, file)}
+
+    qInstallMessageHandler(on_qt_message)
+    app = QApplication(sys.argv)
+    versions = get_versions()
+    run_time = time.strftime('%Y-%m-%dT%H:%M:%S')
+    results = []
+    for renderer, graph_time, graph_height in itertools.product(args.renderer, args.graph_time, args.graph_height):
+        result = run_case(app, args, graph_time, graph_height, renderer)
+        result.update(versions, time=run_time)
+        results.append(result)
+
+    print(' '.join('{} {}'.format(name, version) for name, version in versions.items()))
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'a') as file:
+            for result in results:
+                file.write(json.dumps(result, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+import os
+import pathlib
+import re
+import time
+import typing
+
+import common
+
+
+CGROUP_PATH = pathlib.Path('/sys/fs/cgroup')
+CGROUP_HYBRID_PATH = CGROUP_PATH / 'unified'  # cgroup v2 tree on hybrid v1/v2 systems
+
+RESCAN_PERIOD_S = 30
+MAX_DEPTH = 6  # /user.slice/user-1000.slice/user@1000.service/app.slice/app-firefox.scope
+# io.stat and memory.pressure are read for the units with the most cpu, I/O and reclaim stalls take cpu of the unit
+DETAIL_SIZE = 8
+# cpu.stat and memory.current of every unit and the files of the detail units stay open in OpenFiles
+MAX_GROUPS = (common.OpenFiles.MAX_OPEN - 2 * DETAIL_SIZE) // 2
+UNIT_SUFFIXES = ('.service', '.scope', '.slice')
+TOP_SIZE = 2
+# memory.pressure some avg10 of the top unit shown from this percent
+MEMORY_PRESSURE_SHOW_PERCENT = 10
+
+
+class CgroupUnit:
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.name = short_unit_name(path.name)
+        self.is_slice = path.name.endswith('.slice')
+        self.usage_usec: typing.Optional[int] = None
+        self.io_bytes: typing.Optional[int] = None
+        self.io_time = 0.0
+
+        self.cpu_cores = 0.0
+        self.cpu_limit_cores: typing.Optional[float] = None
+        self.memory_gb = 0.0
+        self.io_mbps = 0.0
+        self.memory_some_avg10 = 0.0
+
+
+def short_unit_name(name: str) -> str:
+    # app-gnome-firefox-2345.scope -> firefox, user@1000.service -> user
+    name = re.sub(r'\.(service|scope|slice)$', '', name)
+    name = re.sub(r'^app-(gnome-|flatpak-|kde-)?', '', name)
+    name = re.sub(r'(@.*|-[0-9]+)$', '', name)
+    return name
+
+
+def read_cpu_limit(path: pathlib.Path) -> typing.Optional[float]:
+    # "max 100000" or "<quota> <period>"
+    try:
+        quota, period = (path / 'cpu.max').read_text().split()
+    except (OSError, ValueError):
+        return None
+    return int(quota) / int(period) if quota != 'max' else None
+
+
+def parse_keyed(data: str) -> typing.Dict[str, int]:
+    # "usage_usec 123\nuser_usec 100" or "rbytes=1 wbytes=2"
+    result = {}
+    for key, value in re.findall(r'([a-z_]+)[ =]([0-9]+)', data):
+        result[key] = result.get(key, 0) + int(value)
+    return result
+
+
+class Cgroups:
+    """CPU, memory and I/O of systemd services and scopes from cgroup v2 files, top consumers by delta."""
+
+    def __init__(self, cpu_count: int):
+        self.cpu_count = cpu_count
+        self.root = CGROUP_PATH if (CGROUP_PATH / 'cgroup.controllers').exists() else CGROUP_HYBRID_PATH
+        self.files = common.OpenFiles()
+        self.units: typing.Dict[pathlib.Path, CgroupUnit] = {}
+        self.detail_units: typing.List[CgroupUnit] = []
+        self.scan_time = 0.0
+        self.counters_time = time.monotonic()
+
+        self.top_cpu: typing.List[CgroupUnit] = []
+        self.top_slice: typing.Optional[CgroupUnit] = None
+        self.top_memory: typing.Optional[CgroupUnit] = None
+        self.top_io: typing.Optional[CgroupUnit] = None
+        self.top_pressure: typing.Optional[CgroupUnit] = None
+
+    def _scan(self):
+        found = []
+        stack = [(self.root, 0)]
+        while stack and len(found) < MAX_GROUPS:
+            path, depth = stack.pop()
+            if path.name.endswith(UNIT_SUFFIXES):
+                found.append(path)
+            if depth >= MAX_DEPTH:
+                continue
+            try:
+                stack.extend(
+                    (pathlib.Path(entry.path), depth + 1)
+                    for entry in os.scandir(path) if entry.is_dir(follow_symlinks=False))
+            except OSError as e:
+                common.log.debug('cgroup scan error', path, e)
+
+        # slices and leaf units, user@1000.service is accounted in its scopes and its slice
+        parents = {parent for path in found for parent in path.parents}
+        units = {path: self.units.get(path) or CgroupUnit(path)
+                 for path in found if path not in parents or path.name.endswith('.slice')}
+
+        # a limit of a parent caps all of its children, read once per scan
+        limits = {}
+        for path, unit in units.items():
+            unit_limits = []
+            for parent in [path] + [parent for parent in path.parents if self.root in parent.parents]:
+                if parent not in limits:
+                    limits[parent] = read_cpu_limit(parent)
+                if limits[parent] is not None:
+                    unit_limits.append(limits[parent])
+            unit.cpu_limit_cores = min(unit_limits, default=None)
+
+        self.units = units
+        self.detail_units = [unit for unit in self.detail_units if unit.path in units]
+        self.files.retain(
+            [path / name for path in units for name in ('cpu.stat', 'memory.current')] +
+            [unit.path / name for unit in self.detail_units for name in ('io.stat', 'memory.pressure')])
+        common.log.debug('cgroup units', len(units), found=len(found))
+
+    def calculate(self, now: float):
+        if now - self.scan_time >= RESCAN_PERIOD_S:
+            self.scan_time = now
+            self._scan()
+
+        time_diff = now - self.counters_time
+        self.counters_time = now
+
+        for unit in self.units.values():
+            self._calculate_unit(unit, time_diff)
+
+        # a slice contains its units, it is only compared to other slices
+        units = [unit for unit in self.units.values() if not unit.is_slice]
+        slices = [unit for unit in self.units.values() if unit.is_slice]
+        units.sort(key=lambda u: u.cpu_cores, reverse=True)
+        self._set_detail_units(units[:DETAIL_SIZE])
+        for unit in self.detail_units:
+            self._calculate_detail(unit, now)
+
+        self.top_cpu = units[:TOP_SIZE]
+        self.top_slice = max(slices, key=lambda u: u.cpu_cores, default=None)
+        self.top_memory = max(units, key=lambda u: u.memory_gb, default=None)
+        self.top_io = max(units, key=lambda u: u.io_mbps, default=None)
+        self.top_pressure = max(units, key=lambda u: u.memory_some_avg10, default=None)
+
+    def _calculate_unit(self, unit: CgroupUnit, time_diff: float):
+        cpu_stat = self.files.read(unit.path / 'cpu.stat')
+        usage_usec = parse_keyed(cpu_stat).get('usage_usec') if cpu_stat else None
+        if usage_usec is not None and unit.usage_usec is not None and time_diff > 0:
+            unit.cpu_cores = max(usage_usec - unit.usage_usec, 0) / time_diff / 1000000
+        unit.usage_usec = usage_usec
+
+        memory_current = self.files.read_int(unit.path / 'memory.current')
+        unit.memory_gb = memory_current / 1024 / 1024 / 1024 if memory_current else 0.0
+
+    def _set_detail_units(self, units: typing.List[CgroupUnit]):
+        for unit in self.detail_units:
+            if unit not in units:
+                self.files.forget(unit.path / 'io.stat')
+                self.files.forget(unit.path / 'memory.pressure')
+                unit.io_mbps = 0.0
+                unit.memory_some_avg10 = 0.0
+        self.detail_units = units
+
+    def _calculate_detail(self, unit: CgroupUnit, now: float):
+        io_stat = self.files.read(unit.path / 'io.stat')
+        if io_stat is not None:
+            io = parse_keyed(io_stat)
+            io_bytes = io.get('rbytes', 0) + io.get('wbytes', 0)
+            # a unit back in the detail units gets the average since its last read
+            if unit.io_bytes is not None and now > unit.io_time:
+                unit.io_mbps = max(io_bytes - unit.io_bytes, 0) / (now - unit.io_time) / 1024 / 1024
+            unit.io_bytes = io_bytes
+            unit.io_time = now
+
+        memory_pressure = self.files.read(unit.path / 'memory.pressure')
+        match = re.search(r'avg10=([0-9.]+)', memory_pressure) if memory_pressure else None
+        if match:
+            unit.memory_some_avg10 = float(match.group(1))
+
+    def get_utilisation(self, unit: CgroupUnit) -> float:
+        # share of the cpu the unit is allowed to use
+        available_cores = min(unit.cpu_limit_cores or self.cpu_count, self.cpu_count)
+        return unit.cpu_cores / available_cores
+
+    def stop(self):
+        self.files.close()
+
+    def __str__(self):
+        top_cpu = self.top_cpu + [None] * (TOP_SIZE - len(self.top_cpu))
+        top_pressure = self.top_pressure
+        if top_pressure and top_pressure.memory_some_avg10 < MEMORY_PRESSURE_SHOW_PERCENT:
+            top_pressure = None
+        return '[{} {} {} {}{}]'.format(
+            ' '.join(
+                '{}{}/{:10}'.format(
+                    common.convert_4(unit.cpu_cores),
+                    '!' if unit.cpu_limit_cores and self.get_utilisation(unit) > 0.9 else ' ',
+                    unit.name[:10],
+                ) if unit else '{:3}  {:10}'.format('', '') for unit in top_cpu
+            ),
+            '{}/{:8}'.format(common.convert_4(self.top_slice.cpu_cores), self.top_slice.name[:8])
+            if self.top_slice else '',
+            '{}/{:8}'.format(common.convert_4(self.top_io.io_mbps), self.top_io.name[:8]) if self.top_io else '',
+            '{}G/{:8}'.format(common.convert_4(self.top_memory.memory_gb), self.top_memory.name[:8])
+            if self.top_memory else '',
+            ' P{}%/{:8}'.format(common.convert_4(top_pressure.memory_some_avg10), top_pressure.name[:8])
+            if top_pressure else '',
+        )
@@ -0,0 +1,67 @@
+import pathlib
+import signal
+import threading
+
+import common
+import hard_monitor
+import profiler
+import sampling
+import segments
+import query
+import snapshot
+import tsdb
+
+
+def main():
+    args = common.init()
+    name = args.snapshot or common.SNAPSHOT_NAME
+
+    stopping = threading.Event()
+    wakeup = threading.Event()
+
+    def stop(signum, frame):
+        stopping.set()
+        wakeup.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    profiler.Profiler(args.savefile, args.profile_s).install()
+
+    monitor = hard_monitor.HardMonitor(
+        args.period, disabled=args.disable, savefile=args.savefile, source_timeout_s=args.source_timeout)
+    monitor.add_wakeup_listener(wakeup.set)
+    writer = snapshot.SnapshotWriter(name, args.period)
+    history = tsdb.History(segments.FIELDS, args.history_days * 24 * 3600) if args.history_days else None
+    query_server = None
+    if history and args.query_socket:
+        query_server = query.QueryServer(history, pathlib.Path(args.query_socket))
+    if query_server:
+        query_server.start()
+    adaptive_period = sampling.AdaptivePeriod(args.period) if args.adaptive else None
+    ticker = sampling.Ticker(args.period)
+    if not monitor.load_json(args.savefile):
+        monitor.update_counters(ticker.tick())
+        stopping.wait(ticker.get_timeout())
+
+    common.log.info('collector started', name)
+    while not stopping.is_set():
+        info = monitor.get_info(ticker.tick())
+        writer.publish(info)
+        if history:
+            history.append(info.get_time(), writer.values.tolist())
+        if adaptive_period:
+            writer.period_s = adaptive_period.update(info)
+            ticker.set_period(writer.period_s)
+        wakeup.wait(ticker.get_timeout())
+        wakeup.clear()
+
+    common.log.info('collector stopped', name, history=history)
+    if query_server:
+        query_server.stop()
+    monitor.save_json(args.savefile)
+    monitor.stop()
+    writer.close()
+
+
+if __name__ == '__main__':
+    main()
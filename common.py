@@ -1,8 +1,13 @@
 import argparse
+import contextlib
+import errno
+import importlib
 import logging
 import os
 import pathlib
 import signal
+import sys
+import time
 from logging.handlers import SysLogHandler
 
 import typing
@@ -53,6 +58,117 @@ class log:
         log._log_call('error', *args, **kwargs)
 
 
+class startup_profile:
+    BUDGET_S = 0.3
+    enabled = False
+    records: typing.List[typing.Tuple[str, float]] = []
+
+    @staticmethod
+    @contextlib.contextmanager
+    def measure(name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            startup_profile.records.append((name, time.perf_counter() - start))
+
+    @staticmethod
+    def get_process_age_s() -> float:
+        # starttime of /proc/self/stat is in clock ticks since boot
+        try:
+            with open('/proc/self/stat', 'r') as file:
+                start_ticks = int(file.read().rsplit(')', 1)[1].split()[19])
+            return time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf('SC_CLK_TCK')
+        except Exception as e:
+            log.error(e)
+        return 0
+
+    @staticmethod
+    def report(event: str):
+        if not startup_profile.enabled:
+            return
+        for name, duration_s in startup_profile.records:
+            log.info('startup', name, '{:.1f} ms'.format(duration_s * 1000))
+        startup_profile.records = []
+
+        age_s = startup_profile.get_process_age_s()
+        log_c = log.info if age_s <= startup_profile.BUDGET_S else log.error
+        log_c('startup', event, '{:.1f} ms since process start'.format(age_s * 1000),
+              budget='{:.0f} ms'.format(startup_profile.BUDGET_S * 1000))
+
+
+class OpenFiles:
+    """
+    sysfs, procfs and cgroupfs files kept open and re-read with pread from offset 0.
+    At most max_open files per collector stay open, the rest are opened for every read, so all collectors together
+    stay well under the usual RLIMIT_NOFILE of 1024.
+    """
+    BUFFER_SIZE = 4096
+    MAX_OPEN = 128
+
+    def __init__(self, max_open: int = MAX_OPEN):
+        self.max_open = max_open
+        self.fds: typing.Dict[pathlib.Path, int] = {}
+        # files the driver does not provide are not tried again until close
+        self.missing: typing.Set[pathlib.Path] = set()
+
+    def read(self, path: pathlib.Path, size: int = BUFFER_SIZE) -> typing.Optional[str]:
+        if path in self.missing:
+            return None
+        try:
+            fd = self.fds.get(path)
+            if fd is not None:
+                return os.pread(fd, size, 0).decode()
+            fd = os.open(path, os.O_RDONLY)
+            if len(self.fds) < self.max_open:
+                self.fds[path] = fd
+                return os.pread(fd, size, 0).decode()
+            try:
+                return os.pread(fd, size, 0).decode()
+            finally:
+                os.close(fd)
+        except FileNotFoundError:
+            self.missing.add(path)
+        except OSError as e:
+            if e.errno == errno.EMFILE:
+                log.error('read error', path, e)
+            else:
+                log.debug('read error', path, e)
+            self.forget(path)
+        return None
+
+    def read_int(self, path: pathlib.Path) -> typing.Optional[int]:
+        data = self.read(path)
+        try:
+            return int(data) if data is not None else None
+        except ValueError:
+            return None
+
+    def forget(self, path: pathlib.Path):
+        fd = self.fds.pop(path, None)
+        if fd is not None:
+            os.close(fd)
+
+    def retain(self, paths: typing.Iterable[pathlib.Path]):
+        # close files of removed devices and groups
+        paths = set(paths)
+        for path in [path for path in self.fds if path not in paths]:
+            self.forget(path)
+        self.missing &= paths
+
+    def close(self):
+        self.retain(())
+
+
+def import_module(name: str):
+    # lazy import of optional or heavy modules on first use
+    module = sys.modules.get(name)
+    if module is None:
+        with startup_profile.measure('import {}'.format(name)):
+            module = importlib.import_module(name)
+    return module
+
+
 def object_to_str(obj) -> str:
     return '{}: {}'.format(
         type(obj).__name__,
@@ -62,11 +178,19 @@ def object_to_str(obj) -> str:
 
 PID_FILE = pathlib.Path('/tmp/hard_monitor_ui_default')
 SAVE_FILE = pathlib.Path('/tmp/hard_monitor_default.json')
+SNAPSHOT_NAME = 'hard_monitor'
+QUERY_SOCKET = pathlib.Path('/tmp/hard_monitor.sock')
+
+# sources which can be turned off with --disable, disabled sources are not imported or started
+OPTIONAL_SOURCES = ('bluetooth', 'ping', 'wlan', 'top_process', 'pressure', 'cgroup', 'gpu', 'energy', 'throttle',
+                    'protocol', 'anomaly', 'nettop')
 
 
 def init():
     parser = argparse.ArgumentParser(prog='hard_monitor', description='Show hardware monitor')
     parser.add_argument('-p', '--period', type=float, default=2.0, help='Timeout for collecting counters.')
+    parser.add_argument('-a', '--adaptive', action='store_true',
+                        help='Stretch period while idle or on battery, shrink it on activity and alarms.')
     parser.add_argument('-f', '--pidfile', type=pathlib.Path, default=None, help='File to save pid.')
     parser.add_argument('-s', '--savefile', type=pathlib.Path, default=SAVE_FILE, help='File to save prev results.')
     parser.add_argument('-l', '--log', type=str, default='INFO', help='Log level.')
@@ -76,10 +200,33 @@ def init():
     parser.add_argument('-g', '--graph_height', type=int, default=17, help='Location height of graph pixels')
     parser.add_argument('-t', '--graph_time', type=int, default=600, help='Total graph timeline sec')
     parser.add_argument('-d', '--graph_debug', action='store_true', help='Debug output for graph')
+    parser.add_argument('--cpu-heatmap', action='store_true',
+                        help='Per core load heatmap under the cpu graph of the plot renderer.')
+    parser.add_argument('--renderer', type=str, default='plot', choices=('plot', 'strip'),
+                        help='Graphs of ui.py: pyqtgraph plot per label or one painted strip for all labels.')
     parser.add_argument('-c', '--count', type=int, default=0, help='Repeat output.')
+    parser.add_argument('--source-timeout', type=float, default=None,
+                        help='Deadline of one collector source per tick, half of the period by default.')
+    parser.add_argument('--disable', type=str, nargs='*', default=[], choices=OPTIONAL_SOURCES,
+                        help='Sources to skip.')
+    parser.add_argument('--snapshot', type=str, nargs='?', default=None, const=SNAPSHOT_NAME,
+                        help='Shared memory snapshot name. collector.py publishes to it, '
+                             'ui.py and main.py read it instead of collecting.')
+    parser.add_argument('--sparkline', type=str, default='block', choices=('block', 'braille'),
+                        help='Sparkline glyphs of tui.py. Braille packs 2 samples per cell.')
+    parser.add_argument('--history-days', type=float, default=7,
+                        help='Compressed history of snapshot fields kept in collector.py memory, 0 to disable.')
+    parser.add_argument('--query-socket', type=str, default=str(QUERY_SOCKET),
+                        help='Unix socket of collector.py for history queries, empty to disable.')
+    parser.add_argument('--profile-s', type=float, default=30,
+                        help='Duration of the stack sampling started by SIGUSR1, written next to the savefile.')
+    parser.add_argument('--no-notify', action='store_true', help='Show alarms without desktop notifications.')
+    parser.add_argument('--startup-profile', action='store_true',
+                        help='Log import and init time per module until first output.')
     args = parser.parse_args()
 
     log.init(args.log, args.logfile)
+    startup_profile.enabled = args.startup_profile
 
     current_pid = os.getpid()
     log.info('init 0xff00f1f1. current pid', current_pid)
@@ -124,7 +271,12 @@ def convert_2_1(value: float) -> str:
     return '{:4}'.format(round(value if value < 100 else 99.9, 1))
 
 
-def create_temp_alarm(name: str, temp: float, limit: float) -> typing.Optional[str]:
-    if temp >= limit:
-        return '{} crit t {:2}/{:2} °C'.format(name, round(temp), round(limit))
-    return None
+class Alarm:
+    def __init__(self, name: str, message: str):
+        # name identifies the alarm source between ticks, message can change every tick
+        self.name = name
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
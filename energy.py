@@ -0,0 +1,168 @@
+import pathlib
+import time
+import typing
+
+import psutil
+
+import common
+
+
+POWERCAP_PATH = pathlib.Path('/sys/class/powercap')
+# bigger power is a counter reset (reboot, restore of old counters), not a real reading
+MAX_POWER_W = 1000
+PROCESS_SHARE_PERIOD_S = 10
+TOP_SIZE = 1
+
+
+class EnergyZone:
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        # package-0, core, uncore, dram, psys
+        self.name = (path / 'name').read_text().strip()
+        self.max_energy_range_uj = int((path / 'max_energy_range_uj').read_text())
+
+        self.energy_uj: typing.Optional[int] = None
+        self.power_w = 0.0
+        self.total_wh = 0.0
+
+    def calculate(self, files: common.OpenFiles, time_diff: float) -> float:
+        """Add the energy since the previous reading, return it in joules."""
+        energy_uj = files.read_int(self.path / 'energy_uj')
+        if energy_uj is None:
+            return 0.0
+        energy_prev_uj = self.energy_uj
+        self.energy_uj = energy_uj
+        if energy_prev_uj is None or time_diff <= 0:
+            return 0.0
+
+        delta_uj = energy_uj - energy_prev_uj
+        if delta_uj < 0:
+            # counter wraps at max_energy_range_uj
+            delta_uj += self.max_energy_range_uj + 1
+
+        power_w = delta_uj / time_diff / 1000000
+        if power_w > MAX_POWER_W:
+            common.log.info('energy counter reset', self.name, power_w)
+            return 0.0
+
+        self.power_w = power_w
+        self.total_wh += delta_uj / 1000000 / 3600
+        return delta_uj / 1000000
+
+
+class Energy:
+    """RAPL powercap zones and subzones with wraparound correction and Wh totals."""
+
+    def __init__(self):
+        self.files = common.OpenFiles()
+        self.zones: typing.Dict[str, EnergyZone] = {}
+        # intel-rapl:0 is the package, intel-rapl:0:0 is its core subzone, AMD zen exposes the same files
+        for path in sorted(POWERCAP_PATH.glob('intel-rapl:*')):
+            try:
+                zone = EnergyZone(path)
+            except (OSError, ValueError) as e:
+                common.log.error('energy zone error', path, e)
+                continue
+            self.zones[path.name] = zone
+            common.log.info('energy zone', path.name, zone.name)
+        if not self.zones:
+            common.log.error('energy zones not found', POWERCAP_PATH)
+
+        self.counters_time = time.monotonic()
+
+        self.package_w = 0.0
+        self.core_w = 0.0
+        self.uncore_w = 0.0
+        self.dram_w = 0.0
+        self.psys_w = 0.0
+        self.total_wh = 0.0
+
+        # energy share of processes by cpu time
+        self.process_times: typing.Dict[int, float] = {}
+        self.busy_time = 0.0
+        self.process_time = 0.0
+        self.process_energy_j = 0.0
+        self.top_process_list: typing.List[typing.Tuple[str, float]] = []
+
+    def calculate(self, now: float):
+        counters_time_prev = self.counters_time
+        self.counters_time = now
+        time_diff = self.counters_time - counters_time_prev
+
+        package_j = 0.0
+        for zone in self.zones.values():
+            energy_j = zone.calculate(self.files, time_diff)
+            if zone.name.startswith('package'):
+                package_j += energy_j
+
+        def get_power_w(prefix: str) -> float:
+            return sum(zone.power_w for zone in self.zones.values() if zone.name.startswith(prefix))
+
+        self.package_w = get_power_w('package')
+        self.core_w = get_power_w('core')
+        self.uncore_w = get_power_w('uncore')
+        self.dram_w = get_power_w('dram')
+        self.psys_w = get_power_w('psys')
+        self.total_wh = sum(zone.total_wh for zone in self.zones.values() if zone.name.startswith('package'))
+
+        self.process_energy_j += package_j
+        if self.counters_time - self.process_time >= PROCESS_SHARE_PERIOD_S:
+            self._calculate_process_share()
+
+    def _calculate_process_share(self):
+        process_time_prev = self.process_time
+        self.process_time = self.counters_time
+        energy_j = self.process_energy_j
+        self.process_energy_j = 0.0
+
+        busy_time_prev = self.busy_time
+        cpu_times = psutil.cpu_times()
+        self.busy_time = sum(v for k, v in cpu_times._asdict().items() if k not in ('idle', 'iowait'))
+        busy_diff = self.busy_time - busy_time_prev
+
+        process_times_prev = self.process_times
+        self.process_times = {}
+        power_by_name: typing.Dict[str, float] = {}
+        interval_s = self.process_time - process_time_prev
+        for proc in psutil.process_iter(['name', 'cpu_times']):
+            cpu_times = proc.info['cpu_times']
+            if cpu_times is None:
+                continue
+            process_time = cpu_times.user + cpu_times.system
+            self.process_times[proc.pid] = process_time
+            if proc.pid not in process_times_prev or busy_diff <= 0 or not process_time_prev:
+                continue
+            share = (process_time - process_times_prev[proc.pid]) / busy_diff
+            if share > 0:
+                name = proc.info['name']
+                power_by_name[name] = power_by_name.get(name, 0) + share * energy_j / interval_s
+
+        self.top_process_list = sorted(power_by_name.items(), key=lambda p: p[1], reverse=True)[:TOP_SIZE]
+
+    def load(self, dump: typing.Dict[str, typing.Any], counters_time: float, same_boot: bool):
+        for name, zone_dump in dump.items():
+            zone = self.zones.get(name)
+            if zone:
+                # a counter of another boot is smaller and would pass as a wraparound
+                if same_boot:
+                    zone.energy_uj = zone_dump['energy_uj']
+                zone.total_wh = zone_dump['total_wh']
+        self.counters_time = counters_time
+
+    def dump(self) -> typing.Dict[str, typing.Any]:
+        return {
+            name: {'energy_uj': zone.energy_uj, 'total_wh': zone.total_wh}
+            for name, zone in self.zones.items()
+        }
+
+    def stop(self):
+        self.files.close()
+
+    def __str__(self):
+        top_process_list = self.top_process_list + [('', 0)] * (TOP_SIZE - len(self.top_process_list))
+        return '[{} {} W {} Wh {}]'.format(
+            common.convert_2(self.core_w),
+            common.convert_2(self.dram_w),
+            common.convert_4(self.total_wh),
+            ' '.join('{}/{:8}'.format(common.convert_4(power_w), name[:8]) for name, power_w in top_process_list),
+        )
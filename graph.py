@@ -1,23 +1,24 @@
-import copy
-
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QRectF
 from PyQt5.QtWidgets import *
-from PyQt5.QtGui import QFont, QMouseEvent
+from PyQt5.QtGui import QFont, QMouseEvent, QBrush
 
 import math
+import typing
 
 import numpy as np
 import pyqtgraph as pg
 
 import common
 import hard_monitor
-import network
+import labels
 
 FONT_SIZE = 10
 TRANSPARENCY = 0.7
 GRAPH_TR = 0.5
 
-BATTERY_DUR_MULTIPLIER = 6  # 10min * 6
+# idle cores are transparent, busy cores go from yellow to red
+HEATMAP_LUT = np.array(
+    [(255, 255 - i // 2, 0, round(i * TRANSPARENCY)) for i in range(256)], dtype=np.uint8)
 
 
 def create_widget() -> QWidget:
@@ -35,36 +36,133 @@ def create_empty_label(size_symbols: int, trans: float = TRANSPARENCY):
     return label
 
 
-class Plot:
-    def __init__(self, impl: pg.PlotDataItem, x: np.array, accum_size: int, y_min):
-        self.impl = impl
-        self.x = x
-        self.accum_size = accum_size
+class Envelope:
+    """
+    Min/max/mean of the samples per column, columns are time slots of total_time_s / columns.
+    Samples are aligned to time so any sample spacing is correct.
+    """
 
-        self.values = []
+    def __init__(self, y_min, total_time_s: float):
         self.y_min = y_min
-        self.y = np.full(np.size(self.x), self.y_min)
+        self.total_time_s = total_time_s
 
-    def add_value(self, value):
-        self.values.append(value)
+        # time slot of the last column
+        self.column: typing.Optional[int] = None
+        self.column_s = 0.0
+        self.y_low = np.empty(0)
+        self.y_high = np.empty(0)
+        self.y_sum = np.empty(0)
+        self.y_count = np.empty(0)
+
+    def get_columns(self) -> int:
+        return np.size(self.y_high)
+
+    def _set_columns(self, columns: int):
+        self.column_s = self.total_time_s / columns
+        self.column = None
+
+    def resize(self, columns: int):
+        size = self.get_columns()
+        if size == 0:
+            self.override_all_y(self.y_min, columns)
+            return
+        elif columns <= size:
+            # merge neighbour columns
+            starts = np.arange(columns) * size // columns
+            self.y_low = np.minimum.reduceat(self.y_low, starts)
+            self.y_high = np.maximum.reduceat(self.y_high, starts)
+            self.y_sum = np.add.reduceat(self.y_sum, starts)
+            self.y_count = np.add.reduceat(self.y_count, starts)
+        else:
+            # split columns, every part keeps the envelope and the mean
+            index = np.arange(columns) * size // columns
+            y_mean = self.get_mean()
+            self.y_low = self.y_low[index]
+            self.y_high = self.y_high[index]
+            self.y_sum = y_mean[index]
+            self.y_count = np.ones(columns)
+        self._set_columns(columns)
+
+    def add_value(self, value, t: float) -> bool:
+        # returns True when a new column is started and the finished one can be rendered
+        value = max(value, self.y_min)
+        column = int(t // self.column_s)
+        shifted = self.column is not None and column > self.column
+        if shifted:
+            shift = min(column - self.column, self.get_columns())
+            # scroll in place, columns without samples (long period, suspend) hold the last mean
+            y_mean = self.y_sum[-1] / self.y_count[-1]
+            for y in (self.y_low, self.y_high, self.y_sum, self.y_count):
+                y[:-shift] = y[shift:]
+            self.y_low[-shift:] = y_mean
+            self.y_high[-shift:] = y_mean
+            self.y_sum[-shift:] = y_mean
+            self.y_count[-shift:] = 1
+
+            self.y_low[-1] = value
+            self.y_high[-1] = value
+            self.y_sum[-1] = value
+            self.y_count[-1] = 1
+        else:
+            self.y_low[-1] = min(self.y_low[-1], value)
+            self.y_high[-1] = max(self.y_high[-1], value)
+            self.y_sum[-1] += value
+            self.y_count[-1] += 1
+
+        if self.column is None or column > self.column:
+            self.column = column
+        return shifted
+
+    def get_mean(self) -> np.ndarray:
+        return self.y_sum / self.y_count
 
-        if len(self.values) >= self.accum_size:
-            y_value = max(sum(self.values) / self.accum_size, self.y_min)
-            self.y = np.append(self.y, y_value)
-            self.y = np.delete(self.y, 0)
-            self.impl.setData(x=self.x, y=self.y)
+    def get_y_max(self, initial):
+        return self.y_high.max(initial=initial)
+
+    def override_all_y(self, y_value, columns: int):
+        self.y_low = np.full(columns, y_value, dtype=float)
+        self.y_high = np.full(columns, y_value, dtype=float)
+        self.y_sum = np.full(columns, y_value, dtype=float)
+        self.y_count = np.ones(columns)
+        self._set_columns(columns)
 
-            self.values = []
+
+class Plot:
+    """
+    Envelope with one column per pixel of the graph width.
+    The filled max keeps every spike visible with any timeline length, the mean is drawn over it.
+    """
+
+    def __init__(self, graph: 'Graph', max_impl: pg.PlotDataItem, mean_impl: pg.PlotDataItem, y_min):
+        self.graph = graph
+        self.max_impl = max_impl
+        self.mean_impl = mean_impl
+        self.envelope = Envelope(y_min, graph.config.total_time_s)
+        self.override_all_y(y_min)
+
+    def add_value(self, value, t: float):
+        columns = self.graph.get_columns()
+        if columns != self.envelope.get_columns():
+            self.envelope.resize(columns)
+
+        # render only finished columns
+        if self.envelope.add_value(value, t):
+            self._render()
+
+    def _render(self):
+        self.max_impl.setData(x=self.graph.x, y=self.envelope.y_high)
+        self.mean_impl.setData(x=self.graph.x, y=self.envelope.get_mean())
 
     def get_y_max(self, initial):
-        return self.y.max(initial=initial)
+        return self.envelope.get_y_max(initial)
 
     def set_fill_level(self, fill_level):
-        self.impl.setFillLevel(fill_level)
+        self.max_impl.setFillLevel(fill_level)
+        self.mean_impl.setFillLevel(fill_level)
 
     def override_all_y(self, y_value):
-        self.y = np.full(np.size(self.x), y_value)
-        self.impl.setData(x=self.x, y=self.y)
+        self.envelope.override_all_y(y_value, self.graph.get_columns())
+        self._render()
 
 
 class GraphConfig:
@@ -75,13 +173,15 @@ class GraphConfig:
             accum_size: int = 2,
             total_time_s: int = 600,
             y_min: float=0.0001,
-            debug: bool = False):
+            debug: bool = False,
+            cpu_heatmap: bool = False):
         self.period_s = period_s
         self.graph_height = graph_height
         self.accum_size = accum_size
         self.total_time_s = total_time_s
         self.y_min = y_min
         self.debug = debug
+        self.cpu_heatmap = cpu_heatmap
         common.log.info(common.object_to_str(self))
 
 
@@ -98,17 +198,30 @@ class Graph:
         self.y_range_max = None
 
     def create_plot(self, fill=pg.mkBrush(255, 0, 0, 255 * GRAPH_TR), fill_level=0) -> Plot:
-        x = []
-        y = []
-
-        plot_impl: pg.PlotDataItem = self.impl.plot(
-            x=x,
-            y=y,
-            pen=pg.mkPen(0, 0, 0, 0),
-            fillBrush=fill,
-            fillLevel=fill_level,
-        )
-        return Plot(plot_impl, self.x, self.config.accum_size, self.config.y_min)
+        # peaks are drawn with half of the mean transparency
+        peak_fill = QBrush(fill)
+        peak_color = peak_fill.color()
+        peak_color.setAlpha(peak_color.alpha() // 2)
+        peak_fill.setColor(peak_color)
+
+        max_impl, mean_impl = [
+            self.impl.plot(
+                x=[],
+                y=[],
+                pen=pg.mkPen(0, 0, 0, 0),
+                fillBrush=brush,
+                fillLevel=fill_level,
+            ) for brush in (peak_fill, fill)
+        ]
+        return Plot(self, max_impl, mean_impl, self.config.y_min)
+
+    def get_columns(self) -> int:
+        # one column per pixel of the plot area once the widget is laid out
+        width = int(self.impl.getViewBox().width())
+        if width >= 2 and width != np.size(self.x):
+            self.x = np.arange(0, width, dtype=int)
+            self.impl.getViewBox().setXRange(self.x[0], self.x[-1], padding=0)
+        return np.size(self.x)
 
     # def set_x_range(self):
     #     self.impl.getViewBox().setXRange(self.x[0], self.x[-1], padding=0)
@@ -199,119 +312,75 @@ class Label:
     def update(self, text: str):
         self.impl.setText(text)
 
-
-class DefaultLabel:
-    def __init__(self, *args, **kwargs):
-        self.label = Label(*args, **kwargs)
-        self.label.update_y_range(0, 0)
-
-    def update(self, info):
-        self.label.update(str(info))
-
-
-class Cpu:
-    def __init__(self, *args, **kwargs):
-        self.label = Label(*args, **kwargs)
-        self.plot = self.label.graph.create_plot()
-
-    def update(self, cpu: hard_monitor.Cpu):
-        self.label.update(str(cpu))
-        self.label.update_y_range(0, cpu.cpu_count)
-        self.plot.add_value(cpu.loadavg_current)
-
-
-class Memory:
-    def __init__(self, *args, **kwargs):
-        self.label = Label(*args, **kwargs)
-        # self.cache_plot = self.label.graph.create_plot(fill=pg.mkBrush(255, 255, 0, 255 * GRAPH_TR / 3))
-        self.used_plot = self.label.graph.create_plot()
-
-    def update(self, memory: hard_monitor.Memory):
-        self.label.update(str(memory))
-        if self.label.update_y_range(0, memory.total_gb):
-            # self.cache_plot.override_all_y(memory.used_gb + memory.cached_gb + memory.buffers_gb)
-            self.used_plot.override_all_y(memory.used_gb)
-        self.used_plot.add_value(memory.used_gb)
-        # self.cache_plot.add_value(memory.used_gb + memory.cached_gb + memory.buffers_gb)
-
-
-class Gpu:
-    def __init__(self, *args, **kwargs):
-        self.label = Label(*args, **kwargs)
-        self.plot = self.label.graph.create_plot()
-
-        self.power_average_max_w = 0
-
-    def update(self, gpu: hard_monitor.Gpu):
-        self.label.update(str(gpu))
-
-        # power1_cap_w can show invalid value
-        self.power_average_max_w = max(gpu.power1_cap_w, gpu.power1_average_w, self.power_average_max_w)
-        self.label.update_y_range(0, self.power_average_max_w)
-        self.plot.add_value(gpu.power1_average_w)
-
-
-class Network:
-    def __init__(self, *args, **kwargs):
-        self.label = Label(*args, **kwargs)
-
-        y_min = -1  # 0.1 mbps
-        y_max = 1.3  # 20 mbps
-        self.label.set_log_mode(y=True)
-        self.label.update_y_range(y_min, y_max)
-        self.recv_plot = self.label.graph.create_plot(fill_level=y_min)
-        self.send_plot = self.label.graph.create_plot(
-            fill=pg.mkBrush(100, 100, 255, 255 * GRAPH_TR),
-            fill_level=y_min)
-
-    def update(self, net: network.Network):
-        self.label.update(str(net))
-
-        self.recv_plot.add_value(net.recv_mbps)
-        self.send_plot.add_value(net.send_mbps)
-
-
-class Disk:
-    def __init__(self, *args, **kwargs):
-        self.label = Label(*args, **kwargs)
-
-        y_min = 0  # 1 mbps
-        y_max = 2  # 100 mbps
-        self.label.set_log_mode(y=True)
-        self.label.update_y_range(y_min, y_max)
-        self.write_plot = self.label.graph.create_plot(fill_level=y_min)
-        self.read_plot = self.label.graph.create_plot(
-            fill=pg.mkBrush(100, 100, 255, 255 * GRAPH_TR),
-            fill_level=y_min)
-
-    def update(self, disk: hard_monitor.Disk):
-        self.label.update(str(disk))
-
-        self.write_plot.add_value(disk.write_mbps)
-        self.read_plot.add_value(disk.read_mbps)
-
-
-class Battery:
-    def __init__(self, config: GraphConfig):
-        config.accum_size = config.accum_size * BATTERY_DUR_MULTIPLIER
-        config.total_time_s = config.total_time_s * BATTERY_DUR_MULTIPLIER
-
-        self.label = Label(config)
-        self.plot = self.label.graph.create_plot()
-
-        self.first_update = True
-
-    def update(self, battery: hard_monitor.Battery):
-        self.label.update(str(battery))
-
-        if self.label.update_y_range(0, battery.charge_full_wh):
-            self.plot.set_fill_level(battery.charge_full_wh)
-
-        if self.first_update:
-            self.plot.override_all_y(battery.charge_now_wh)
-            self.first_update = False
-
-        self.plot.add_value(battery.charge_now_wh)
+    def create_series(self, color=(255, 0, 0), fill_level=0) -> Plot:
+        return self.graph.create_plot(fill=pg.mkBrush(*color, 255 * GRAPH_TR), fill_level=fill_level)
+
+    def create_heatmap(self) -> 'Heatmap':
+        return Heatmap(self.graph)
+
+
+class Heatmap:
+    """
+    Load of every core over time in one ImageItem.
+    Cores are grouped to at most graph_height rows by their max, so the cost doesn't depend on the core count.
+    Columns are written twice into a ring of double width, the image is a view of the ring from the oldest column.
+    """
+
+    def __init__(self, graph: Graph):
+        self.graph = graph
+        self.impl = pg.ImageItem(axisOrder='row-major')
+        self.impl.setLookupTable(HEATMAP_LUT)
+        self.impl.setLevels((0, 255))
+        # under the load plot
+        self.impl.setZValue(-1)
+        graph.impl.addItem(self.impl)
+
+        self.ring = np.zeros((0, 0), dtype=np.uint8)
+        self.rows = 0
+        self.columns = 0
+        self.pos = 0
+        self.column: typing.Optional[int] = None
+        self.column_s = 0.0
+        self.y_max = 1
+
+    def _reset(self, rows: int, columns: int):
+        self.ring = np.zeros((rows, columns * 2), dtype=np.uint8)
+        self.rows = rows
+        self.columns = columns
+        self.pos = 0
+        self.column = None
+        self.column_s = self.graph.config.total_time_s / columns
+
+    def add_values(self, core_load_list: typing.Sequence[float], t: float, y_max: float):
+        columns = self.graph.get_columns()
+        rows = min(len(core_load_list), self.graph.config.graph_height)
+        if rows != self.rows or columns != self.columns:
+            self._reset(rows, columns)
+        self.y_max = y_max
+
+        starts = np.arange(rows) * len(core_load_list) // rows
+        values = np.maximum.reduceat(np.asarray(core_load_list), starts)
+        values = np.clip(values * 255, 0, 255).astype(np.uint8)
+
+        column = int(t // self.column_s)
+        shifted = self.column is None or column > self.column
+        if shifted:
+            # columns without samples stay empty
+            for _ in range(min(column - self.column, columns) if self.column is not None else 1):
+                self.pos = (self.pos + 1) % columns
+                self.ring[:, self.pos] = 0
+                self.ring[:, self.pos + columns] = 0
+            self.column = column
+
+        np.maximum(self.ring[:, self.pos], values, out=self.ring[:, self.pos])
+        self.ring[:, self.pos + columns] = self.ring[:, self.pos]
+        # the new column is drawn with its first sample
+        if shifted:
+            self._render()
+
+    def _render(self):
+        self.impl.setImage(self.ring[:, self.pos + 1:self.pos + 1 + self.columns], autoLevels=False)
+        self.impl.setRect(QRectF(0, 0, self.columns - 1, self.y_max))
 
 
 class GraphList:
@@ -324,28 +393,23 @@ class GraphList:
         self.graph_layout.setContentsMargins(0, 0, 0, 0)
         self.graph_layout.setAlignment(Qt.AlignLeft | Qt.AlignTop)
 
-        self.cpu = self._create_label(Cpu, first=True)
-        self.memory = self._create_label(Memory)
-        self.gpu = self._create_label(Gpu)
-        self.network = self._create_label(Network)
-        self.disk = self._create_label(Disk)
-        self.battery = self._create_label(Battery)
-        self.common = self._create_label(DefaultLabel)
-        self.top_process = self._create_label(DefaultLabel)
-
-    def _create_label(self, label_type, first=False):
-        if not first:
+        self.labels = labels.create_labels(self, config)
+
+    def create_view(self, config: GraphConfig, after: typing.Optional[Label] = None) -> Label:
+        """Labels are laid out in creation order, a label created after another one is placed right after it."""
+        if after:
+            index = next(i + 1 for i in range(self.graph_layout.count())
+                         if self.graph_layout.itemAt(i).layout() is after.stacked_layout)
+        else:
+            index = self.graph_layout.count()
+        if self.graph_layout.count():
             empty_label = create_empty_label(1, trans=0)
             empty_label.setFixedHeight(self.config.graph_height)
-            self.graph_layout.addWidget(empty_label, alignment=Qt.AlignLeft | Qt.AlignTop)
-        label = label_type(copy.deepcopy(self.config))
-        self.graph_layout.addLayout(label.label.stacked_layout)
+            self.graph_layout.insertWidget(index, empty_label, alignment=Qt.AlignLeft | Qt.AlignTop)
+            index += 1
+        label = Label(config)
+        self.graph_layout.insertLayout(index, label.stacked_layout)
         return label
 
     def update(self, info: hard_monitor.HardMonitorInfo):
-        for attr, value in info.__dict__.items():
-            if attr == 'alarms':
-                continue
-
-            label = getattr(self, attr)
-            label.update(value)
+        labels.update_labels(self.labels, info)
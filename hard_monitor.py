@@ -1,3 +1,4 @@
+import fcntl
 import logging
 import os
 import threading
@@ -7,29 +8,64 @@ import json
 import pathlib
 import typing
 import collections
-import sensors
 import datetime
-import netifaces
 import subprocess
 import locale
+import select
 
+import cgroup
 import common
+import energy
 import network
+import nettop
+import rules
+import sampling
+import watchdog
 
 
 BAT_PATH = pathlib.Path('/sys/class/power_supply/BAT1')
 
 CPU_TEMP_SENSOR_NAME = 'k10temp'  # DEBUG mode grep 'Sensor names'
 CPU_TEMP_CRIT_C = 90
-CPU_POWER_SENSOR_PATH = pathlib.Path('/sys/class/powercap/intel-rapl:0/energy_uj')
 
-GPU_DEVICE_ID = '0x7340'  # DEBUG mode grep 'GPU device'
-HWMON_PATH = pathlib.Path('/sys/class/hwmon/')
+DRM_PATH = pathlib.Path('/sys/class/drm')
+HWMON_PATH = pathlib.Path('/sys/class/hwmon')
+CPU_PATH = pathlib.Path('/sys/devices/system/cpu')
+
+THROTTLE_CRIT_EVENTS_PER_S = 1
+RETRANS_CRIT_PERCENT = 2
+LISTEN_OVERFLOWS_CRIT_PER_S = 1
+UDP_RCVBUF_ERRORS_CRIT_PER_S = 1
+PROTOCOL_CRIT_FOR_S = 30
+THROTTLE_CRIT_FOR_S = 30
 
 DISK_TEMP_SENSOR_NAME = 'nvme'  # DEBUG mode grep 'Sensor names'
 DISK_TEMP_CRIT_C = 70  # for WDC PC SN540 max temp is 80
 
+TEMP_ALARM_MESSAGE = '{name} crit t {value:2.0f}/{limit:2.0f} °C'
+TEMP_ALARM_HYSTERESIS_C = 5
+CPU_LOAD_CRIT_PERCENT = 95
+CPU_LOAD_CRIT_FOR_S = 300
+SWAP_GROWTH_CRIT_GB_PER_MIN = 0.1
+SWAP_GROWTH_WINDOW_S = 600
+
+PRESSURE_PATH = pathlib.Path('/proc/pressure')
+PRESSURE_RESOURCES = ('cpu', 'memory', 'io')
+# "<some|full> <stall us> <window us>", unprivileged triggers need a window multiple of 2 s
+PRESSURE_TRIGGERS = {
+    'cpu': 'some 500000 2000000',
+    'memory': 'some 200000 2000000',
+    'io': 'full 500000 2000000',
+}
+PRESSURE_ALARM_HOLD_S = 10
+
 PRINT_TO_LOG_PERIOD_S = 60
+SAVE_PERIOD_S = 300
+
+# watchdog sources of collectors updating their counters at the tick time
+COUNTER_SOURCES = ('energy', 'cpu', 'throttle', 'network', 'protocol', 'disk', 'gpu', 'cgroup', 'nettop')
+# watchdog sources returning a new object per tick
+PROBE_SOURCES = ('memory', 'battery', 'keyboard', 'top_process')
 
 
 def get_sensors_temperatures():
@@ -75,19 +111,24 @@ class Battery:
         )
 
 
+def get_busy_time(cpu_times) -> float:
+    return sum(v for k, v in cpu_times._asdict().items() if k != 'idle')
+
+
 class Cpu:
-    def __init__(self, period_s: float):
+    def __init__(self, period_s: float, energy_zones: typing.Optional[energy.Energy] = None):
         self.cpu_count = psutil.cpu_count()
 
         self.cpu_counters = psutil.cpu_times()
-        self.counters_time = time.time()
+        self.core_counters = psutil.cpu_times(percpu=True)
+        self.counters_time = time.monotonic()
 
         self.loadavg_current = 0
+        # busy part of every core 0.0-1.0
+        self.core_load_list: typing.List[float] = []
         self.loadavg_1m = 0
         self.temp_c = 0
 
-        self.alarm = None
-
         # take readings for graq list inside another thread to prevent any affects to cpy freq
         self.period_s = period_s
         self.stopping = threading.Event()
@@ -95,29 +136,37 @@ class Cpu:
         self.freq_list_theead.start()
         self.freq_list_ghz = []
 
-        self.power_uj_counter = 0
-        self.power_w = 0
+        # package power from rapl
+        self.energy = energy_zones
+
+    @property
+    def power_w(self) -> float:
+        # energy is polled concurrently with the cpu, its zones are read when the tick is done
+        return self.energy.package_w if self.energy else 0
 
     def stop(self):
         self.stopping.set()
+        self.freq_list_theead.join()
 
-    def calculate(self):
+    def calculate(self, now: float):
         cpu_counters_prev = self.cpu_counters
         counters_time_prev = self.counters_time
-        power_uj_counter_prev = self.power_uj_counter
+
+        core_counters_prev = self.core_counters
 
         self.cpu_counters = psutil.cpu_times()
-        self.power_uj_counter = self._get_power_uj_counter()
-        self.counters_time = time.time()
+        self.core_counters = psutil.cpu_times(percpu=True)
+        self.counters_time = now
 
         time_diff = self.counters_time - counters_time_prev
 
-        cpu_counters_sum_next = sum(v for k, v in self.cpu_counters._asdict().items() if k != 'idle')
-        cpu_counters_sum_prev = sum(v for k, v in cpu_counters_prev._asdict().items() if k != 'idle')
-        self.loadavg_current = (cpu_counters_sum_next - cpu_counters_sum_prev) / time_diff
+        self.loadavg_current = (get_busy_time(self.cpu_counters) - get_busy_time(cpu_counters_prev)) / time_diff
+        self.core_load_list = [
+            min(max((get_busy_time(core) - get_busy_time(core_prev)) / time_diff, 0), 1)
+            for core, core_prev in zip(self.core_counters, core_counters_prev)
+        ]
 
         self.loadavg_1m = os.getloadavg()[0]
-        self.power_w = ((self.power_uj_counter - power_uj_counter_prev) / time_diff) / 1000000
 
         sensors_temp = get_sensors_temperatures()
         try:
@@ -126,17 +175,6 @@ class Cpu:
             common.log.error(e)
             self.temp_c = 0
 
-        self.alarm = common.create_temp_alarm('CPU', self.temp_c, CPU_TEMP_CRIT_C)
-
-    # return micro joule
-    def _get_power_uj_counter(self) -> int:
-        try:
-            with CPU_POWER_SENSOR_PATH.open('r') as file:
-                return int(file.readline())
-        except Exception as e:
-            common.log.error(e)
-        return 0
-
     def _take_freq_list(self) -> None:
         count = 5
 
@@ -145,7 +183,8 @@ class Cpu:
                 # sleep before psutil.cpu_freq call
                 freq_list = [9999.9, 9999.9]  # Mhz
                 for _ in range(0, count):
-                    time.sleep(self.period_s / count / 2)
+                    if self.stopping.wait(self.period_s / count / 2):
+                        return
                     freqs = psutil.cpu_freq(percpu=True)
                     freq_cur_list = [freq.current for freq in freqs]
                     freq_min = min(freq_cur_list)
@@ -168,52 +207,208 @@ class Cpu:
         )
 
 
-class Gpu:
+class Throttle:
     def __init__(self):
+        self.files = common.OpenFiles()
+        self.core_count_paths: typing.List[pathlib.Path] = []
+        self.package_count_paths: typing.List[pathlib.Path] = []
+        self.scaling_max_paths: typing.List[typing.Tuple[pathlib.Path, int]] = []
+        for cpu in sorted(CPU_PATH.glob('cpu[0-9]*')):
+            # intel only, per core and per package counters
+            if (cpu / 'thermal_throttle').exists():
+                self.core_count_paths.append(cpu / 'thermal_throttle' / 'core_throttle_count')
+                self.package_count_paths.append(cpu / 'thermal_throttle' / 'package_throttle_count')
+            try:
+                cpuinfo_max_khz = int((cpu / 'cpufreq' / 'cpuinfo_max_freq').read_text())
+                self.scaling_max_paths.append((cpu / 'cpufreq' / 'scaling_max_freq', cpuinfo_max_khz))
+            except (OSError, ValueError) as e:
+                common.log.debug('cpufreq not available', cpu, e)
+        self.crit_alarm_paths = sorted(HWMON_PATH.glob('hwmon*/*_crit_alarm'))
+        common.log.info('throttle sources', len(self.core_count_paths), len(self.scaling_max_paths),
+                        len(self.crit_alarm_paths))
+
+        self.counters_time = time.monotonic()
+        self.core_count: typing.Optional[int] = None
+        self.package_count: typing.Optional[int] = None
+
+        self.events_per_s = 0.0
+        # scaling_max_freq / cpuinfo_max_freq per core, 1.0 is not capped
+        self.cap_ratio_list: typing.List[float] = []
+        self.cap_ratio = 1.0
+        self.crit_alarms = 0
+
+    def calculate(self, now: float):
+        counters_time_prev = self.counters_time
+        core_count_prev = self.core_count
+        package_count_prev = self.package_count
+
+        self.core_count = sum(self.files.read_int(path) or 0 for path in self.core_count_paths)
+        # every cpu of a package shows the same package counter
+        self.package_count = max((self.files.read_int(path) or 0 for path in self.package_count_paths), default=0)
+        self.counters_time = now
+
+        time_diff = self.counters_time - counters_time_prev
+        if core_count_prev is not None and time_diff > 0:
+            events = max(self.core_count - core_count_prev, 0) + max(self.package_count - package_count_prev, 0)
+            self.events_per_s = events / time_diff
+
+        self.cap_ratio_list = [
+            (self.files.read_int(path) or cpuinfo_max_khz) / cpuinfo_max_khz
+            for path, cpuinfo_max_khz in self.scaling_max_paths
+        ]
+        self.cap_ratio = min(self.cap_ratio_list, default=1.0)
+        self.crit_alarms = sum(1 for path in self.crit_alarm_paths if self.files.read_int(path))
+
+    def stop(self):
+        self.files.close()
+
+    def __str__(self):
+        return '[{} T/s {}% {}]'.format(
+            common.convert_4(self.events_per_s),
+            common.convert_2(self.cap_ratio * 100) if self.cap_ratio < 1 else '--',
+            '!' if self.crit_alarms else ' ',
+        )
+
+
+class GpuDevice:
+    def __init__(self, card_path: pathlib.Path):
+        self.name = card_path.name
+        self.device_path = card_path / 'device'
+        self.hwmon_path = next((self.device_path / 'hwmon').glob('hwmon*'), None)
         try:
-            hwmon_path = self._find_hwmon()
-            with (hwmon_path / 'power1_average').open('r') as file:
-                self.power1_average_w = int(file.readline()) / 1000000
-            with (hwmon_path / 'power1_cap').open('r') as file:
-                self.power1_cap_w = int(file.readline()) / 1000000
-            with (hwmon_path / 'temp2_input').open('r') as file:
-                self.temp2_input_c = int(file.readline()) / 1000
-            with (hwmon_path / 'temp2_crit').open('r') as file:
-                self.temp2_crit_c = int(file.readline()) / 1000 - 10
-            # with (hwmon_path / 'freq1_input').open('r') as file:
-            #     self.freq1_input_ghz = int(file.readline()) / 1000000000
-            # with (hwmon_path / 'freq2_input').open('r') as file:
-            #     self.freq2_input_ghz = int(file.readline()) / 1000000000
-        except Exception as e:
-            common.log.error(e)
-            self.power1_average_w = 0
-            self.power1_cap_w = 0
-            self.temp2_input_c = 0
-            self.temp2_crit_c = 90
-
-        self.alarm = common.create_temp_alarm('GPU', self.temp2_input_c, self.temp2_crit_c)
-
-    def _find_hwmon(self) -> typing.Optional[pathlib.Path]:
-        for hwmon in HWMON_PATH.iterdir():
-            hwmon_device = hwmon / 'device' / 'device'
-            if hwmon_device.exists() and hwmon_device.is_file():
-                with hwmon_device.open('r') as file:
-                    device_id = file.read().splitlines()[0]
-                    common.log.debug('GPU device: {} {}'.format(hwmon_device, device_id))
-                    if GPU_DEVICE_ID in device_id:
-                        return hwmon
-        raise Exception('gpu device {} not found. change id.'.format(GPU_DEVICE_ID))
+            self.vendor = (self.device_path / 'vendor').read_text().strip()
+        except OSError:
+            self.vendor = ''
+        common.log.info('GPU device', self.name, self.vendor, self.hwmon_path)
+
+        self.suspended = False
+        self.busy_percent: typing.Optional[float] = None
+        self.vram_used_gb: typing.Optional[float] = None
+        self.vram_total_gb: typing.Optional[float] = None
+        self.sclk_ghz: typing.Optional[float] = None
+        self.mclk_ghz: typing.Optional[float] = None
+        self.power_w: typing.Optional[float] = None
+        self.power_cap_w: typing.Optional[float] = None
+        self.temp_c: typing.Optional[float] = None
+        self.temp_crit_c: typing.Optional[float] = None
+
+    def calculate(self, files: common.OpenFiles):
+        # reading hwmon of a runtime suspended dGPU wakes it up (or hangs in D3cold)
+        runtime_status = files.read(self.device_path / 'power' / 'runtime_status')
+        self.suspended = runtime_status is not None and runtime_status.strip() == 'suspended'
+        if self.suspended:
+            self.busy_percent = 0
+            self.power_w = 0
+            self.temp_c = None
+            self.sclk_ghz = None
+            self.mclk_ghz = None
+            return
+
+        self.busy_percent = files.read_int(self.device_path / 'gpu_busy_percent')
+        self.vram_used_gb = self._scale(files.read_int(self.device_path / 'mem_info_vram_used'), 1024 ** 3)
+        self.vram_total_gb = self._scale(files.read_int(self.device_path / 'mem_info_vram_total'), 1024 ** 3)
+        self.sclk_ghz = self._read_clock_ghz(files, 'freq1_input', 'pp_dpm_sclk')
+        self.mclk_ghz = self._read_clock_ghz(files, 'freq2_input', 'pp_dpm_mclk')
+
+        if self.hwmon_path:
+            power_uw = files.read_int(self.hwmon_path / 'power1_average')
+            if power_uw is None:
+                power_uw = files.read_int(self.hwmon_path / 'power1_input')
+            self.power_w = self._scale(power_uw, 1000000)
+            self.power_cap_w = self._scale(files.read_int(self.hwmon_path / 'power1_cap'), 1000000)
+
+            # junction (temp2) if the card has it, edge (temp1) otherwise
+            for sensor in ('temp2', 'temp1'):
+                temp_mc = files.read_int(self.hwmon_path / '{}_input'.format(sensor))
+                if temp_mc is not None:
+                    self.temp_c = temp_mc / 1000
+                    crit_mc = files.read_int(self.hwmon_path / '{}_crit'.format(sensor))
+                    self.temp_crit_c = crit_mc / 1000 - 10 if crit_mc else None
+                    break
+
+    def _read_clock_ghz(self, files: common.OpenFiles, hwmon_name: str, dpm_name: str) -> typing.Optional[float]:
+        if self.hwmon_path:
+            freq_hz = files.read_int(self.hwmon_path / hwmon_name)
+            if freq_hz is not None:
+                return freq_hz / 1000000000
+        # "1: 1800Mhz *" marks the current level
+        dpm = files.read(self.device_path / dpm_name)
+        for line in (dpm or '').splitlines():
+            if line.endswith('*'):
+                return int(line.split()[1].lower().rstrip('mhz')) / 1000
+        return None
+
+    @staticmethod
+    def _scale(value: typing.Optional[int], divider: float) -> typing.Optional[float]:
+        return value / divider if value is not None else None
 
     def __str__(self):
-        return '[{} W {} °C]'.format(
-        # return '[({:3} {:3}) Ghz {:2} W {:2} °C]'.format(
-            # round(self.freq1_input_ghz, 1),
-            # round(self.freq2_input_ghz, 1),
-            common.convert_2(self.power1_average_w),
-            common.convert_2(self.temp2_input_c),
+        def convert(value: typing.Optional[float], func: typing.Callable[[float], str] = common.convert_2) -> str:
+            return func(value) if value is not None else '**'
+
+        # vendors without the files show ** in their place
+        return '{} {}% {} W {} °C {}/{} GB {}/{} GHz'.format(
+            self.name,
+            convert(self.busy_percent),
+            convert(self.power_w),
+            convert(self.temp_c) if not self.suspended else 'zz',
+            convert(self.vram_used_gb, common.convert_1_1),
+            convert(self.vram_total_gb, common.convert_1_1),
+            convert(self.sclk_ghz, common.convert_1_1),
+            convert(self.mclk_ghz, common.convert_1_1),
         )
 
 
+class Gpu:
+    RESCAN_PERIOD_S = 60
+
+    def __init__(self):
+        self.files = common.OpenFiles()
+        self.devices: typing.List[GpuDevice] = []
+        self.scan_time = 0.0
+
+        # all devices together for alarms and graph scale
+        self.busy_percent = 0.0
+        self.power_w = 0.0
+        self.power_cap_w = 0.0
+        self.temp_c = 0.0
+        self.temp_crit_c = 90.0
+
+    def _scan(self):
+        # card0, card1, but not connectors like card0-eDP-1 or virtual cards without a device
+        cards = sorted(
+            path for path in DRM_PATH.glob('card*') if path.name[4:].isdigit() and (path / 'device').exists())
+        names = [device.name for device in self.devices]
+        if [card.name for card in cards] != names:
+            self.devices = [GpuDevice(card) for card in cards]
+            self.files.close()
+            if not self.devices:
+                common.log.error('gpu devices not found', DRM_PATH)
+
+    def calculate(self, now: float):
+        if now - self.scan_time >= self.RESCAN_PERIOD_S:
+            self.scan_time = now
+            self._scan()
+
+        for device in self.devices:
+            try:
+                device.calculate(self.files)
+            except Exception as e:
+                common.log.error('gpu error', device.name, e)
+
+        self.busy_percent = max((d.busy_percent or 0 for d in self.devices), default=0)
+        self.power_w = sum(d.power_w or 0 for d in self.devices)
+        self.power_cap_w = sum(d.power_cap_w or 0 for d in self.devices)
+        self.temp_c = max((d.temp_c or 0 for d in self.devices), default=0)
+        self.temp_crit_c = min((d.temp_crit_c for d in self.devices if d.temp_crit_c), default=90)
+
+    def stop(self):
+        self.files.close()
+
+    def __str__(self):
+        return '[{}]'.format(' | '.join(str(device) for device in self.devices))
+
+
 class Memory:
     def __init__(self):
         memory = psutil.virtual_memory()
@@ -228,23 +423,114 @@ class Memory:
         return '[{} {} GB]'.format(common.convert_4(self.swap_gb), common.convert_2_1(self.used_gb))
 
 
+class Pressure:
+    def __init__(self, period_s: float, on_trigger: typing.Callable[[str], None]):
+        self.period_s = period_s
+        self.on_trigger = on_trigger
+
+        # keep files open, one pread per resource and tick
+        self.fds: typing.Dict[str, int] = {}
+        for resource in PRESSURE_RESOURCES:
+            try:
+                self.fds[resource] = os.open(PRESSURE_PATH / resource, os.O_RDONLY)
+            except OSError as e:
+                common.log.error('pressure not available', resource, e)
+            # avg10 of "some" and "full" in percents, total stall time in us
+            setattr(self, '{}_some_avg10'.format(resource), 0.0)
+            setattr(self, '{}_full_avg10'.format(resource), 0.0)
+            setattr(self, '{}_some_total_us'.format(resource), 0)
+
+        # triggers since last calculate, counted on the trigger thread and taken on the tick thread
+        self.stall_events = 0
+        self._stall_events = 0
+        self.stall_events_lock = threading.Lock()
+
+        self.stopping = threading.Event()
+        self.trigger_theead = threading.Thread(target=self._trigger_loop)
+        self.trigger_theead.start()
+
+    def calculate(self):
+        for resource, fd in self.fds.items():
+            try:
+                for line in os.pread(fd, 256, 0).decode().splitlines():
+                    # some avg10=0.00 avg60=0.00 avg300=0.00 total=0
+                    kind, avg10, _, _, total = line.split()
+                    setattr(self, '{}_{}_avg10'.format(resource, kind), float(avg10[6:]))
+                    if kind == 'some':
+                        setattr(self, '{}_some_total_us'.format(resource), int(total[6:]))
+            except Exception as e:
+                common.log.error('pressure read error', resource, e)
+
+        with self.stall_events_lock:
+            self.stall_events = self._stall_events
+            self._stall_events = 0
+
+    def stop(self):
+        # the loop wakes up on the poll timeout
+        self.stopping.set()
+        self.trigger_theead.join()
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+
+    def _trigger_loop(self):
+        poller = select.poll()
+        trigger_fds: typing.Dict[int, str] = {}
+        for resource, trigger in PRESSURE_TRIGGERS.items():
+            try:
+                fd = os.open(PRESSURE_PATH / resource, os.O_RDWR | os.O_NONBLOCK)
+            except OSError as e:
+                common.log.error('pressure trigger not available', resource, e)
+                continue
+            try:
+                os.write(fd, trigger.encode() + b'\0')
+            except OSError as e:
+                common.log.error('pressure trigger error', resource, trigger, e)
+                os.close(fd)
+                continue
+            poller.register(fd, select.POLLPRI)
+            trigger_fds[fd] = resource
+
+        try:
+            while trigger_fds and not self.stopping.is_set():
+                for fd, event in poller.poll(self.period_s * 1000):
+                    resource = trigger_fds[fd]
+                    if event & select.POLLERR:
+                        common.log.error('pressure trigger removed', resource)
+                        poller.unregister(fd)
+                        os.close(trigger_fds.pop(fd))
+                    elif event & select.POLLPRI:
+                        common.log.info('pressure stall', resource, PRESSURE_TRIGGERS[resource])
+                        with self.stall_events_lock:
+                            self._stall_events += 1
+                        self.on_trigger(resource)
+        finally:
+            for fd in trigger_fds:
+                os.close(fd)
+
+    def __str__(self):
+        return '[{} {} {} %P]'.format(
+            common.convert_2(self.cpu_some_avg10),
+            common.convert_2(self.memory_some_avg10),
+            common.convert_2(self.io_some_avg10),
+        )
+
+
 class Disk:
     def __init__(self):
         self.disk_counters = psutil.disk_io_counters()
-        self.counters_time = time.time()
+        self.counters_time = time.monotonic()
 
         self.read_mbps = 0
         self.write_mbps = 0
         self.temp_c = 0
 
-        self.alarm = None
-
-    def calculate(self):
+    def calculate(self, now: float):
         disk_counters_prev = self.disk_counters
         counters_time_prev = self.counters_time
 
         self.disk_counters = psutil.disk_io_counters()
-        self.counters_time = time.time()
+        self.counters_time = now
 
         time_diff = self.counters_time - counters_time_prev
 
@@ -260,8 +546,6 @@ class Disk:
             common.log.error(e)
             self.temp_c = 0
 
-        self.alarm = common.create_temp_alarm('NVME', self.temp_c, DISK_TEMP_CRIT_C)
-
     def __str__(self):
         return '[{} MB/s {} MB/s {} °C]'.format(
             common.convert_4(self.read_mbps),
@@ -270,28 +554,30 @@ class Disk:
         )
 
 
+def get_keyboard_layout() -> str:
+    try:
+        output = subprocess.check_output('xset -q | grep -A 0 \'LED\' | cut -c59-67', shell=True)
+        if b'1' in output:
+            return 'RU'
+        return 'EN'
+    except Exception as e:
+        common.log.error(e)
+    return '**'
+
+
 class Common:
-    def __init__(self, bt: network.Bluetooth):
+    def __init__(self, bt: typing.Optional[network.Bluetooth], keyboard_layout: typing.Optional[str]):
         locale.setlocale(locale.LC_TIME, 'en_US.utf8')
         self.date_time = datetime.datetime.now()
         self.hour_utc = datetime.datetime.now(datetime.timezone.utc).hour
         self.hour_msc = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=3))).hour
 
-        self.keyboard_layout = '**'
-        try:
-            output = subprocess.check_output('xset -q | grep -A 0 \'LED\' | cut -c59-67', shell=True)
-            if b'1' in output:
-                self.keyboard_layout = 'RU'
-            else:
-                self.keyboard_layout = 'EN'
-        except Exception as e:
-            common.log.error(e)
-
-        self.vpn_connected = any('ppp' in iface for iface in netifaces.interfaces())
+        self.keyboard_layout = keyboard_layout or '**'
+        self.vpn_connected = any('ppp' in iface for iface in common.import_module('netifaces').interfaces())
         self.bt = bt
 
     def __str__(self):
-        bt_status = 'B/{}'.format(common.convert_1_1(self.bt.get_bat_level()))
+        bt_status = 'B/{}'.format(common.convert_1_1(self.bt.get_bat_level() if self.bt else 0))
         return '[{} {:02}/{:02}/{} {} {} {}]'.format(
             self.date_time.strftime("%a %d.%m.%y"),
             self.hour_utc,
@@ -299,7 +585,7 @@ class Common:
             self.date_time.strftime("%H:%M:%S"),
             self.keyboard_layout,
             'V' if self.vpn_connected else ' ',
-            bt_status if self.bt.is_connected() else ' ' * len(bt_status),
+            bt_status if self.bt and self.bt.is_connected() else ' ' * len(bt_status),
         )
 
 
@@ -328,54 +614,205 @@ class TopProcess:
 
 
 class HardMonitorInfo:
-    def __init__(self, net: network.Network, disk: Disk, cpu: Cpu, bt: network.Bluetooth):
+    def __init__(
+            self,
+            net: network.Network,
+            disk: Disk,
+            cpu: Cpu,
+            gpu: typing.Optional[Gpu],
+            bt: typing.Optional[network.Bluetooth],
+            pressure: typing.Optional[Pressure],
+            cgroups: typing.Optional[cgroup.Cgroups],
+            net_top: typing.Optional[nettop.NetTop],
+            energy_zones: typing.Optional[energy.Energy],
+            throttle: typing.Optional[Throttle],
+            protocol: typing.Optional[network.ProtocolHealth],
+            memory: typing.Optional[Memory],
+            battery: typing.Optional[Battery],
+            keyboard_layout: typing.Optional[str],
+            top_process: typing.Optional[TopProcess]):
         self.cpu = cpu
-        self.memory = Memory()
-        self.gpu = Gpu()
+        self.throttle = throttle
+        self.memory = memory
+        self.pressure = pressure
+        self.gpu = gpu
         self.network = net
+        self.protocol = protocol
         self.disk = disk
-        self.battery = Battery()
-        self.common = Common(bt)
-        self.top_process = TopProcess()
+        self.battery = battery
+        self.energy = energy_zones
+        self.common = Common(bt, keyboard_layout)
+        self.top_process = top_process
+        self.top_cgroup = cgroups
+        self.top_network = net_top
 
-        self.alarms = [alarm for alarm in (self.gpu.alarm, self.disk.alarm, self.cpu.alarm) if alarm]
+        self.alarms: typing.List[common.Alarm] = []
 
     def get_time(self) -> float:
         return self.cpu.counters_time
 
     def __str__(self):
-        return ' '.join(str(value) for attr, value in self.__dict__.items() if attr != 'alarms')
+        return ' '.join(
+            str(value) for attr, value in self.__dict__.items() if attr != 'alarms' and value is not None)
+
+
+def create_alarm_rules() -> typing.List[rules.Rule]:
+    return [
+        rules.Rule('CPU', 'cpu.temp_c', CPU_TEMP_CRIT_C,
+                   hysteresis=TEMP_ALARM_HYSTERESIS_C, message=TEMP_ALARM_MESSAGE),
+        rules.Rule('GPU', 'gpu.temp_c', 'gpu.temp_crit_c',
+                   hysteresis=TEMP_ALARM_HYSTERESIS_C, message=TEMP_ALARM_MESSAGE),
+        rules.Rule('NVME', 'disk.temp_c', DISK_TEMP_CRIT_C,
+                   hysteresis=TEMP_ALARM_HYSTERESIS_C, message=TEMP_ALARM_MESSAGE),
+        rules.Rule('CPU load', lambda info: info.cpu.loadavg_current / info.cpu.cpu_count * 100, CPU_LOAD_CRIT_PERCENT,
+                   hysteresis=10, for_s=CPU_LOAD_CRIT_FOR_S, message='{name} {value:2.0f}% for 5 min'),
+        rules.Rule('Swap', 'memory.swap_gb', SWAP_GROWTH_CRIT_GB_PER_MIN,
+                   for_s=SWAP_GROWTH_WINDOW_S / 2, rate_window_s=SWAP_GROWTH_WINDOW_S, rate_unit_s=60,
+                   message='{name} grows {value:.2f} GB/min'),
+        rules.Rule('Throttle', 'throttle.events_per_s', THROTTLE_CRIT_EVENTS_PER_S,
+                   for_s=THROTTLE_CRIT_FOR_S, clear_for_s=THROTTLE_CRIT_FOR_S,
+                   message='{name} {value:.0f}/s for 30 s'),
+        rules.Rule('Crit', 'throttle.crit_alarms', 1, message='{name} hwmon alarm {value:.0f}'),
+        rules.Rule('TCP retrans', 'protocol.retrans_percent', RETRANS_CRIT_PERCENT, hysteresis=1,
+                   for_s=PROTOCOL_CRIT_FOR_S, message='{name} {value:.1f}%'),
+        rules.Rule('TCP listen', 'protocol.listen_overflows_per_s', LISTEN_OVERFLOWS_CRIT_PER_S,
+                   for_s=PROTOCOL_CRIT_FOR_S, message='{name} overflows {value:.0f}/s'),
+        rules.Rule('UDP', 'protocol.udp_rcvbuf_errors_per_s', UDP_RCVBUF_ERRORS_CRIT_PER_S,
+                   for_s=PROTOCOL_CRIT_FOR_S, message='{name} rcvbuf errors {value:.0f}/s'),
+        rules.Rule('PSI', 'pressure.stall_events', 1, clear_for_s=PRESSURE_ALARM_HOLD_S,
+                   message='{name} {total:.0f} stalls'),
+    ]
 
 
 class HardMonitor:
-    def __init__(self, period_s: float, force_reload_bt: bool = False):
-        sensors.init()
-        self.cpu = Cpu(period_s)
-        self.network = network.Network(period_s)
-        self.disk = Disk()
-        self.bt = network.Bluetooth(period_s, force_reload_bt)
+    def __init__(
+            self,
+            period_s: float,
+            disabled: typing.Iterable[str] = (),
+            savefile: typing.Optional[pathlib.Path] = None,
+            source_timeout_s: typing.Optional[float] = None):
+        self.disabled = set(disabled)
+        # counters and energy totals are saved periodically to survive restarts
+        self.savefile = savefile
+        # ui, main and collector default to the same savefile, the first one started owns it
+        self.savefile_lock = self._lock_savefile(savefile) if savefile else None
+        self.foreign_savefile = savefile if savefile and self.savefile_lock is None else None
+        self.last_save_time = time.monotonic()
+        with common.startup_profile.measure('init sensors'):
+            common.import_module('sensors').init()
+        with common.startup_profile.measure('init collectors'):
+            self.energy = energy.Energy() if 'energy' not in self.disabled else None
+            self.cpu = Cpu(period_s, self.energy)
+            self.throttle = Throttle() if 'throttle' not in self.disabled else None
+            self.network = network.Network(
+                period_s, ping='ping' not in self.disabled, wlan='wlan' not in self.disabled)
+            self.protocol = network.ProtocolHealth() if 'protocol' not in self.disabled else None
+            self.disk = Disk()
+            self.gpu = Gpu() if 'gpu' not in self.disabled else None
+            self.bt = network.Bluetooth(period_s) if 'bluetooth' not in self.disabled else None
+            self.pressure = Pressure(period_s, self._wakeup) if 'pressure' not in self.disabled else None
+            self.cgroups = cgroup.Cgroups(self.cpu.cpu_count) if 'cgroup' not in self.disabled else None
+            self.net_top = nettop.NetTop() if 'nettop' not in self.disabled else None
+        self.watchdog = self._create_watchdog(source_timeout_s or period_s / 2)
+        self.rules = rules.RuleEngine(create_alarm_rules())
+        self.anomaly = common.import_module('anomaly').Detector() if 'anomaly' not in self.disabled else None
+        self.wakeup_listeners: typing.List[typing.Callable[[], None]] = []
         self.last_log_time: float = 0
-        common.log.info(period_s, force_reload_bt)
+        common.log.info(period_s, disabled=self.disabled)
+
+    @staticmethod
+    def _lock_savefile(savefile: pathlib.Path) -> typing.Optional[int]:
+        try:
+            fd = os.open(savefile.with_name(savefile.name + '.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            common.log.error('savefile lock error', savefile, e)
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            common.log.info('savefile owned by another process, not written', savefile)
+            return None
+        return fd
+
+    def _create_watchdog(self, timeout_s: float) -> watchdog.Watchdog:
+        sources = watchdog.Watchdog(timeout_s)
+        # collectors keep counters between ticks, they can only run on a thread
+        for name, collector in (
+                ('energy', self.energy), ('cpu', self.cpu), ('throttle', self.throttle), ('network', self.network),
+                ('protocol', self.protocol), ('disk', self.disk), ('gpu', self.gpu), ('pressure', self.pressure),
+                ('cgroup', self.cgroups), ('nettop', self.net_top)):
+            if collector:
+                sources.add(name, collector.calculate)
+        # stateless probes return plain objects and can move to a worker process
+        sources.add('memory', Memory, isolate=True)
+        sources.add('battery', Battery, isolate=True)
+        sources.add('keyboard', get_keyboard_layout, isolate=True)
+        if 'top_process' not in self.disabled:
+            sources.add('top_process', TopProcess, isolate=True)
+        return sources
 
     def stop(self):
+        self.watchdog.stop()
+        if self.savefile_lock is not None:
+            os.close(self.savefile_lock)
+            self.savefile_lock = None
         self.cpu.stop()
         self.network.stop()
-        self.bt.stop()
-
-    def update_counters(self):
-        self.cpu.calculate()
-        self.network.calculate()
-        self.disk.calculate()
+        if self.bt:
+            self.bt.stop()
+        if self.pressure:
+            self.pressure.stop()
+        if self.cgroups:
+            self.cgroups.stop()
+        if self.net_top:
+            self.net_top.stop()
+        if self.gpu:
+            self.gpu.stop()
+        if self.energy:
+            self.energy.stop()
+        if self.throttle:
+            self.throttle.stop()
+        if self.protocol:
+            self.protocol.stop()
+
+    # listener is called from collector threads when an event needs an immediate get_info
+    def add_wakeup_listener(self, listener: typing.Callable[[], None]):
+        self.wakeup_listeners.append(listener)
+
+    def _wakeup(self, reason: str):
+        common.log.debug('wakeup', reason)
+        for listener in self.wakeup_listeners:
+            listener()
+
+    def update_counters(self, now: typing.Optional[float] = None):
+        self._poll(now, probes=False)
+
+    def _poll(self, now: typing.Optional[float], probes: bool) -> typing.Dict[str, typing.Any]:
+        # one monotonic tick time for all collectors, rates of every collector cover the same interval
+        if now is None:
+            now = time.monotonic()
+        calls = [(name, (now,)) for name in COUNTER_SOURCES]
+        calls.append(('pressure', ()))
+        if probes:
+            calls += [(name, ()) for name in PROBE_SOURCES]
+        return self.watchdog.call_all(calls)
 
     def load_json(self, file: pathlib.Path) -> bool:
         common.log.info('read json', file)
         try:
             with file.open('r') as output:
                 dump = json.load(output)
-            counters_time = dump['counters_time']
+            # saved as wall time, the monotonic clock starts over on boot
+            counters_time = sampling.wall_to_monotonic(dump['counters_time'])
 
             CpuCounters = collections.namedtuple('CpuCounters', dump['cpu_counters'])
             self.cpu.cpu_counters = CpuCounters(**dump['cpu_counters'])
+            # per core counters of another core count or an older savefile give no per core load on the first tick
+            core_counters = dump.get('core_counters', [])
+            if len(core_counters) != len(self.cpu.core_counters):
+                core_counters = []
+            self.cpu.core_counters = [CpuCounters(**core) for core in core_counters]
             self.cpu.counters_time = counters_time
 
             NetCounters = collections.namedtuple('NetCounters', dump['net_counters'])
@@ -385,6 +822,12 @@ class HardMonitor:
             DiskCounters = collections.namedtuple('DiskCounters', dump['disk_counters'])
             self.disk.disk_counters = DiskCounters(**dump['disk_counters'])
             self.disk.counters_time = counters_time
+
+            if self.energy:
+                same_boot = bool(dump.get('boot_id')) and dump.get('boot_id') == sampling.get_boot_id()
+                self.energy.load(dump.get('energy', {}), counters_time, same_boot)
+            if self.anomaly:
+                self.anomaly.load(dump.get('anomaly', {}))
         except Exception as e:
             common.log.error('read json error', e)
             return False
@@ -392,12 +835,18 @@ class HardMonitor:
         return True
 
     def save_json(self, file: pathlib.Path) -> None:
+        if file == self.foreign_savefile:
+            return
         common.log.info('write json', file)
         dump = {
-            'counters_time': self.cpu.counters_time,
+            'boot_id': sampling.get_boot_id(),
+            'counters_time': sampling.monotonic_to_wall(self.cpu.counters_time),
             'cpu_counters': self.cpu.cpu_counters._asdict(),
+            'core_counters': [core._asdict() for core in self.cpu.core_counters],
             'disk_counters': self.disk.disk_counters._asdict(),
             'net_counters': self.network.net_counters._asdict(),
+            'energy': self.energy.dump() if self.energy else {},
+            'anomaly': self.anomaly.dump() if self.anomaly else {},
         }
         json_dump = json.dumps(dump, sort_keys=True, indent=4)
 
@@ -409,11 +858,27 @@ class HardMonitor:
                 return
         common.log.info('write json success', file)
 
-    def get_info(self) -> HardMonitorInfo:
-        self.update_counters()
+    def get_info(self, now: typing.Optional[float] = None) -> HardMonitorInfo:
+        values = self._poll(now, probes=True)
 
-        info = HardMonitorInfo(self.network, self.disk, self.cpu, self.bt)
+        info = HardMonitorInfo(
+            self.network, self.disk, self.cpu, self.gpu, self.bt, self.pressure, self.cgroups, self.net_top,
+            self.energy, self.throttle, self.protocol,
+            values.get('memory'), values.get('battery'), values.get('keyboard'), values.get('top_process'))
+        info.alarms = self.rules.evaluate(info, info.get_time()) + self.watchdog.get_alarms(time.monotonic())
+        if self.anomaly:
+            info.alarms += self.anomaly.update(info, info.get_time())
         if info.get_time() - self.last_log_time > PRINT_TO_LOG_PERIOD_S:
             self.last_log_time = info.get_time()
             common.log.info(info)
+            common.log.info('sources', self.watchdog, anomaly=self.anomaly)
+        if self.savefile and info.get_time() - self.last_save_time > SAVE_PERIOD_S:
+            self.last_save_time = info.get_time()
+            self.save_json(self.savefile)
         return info
+
+
+def create_monitor(args):
+    if args.snapshot:
+        return common.import_module('snapshot').SnapshotReader(args.snapshot)
+    return HardMonitor(args.period, disabled=args.disable, savefile=args.savefile, source_timeout_s=args.source_timeout)
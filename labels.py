@@ -0,0 +1,175 @@
+import copy
+import typing
+
+import hard_monitor
+import network
+import segments
+
+BATTERY_DUR_MULTIPLIER = 6  # 10min * 6
+GPU_COLORS = [(255, 0, 0), (100, 100, 255), (255, 255, 0), (0, 255, 0)]
+SECOND_COLOR = (100, 100, 255)
+
+# A label draws a segment through the views of a renderer, graph.Label or strip.Cell:
+#   update(text), update_y_range(y_min, y_max) -> changed, set_log_mode(y),
+#   create_series(color, fill_level) -> series with add_value(value, t), override_all_y(y), set_fill_level(level),
+#   create_heatmap() -> heatmap with add_values(core_load_list, t, y_max) or None.
+# The renderer creates the views with create_view(config, after=None), a view created after another one
+# is placed right after it.
+
+
+class DefaultLabel:
+    def __init__(self, renderer, config):
+        self.view = renderer.create_view(config)
+        self.view.update_y_range(0, 0)
+
+    def update(self, info, t: float):
+        self.view.update(str(info))
+
+
+class Cpu:
+    def __init__(self, renderer, config):
+        self.view = renderer.create_view(config)
+        self.heatmap = self.view.create_heatmap() if config.cpu_heatmap else None
+        self.series = self.view.create_series()
+
+    def update(self, cpu: hard_monitor.Cpu, t: float):
+        self.view.update(str(cpu))
+        self.view.update_y_range(0, cpu.cpu_count)
+        self.series.add_value(cpu.loadavg_current, t)
+
+        # snapshot readers have no per core load
+        core_load_list = getattr(cpu, 'core_load_list', None)
+        if self.heatmap and core_load_list:
+            self.heatmap.add_values(core_load_list, t, cpu.cpu_count)
+
+
+class Memory:
+    def __init__(self, renderer, config):
+        self.view = renderer.create_view(config)
+        self.used_series = self.view.create_series()
+
+    def update(self, memory: hard_monitor.Memory, t: float):
+        self.view.update(str(memory))
+        if self.view.update_y_range(0, memory.total_gb):
+            self.used_series.override_all_y(memory.used_gb)
+        self.used_series.add_value(memory.used_gb, t)
+
+
+class Gpu:
+    """A view and power graph per device, added after the previous device view when the device shows up."""
+
+    def __init__(self, renderer, config):
+        self.renderer = renderer
+        self.config = config
+        self.views: typing.Dict[str, typing.Any] = {}
+        self.series: typing.Dict[str, typing.Any] = {}
+        self.power_average_max_w: typing.Dict[str, float] = {}
+        # keeps the panel position until the first device shows up
+        self.last_view = renderer.create_view(config)
+
+    def _create_view(self, name: str):
+        if self.views:
+            view = self.renderer.create_view(copy.deepcopy(self.config), after=self.last_view)
+        else:
+            view = self.last_view
+        self.views[name] = self.last_view = view
+        color = GPU_COLORS[len(self.series) % len(GPU_COLORS)]
+        self.series[name] = view.create_series(color=color)
+        self.power_average_max_w[name] = 0
+        return view
+
+    def update(self, gpu: hard_monitor.Gpu, t: float):
+        # snapshot readers have only the total of all devices
+        devices = getattr(gpu, 'devices', None)
+        for device in [gpu] if devices is None else devices:
+            name = 'total' if devices is None else device.name
+            view = self.views.get(name) or self._create_view(name)
+            view.update(str(gpu) if devices is None else '[{}]'.format(device))
+
+            # power cap can show invalid value
+            power_w = device.power_w or 0
+            self.power_average_max_w[name] = max(device.power_cap_w or 0, power_w, self.power_average_max_w[name])
+            self.series[name].add_value(power_w, t)
+            view.update_y_range(0, self.power_average_max_w[name])
+
+
+class Network:
+    def __init__(self, renderer, config):
+        self.view = renderer.create_view(config)
+
+        y_min, y_max = segments.NETWORK_LOG_RANGE
+        self.view.set_log_mode(y=True)
+        self.view.update_y_range(y_min, y_max)
+        self.recv_series = self.view.create_series(fill_level=y_min)
+        self.send_series = self.view.create_series(color=SECOND_COLOR, fill_level=y_min)
+
+    def update(self, net: network.Network, t: float):
+        self.view.update(str(net))
+
+        self.recv_series.add_value(net.recv_mbps, t)
+        self.send_series.add_value(net.send_mbps, t)
+
+
+class Disk:
+    def __init__(self, renderer, config):
+        self.view = renderer.create_view(config)
+
+        y_min, y_max = segments.DISK_LOG_RANGE
+        self.view.set_log_mode(y=True)
+        self.view.update_y_range(y_min, y_max)
+        self.write_series = self.view.create_series(fill_level=y_min)
+        self.read_series = self.view.create_series(color=SECOND_COLOR, fill_level=y_min)
+
+    def update(self, disk: hard_monitor.Disk, t: float):
+        self.view.update(str(disk))
+
+        self.write_series.add_value(disk.write_mbps, t)
+        self.read_series.add_value(disk.read_mbps, t)
+
+
+class Battery:
+    def __init__(self, renderer, config):
+        config.accum_size = config.accum_size * BATTERY_DUR_MULTIPLIER
+        config.total_time_s = config.total_time_s * BATTERY_DUR_MULTIPLIER
+
+        self.view = renderer.create_view(config)
+        self.series = self.view.create_series()
+
+        self.first_update = True
+
+    def update(self, battery: hard_monitor.Battery, t: float):
+        self.view.update(str(battery))
+
+        if self.view.update_y_range(0, battery.charge_full_wh):
+            self.series.set_fill_level(battery.charge_full_wh)
+
+        if self.first_update:
+            self.series.override_all_y(battery.charge_now_wh)
+            self.first_update = False
+
+        self.series.add_value(battery.charge_now_wh, t)
+
+
+# segments with a graph, the others show only their text
+LABEL_TYPES = {
+    'cpu': Cpu,
+    'memory': Memory,
+    'gpu': Gpu,
+    'network': Network,
+    'disk': Disk,
+    'battery': Battery,
+}
+
+
+def create_labels(renderer, config) -> typing.Dict[str, typing.Any]:
+    return {
+        name: LABEL_TYPES.get(name, DefaultLabel)(renderer, copy.deepcopy(config)) for name in segments.NAMES
+    }
+
+
+def update_labels(labels: typing.Dict[str, typing.Any], info: hard_monitor.HardMonitorInfo):
+    t = info.get_time()
+    for name, label in labels.items():
+        value = getattr(info, name, None)
+        if value is not None:
+            label.update(value, t)
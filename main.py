@@ -1,41 +1,49 @@
 import time
 import pathlib
-import subprocess
+import threading
 
+import alarm
 import hard_monitor
 import common
+import profiler
+import sampling
 
 
 TMP_FILE = pathlib.Path('/tmp/hard_monitor_default.json')
 
 
-def send_message(message: str):
-    subprocess.Popen(['notify-send', message])
-    return
-
-
 def main():
     args = common.init()
-
-    monitor = hard_monitor.HardMonitor(args.period)
+    profiler.Profiler(args.savefile, args.profile_s).install()
+
+    monitor = hard_monitor.create_monitor(args)
+    alarm_dispatcher = alarm.create_dispatcher(args)
+    wakeup = threading.Event()
+    monitor.add_wakeup_listener(wakeup.set)
+    adaptive_period = sampling.AdaptivePeriod(args.period) if args.adaptive else None
+    ticker = sampling.Ticker(args.period)
     if not monitor.load_json(args.savefile):
-        monitor.update_counters()
-        time.sleep(args.period)
+        monitor.update_counters(ticker.tick())
+        time.sleep(ticker.get_timeout())
 
     i = args.count
     while True:
-        info = monitor.get_info()
+        info = monitor.get_info(ticker.tick())
         print(info)
-        for alarm in info.alarms:
-            send_message(alarm)
+        if i == args.count:
+            common.startup_profile.report('first output')
+        alarm_dispatcher.update(info.alarms)
 
         i -= 1
         if i <= 0 and args.count:
             break
-        time.sleep(args.period)
+        if adaptive_period:
+            ticker.set_period(adaptive_period.update(info))
+        wakeup.wait(ticker.get_timeout())
+        wakeup.clear()
     monitor.save_json(args.savefile)
     monitor.stop()
-    pass
+    alarm_dispatcher.close()
 
 
 if __name__ == '__main__':
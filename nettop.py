@@ -0,0 +1,245 @@
+import os
+import socket
+import struct
+import time
+import typing
+
+import common
+
+
+PROC_PATH = '/proc'
+
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+INET_DIAG_INFO = 2
+TCP_LISTEN = 10
+TCP_TIME_WAIT = 6
+# listening and time wait sockets move no data, time wait ones have no inode
+TCP_STATES = 0xfff & ~(1 << TCP_LISTEN | 1 << TCP_TIME_WAIT)
+RECV_SIZE = 65536
+
+# len, type, flags, seq, pid
+NLMSG_HEADER = struct.Struct('=IHHII')
+# inet_diag_req_v2: family, protocol, ext, pad, states, inet_diag_sockid of 48 zero bytes
+INET_DIAG_REQ = struct.Struct('=BBBBI48x')
+# inet_diag_msg: family, state, timer, retrans, sockid, expires, rqueue, wqueue, uid, inode
+INET_DIAG_MSG = struct.Struct('=BBBB48xIIIII')
+# len, type
+RTATTR = struct.Struct('=HH')
+# bytes_acked and bytes_received of struct tcp_info, kernel 4.1+
+TCP_INFO_BYTES = struct.Struct('=QQ')
+TCP_INFO_BYTES_OFFSET = 120
+
+# an unresolved inode is looked up again at most this often, owners without access stay unresolved
+RESCAN_PERIOD_S = 30
+TOP_SIZE = 2
+
+
+def align(length: int) -> int:
+    return (length + 3) & ~3
+
+
+class SockDiag:
+    """TCP sockets with their byte counters, dumped from the kernel in one netlink round trip per family."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG)
+        self.seq = 0
+
+    def dump(self) -> typing.Dict[int, typing.Tuple[int, int, int]]:
+        """inode -> uid, bytes sent and acked, bytes received"""
+        sockets = {}
+        for family in (socket.AF_INET, socket.AF_INET6):
+            self._dump_family(family, sockets)
+        return sockets
+
+    def _dump_family(self, family: int, sockets: typing.Dict[int, typing.Tuple[int, int, int]]):
+        self.seq += 1
+        request = INET_DIAG_REQ.pack(family, socket.IPPROTO_TCP, 1 << (INET_DIAG_INFO - 1), 0, TCP_STATES)
+        self.sock.sendto(NLMSG_HEADER.pack(NLMSG_HEADER.size + len(request), SOCK_DIAG_BY_FAMILY,
+                                           NLM_F_REQUEST | NLM_F_DUMP, self.seq, 0) + request, (0, 0))
+        while True:
+            data = self.sock.recv(RECV_SIZE)
+            offset = 0
+            while offset + NLMSG_HEADER.size <= len(data):
+                length, message_type, _, seq, _ = NLMSG_HEADER.unpack_from(data, offset)
+                if seq != self.seq:
+                    # leftover of an interrupted dump
+                    pass
+                elif message_type == NLMSG_DONE:
+                    return
+                elif message_type == NLMSG_ERROR:
+                    error, = struct.unpack_from('=i', data, offset + NLMSG_HEADER.size)
+                    raise OSError(-error, os.strerror(-error))
+                else:
+                    self._parse(data, offset + NLMSG_HEADER.size, offset + length, sockets)
+                offset += align(length)
+
+    @staticmethod
+    def _parse(data: bytes, offset: int, end: int, sockets: typing.Dict[int, typing.Tuple[int, int, int]]):
+        uid, inode = INET_DIAG_MSG.unpack_from(data, offset)[-2:]
+        offset += INET_DIAG_MSG.size
+        while offset + RTATTR.size <= end:
+            length, attr_type = RTATTR.unpack_from(data, offset)
+            if length < RTATTR.size:
+                return
+            if attr_type == INET_DIAG_INFO and length - RTATTR.size >= TCP_INFO_BYTES_OFFSET + TCP_INFO_BYTES.size:
+                sent, received = TCP_INFO_BYTES.unpack_from(data, offset + RTATTR.size + TCP_INFO_BYTES_OFFSET)
+                if inode:
+                    sockets[inode] = (uid, sent, received)
+                return
+            offset += align(length)
+
+    def close(self):
+        self.sock.close()
+
+
+class SocketIndex:
+    """
+    Socket inode -> pid, kept across ticks. /proc/<pid>/fd is read for new processes only, a socket opened later by
+    a known process is looked up on its first traffic in the processes already owning sockets, then in all
+    processes of its user.
+    """
+
+    def __init__(self):
+        self.owners: typing.Dict[int, int] = {}
+        self.inodes: typing.Dict[int, typing.Set[int]] = {}
+        self.names: typing.Dict[int, str] = {}
+        self.uids: typing.Dict[int, int] = {}
+        # inode -> time of the last lookup which did not find it
+        self.miss_time: typing.Dict[int, float] = {}
+        self.scans = 0
+
+    def update(self):
+        pids = {int(name) for name in os.listdir(PROC_PATH) if name.isdigit()}
+        for pid in [pid for pid in self.names if pid not in pids]:
+            for inode in self.inodes.pop(pid, ()):
+                if self.owners.get(inode) == pid:
+                    del self.owners[inode]
+            del self.names[pid]
+            del self.uids[pid]
+        for pid in pids:
+            if pid not in self.names:
+                self._scan(pid)
+
+    def _scan(self, pid: int):
+        self.scans += 1
+        path = '{}/{}'.format(PROC_PATH, pid)
+        if pid not in self.names:
+            try:
+                with open(path + '/comm', 'r') as file:
+                    self.names[pid] = file.read().strip()
+                self.uids[pid] = os.stat(path).st_uid
+            except OSError:
+                # exited, a pid is only scanned again when it shows up in /proc once more
+                self.names[pid] = ''
+                self.uids[pid] = -1
+                return
+        inodes = set()
+        try:
+            # threads share the fd table of the process, /proc lists process ids only
+            for entry in os.scandir(path + '/fd'):
+                try:
+                    link = os.readlink(entry.path)
+                except OSError:
+                    continue
+                if link.startswith('socket:['):
+                    inodes.add(int(link[8:-1]))
+        except OSError:
+            # other users' processes without privileges
+            pass
+        for inode in inodes:
+            self.owners[inode] = pid
+        if inodes or pid in self.inodes:
+            self.inodes[pid] = inodes
+
+    def resolve(self, missing: typing.Dict[int, int], now: float):
+        """Find the owners of socket inodes not in the index, missing is inode -> uid."""
+        self.miss_time = {inode: self.miss_time[inode] for inode in missing if inode in self.miss_time}
+        missing = {inode: uid for inode, uid in missing.items()
+                   if now - self.miss_time.get(inode, -RESCAN_PERIOD_S) >= RESCAN_PERIOD_S}
+        if not missing:
+            return
+        uids = set(missing.values())
+        for pid in [pid for pid in self.inodes if self.uids.get(pid) in uids]:
+            self._scan(pid)
+        missing = {inode: uid for inode, uid in missing.items() if inode not in self.owners}
+        uids = set(missing.values())
+        for pid in [pid for pid, uid in self.uids.items() if uid in uids and pid not in self.inodes]:
+            self._scan(pid)
+        for inode in missing:
+            if inode not in self.owners:
+                self.miss_time[inode] = now
+
+    def retain(self, inodes: typing.Container[int]):
+        # closed sockets of long running processes, unix and udp sockets are dropped as well
+        self.owners = {inode: pid for inode, pid in self.owners.items() if inode in inodes}
+        for pid, pid_inodes in self.inodes.items():
+            self.inodes[pid] = {inode for inode in pid_inodes if inode in inodes}
+
+    def get_name(self, inode: int) -> typing.Optional[str]:
+        pid = self.owners.get(inode)
+        return self.names.get(pid) if pid is not None else None
+
+
+class NetTop:
+    """TCP bytes per process from the sock_diag counters of every socket, top talkers by delta."""
+
+    def __init__(self):
+        self.diag = SockDiag()
+        self.index = SocketIndex()
+        self.counters: typing.Optional[typing.Dict[int, typing.Tuple[int, int, int]]] = None
+        self.counters_time = time.monotonic()
+
+        # name, recv MB/s, send MB/s
+        self.top_list: typing.List[typing.Tuple[str, float, float]] = []
+        self.socket_count = 0
+
+    def calculate(self, now: float):
+        sockets = self.diag.dump()
+        counters = self.counters
+        self.counters = sockets
+        time_diff = now - self.counters_time
+        self.counters_time = now
+        self.socket_count = len(sockets)
+        self.index.update()
+        self.index.retain(sockets)
+        if counters is None or time_diff <= 0:
+            return
+
+        # bytes of sockets closed since the previous tick are not counted
+        deltas = {}
+        for inode, (uid, sent, received) in sockets.items():
+            _, prev_sent, prev_received = counters.get(inode, (uid, 0, 0))
+            if sent > prev_sent or received > prev_received:
+                deltas[inode] = (max(received - prev_received, 0), max(sent - prev_sent, 0))
+
+        missing = {inode: sockets[inode][0] for inode in deltas if inode not in self.index.owners}
+        if missing:
+            self.index.resolve(missing, now)
+
+        talkers: typing.Dict[str, typing.List[float]] = {}
+        for inode, (received, sent) in deltas.items():
+            name = self.index.get_name(inode) or 'uid {}'.format(sockets[inode][0])
+            talker = talkers.setdefault(name, [0.0, 0.0])
+            talker[0] += received
+            talker[1] += sent
+        self.top_list = sorted(
+            ((name, received / time_diff / 1024 / 1024, sent / time_diff / 1024 / 1024)
+             for name, (received, sent) in talkers.items()),
+            key=lambda talker: talker[1] + talker[2], reverse=True)[:TOP_SIZE]
+
+    def stop(self):
+        self.diag.close()
+
+    def __str__(self):
+        top_list = self.top_list + [('', 0.0, 0.0)] * (TOP_SIZE - len(self.top_list))
+        return '[{} {:4}]'.format(
+            ' '.join('{}/{}/{:10}'.format(common.convert_4(received), common.convert_4(sent), name[:10])
+                     for name, received, sent in top_list),
+            self.socket_count,
+        )
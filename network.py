@@ -2,182 +2,138 @@ import fcntl
 import struct
 import socket
 import array
-import bluetooth_battery
-import re
-import ping3
 import threading
 import time
 import psutil
 import typing
-import netifaces
-import subprocess
-import pulsectl
-import pulsectl.lookup
-import tailer
+import pathlib
 
 import common
-import systemd.journal
 
 
-class BluetoothDevice:
-    BAT_UPDATE_PERIOD_S = 3 * 3600
+PROC_NET_PATH = pathlib.Path('/proc/net')
+PROC_NET_READ_SIZE = 65536
 
-    def __init__(self, mac_address: str):
-        self.mac_address = mac_address
-        self.bat_level: float = 0.0  # 0.0-1.0
-        self.bat_update_time = 0
-
-    def update_bat_level(self):
-        update_time = time.time()
-        if update_time - self.bat_update_time < self.BAT_UPDATE_PERIOD_S:
-            return
-
-        common.log.info('update bat level for', self.mac_address)
-        try:
-            o = subprocess.check_output('bluetoothctl disconnect {}'.format(self.mac_address), shell=True, text=True)
-            common.log.debug('disconnect bt device', o.splitlines())
-            for i in range(1, 11):
-                try:
-                    b = bluetooth_battery.BatteryStateQuerier('{}'.format(self.mac_address), i)
-                    result = int(b) / 100
-                    self.bat_level = result
-                    self.bat_update_time = update_time
-                    common.log.info('bat level is', result)
-                    break
-                except Exception as e:
-                    common.log.debug('port error', i, e)
-        except Exception as e:
-            common.log.error('update bt error', e)
-
-        o = subprocess.check_output('bluetoothctl connect {}'.format(self.mac_address), shell=True, text=True)
-        common.log.debug('connect bt device', o.splitlines())
-
-
-class _Bluetooth:
-    MAX_DEVICE_SIZE = 5
-
-    def __init__(self, period_s: float, force_reload_bt: bool = False):
-        self.device_list: typing.List[BluetoothDevice] = []
-        self.current_device: typing.Optional[BluetoothDevice] = None
-
-        self.force_reload_bt = force_reload_bt
-        self.period_s = period_s
-        self.stopping = threading.Event()
-        self.check_theead = threading.Thread(target=self._check_loop)
-        self.check_theead.start()
-
-    def is_connected(self) -> bool:
-        return self.current_device is not None
-
-    def get_bat_level(self) -> float:
-        if self.current_device:
-            return self.current_device.bat_level
-        return 0
-
-    def stop(self):
-        self.stopping.set()
-
-    def _get_current_mac(self):
-        try:
-            p = subprocess.run('bluetoothctl info | grep Device',
-                               shell=True, text=True, check=False, stdout=subprocess.PIPE)
-            if p.returncode == 0:
-                output = p.stdout.splitlines()
-                mac = re.findall('[:0-9A-F]{17}', output[0])
-                return mac[0]
-        except Exception as e:
-            common.log.error(e)
-        return None
-
-    def _update_current_device(self):
-        mac_address = self._get_current_mac()
-        if mac_address:
-            if self.current_device and self.current_device.mac_address == mac_address:
-                return
-
-            for device in self.device_list:
-                if device.mac_address == mac_address:
-                    common.log.info('found old device', device.mac_address)
-                    break
-            else:
-                if len(self.device_list) >= Bluetooth.MAX_DEVICE_SIZE:
-                    to_remove = self.device_list.pop(0)
-                    common.log.info('removed device', to_remove.mac_address)
-
-                device = BluetoothDevice(mac_address)
-                common.log.info('add new device', device.mac_address)
-                self.device_list.append(device)
-
-            self.current_device = device
-            common.log.info('current device', self.current_device.mac_address)
-        else:
-            self.current_device = None
-
-    def _check_loop(self):
-        while not self.stopping.is_set():
-            try:
-                prev_device = self.current_device
-                self._update_current_device()
-                if self.current_device and prev_device != self.current_device:
-                    common.log.info('connected device', self.current_device.mac_address)
-                    if self.force_reload_bt:
-                        self.current_device.update_bat_level()
-                elif prev_device != self.current_device:
-                    common.log.info('disconnected device', prev_device.mac_address)
-            except Exception as e:
-                common.log.error(e)
-            time.sleep(self.period_s)
+# attribute: counters of /proc/net/snmp and /proc/net/netstat summed into one per second rate
+PROTOCOL_RATES = {
+    'out_segs_per_s': (('Tcp', 'OutSegs'),),
+    'retrans_per_s': (('Tcp', 'RetransSegs'),),
+    'resets_per_s': (('Tcp', 'EstabResets'), ('Tcp', 'OutRsts')),
+    'attempt_fails_per_s': (('Tcp', 'AttemptFails'),),
+    'tcp_errors_per_s': (('Tcp', 'InErrs'), ('Tcp', 'InCsumErrors')),
+    'timeouts_per_s': (('TcpExt', 'TCPTimeouts'),),
+    'listen_overflows_per_s': (('TcpExt', 'ListenOverflows'), ('TcpExt', 'ListenDrops')),
+    'udp_rcvbuf_errors_per_s': (('Udp', 'RcvbufErrors'), ('UdpLite', 'RcvbufErrors')),
+    'udp_errors_per_s': (('Udp', 'InErrors'), ('Udp', 'SndbufErrors')),
+    'ip_discards_per_s': (('Ip', 'InDiscards'), ('Ip', 'OutDiscards')),
+}
 
 
 class Bluetooth:
-    def __init__(self, period_s: float, force_reload_bt: bool = False):
+    BLUEZ_SERVICE = 'org.bluez'
+    BLUEZ_PATH = '/org/bluez'
+    DEVICE_INTERFACE = 'org.bluez.Device1'
+    BATTERY_INTERFACE = 'org.bluez.Battery1'
+    PROPERTIES_INTERFACE = 'org.freedesktop.DBus.Properties'
+    OBJECT_MANAGER_INTERFACE = 'org.freedesktop.DBus.ObjectManager'
+
+    # bus is 'SYSTEM', 'SESSION' or a dbus address like 'unix:path=/tmp/test_bus' (test with mock bluez)
+    def __init__(self, period_s: float, bus: str = 'SYSTEM'):
         self.connected = False
         self.bat_level = 0.0
         self.period_s = period_s
+        self.bus = bus
+
+        # object path -> {'connected': bool, 'bat_level': float}
+        self.devices: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
 
         self.stopping = threading.Event()
         self.theead = threading.Thread(target=self._loop)
         self.theead.start()
 
     def _loop(self):
-        journal = systemd.journal.Reader()
-        journal.this_boot()
-        journal.seek_tail()
-        journal.log_level(systemd.journal.LOG_DEBUG)
-        journal.add_match('SYSLOG_IDENTIFIER=pulseaudio', 'SYSLOG_IDENTIFIER=bluetoothd')
-
         while not self.stopping.is_set():
             try:
-                journal.wait(self.period_s)
-                for line in journal:
-                    if self.stopping.is_set():
-                        break
-
-                    message = line['MESSAGE']
-                    id = line['SYSLOG_IDENTIFIER']
-
-                    # prevent recursive syslog loop
-                    if common.SERVICE_NAME in message:
+                self._listen()
+            except Exception as e:
+                common.log.error('bluez error', e)
+                # reconnect after bluetoothd/dbus restart
+                self.stopping.wait(self.period_s)
+
+    def _listen(self):
+        common.import_module('jeepney.bus_messages')
+        common.import_module('jeepney.io.blocking')
+        common.import_module('jeepney.wrappers')
+        jeepney = common.import_module('jeepney')
+
+        signals = [
+            (self.PROPERTIES_INTERFACE, 'PropertiesChanged', dict(path_namespace=self.BLUEZ_PATH)),
+            (self.OBJECT_MANAGER_INTERFACE, 'InterfacesAdded', {}),
+            (self.OBJECT_MANAGER_INTERFACE, 'InterfacesRemoved', {}),
+        ]
+
+        with jeepney.io.blocking.open_dbus_connection(bus=self.bus) as connection:
+            # only subscribed signals are routed to us by the bus, so the local filter catches all of them
+            with connection.filter(jeepney.MatchRule(type='signal'), bufsize=64) as queue:
+                for interface, member, kwargs in signals:
+                    rule = jeepney.MatchRule(
+                        type='signal', sender=self.BLUEZ_SERVICE, interface=interface, member=member, **kwargs)
+                    connection.send_and_get_reply(jeepney.bus_messages.message_bus.AddMatch(rule))
+
+                # subscribe before reading initial state to not lose changes between calls
+                address = jeepney.DBusAddress(
+                    '/', bus_name=self.BLUEZ_SERVICE, interface=self.OBJECT_MANAGER_INTERFACE)
+                reply = connection.send_and_get_reply(jeepney.new_method_call(address, 'GetManagedObjects'))
+                self.devices = {}
+                for path, interfaces in jeepney.wrappers.unwrap_msg(reply)[0].items():
+                    self._update_device(path, interfaces)
+                self._update_state()
+
+                while not self.stopping.is_set():
+                    try:
+                        message = connection.recv_until_filtered(queue, timeout=self.period_s)
+                    except TimeoutError:
                         continue
+                    self._handle_signal(message)
+
+    def _handle_signal(self, message):
+        jeepney = common.import_module('jeepney')
+        member = message.header.fields.get(jeepney.HeaderFields.member)
+        if member == 'PropertiesChanged':
+            interface, changed, _ = message.body
+            self._update_device(message.header.fields[jeepney.HeaderFields.path], {interface: changed})
+        elif member == 'InterfacesAdded':
+            path, interfaces = message.body
+            self._update_device(path, interfaces)
+        elif member == 'InterfacesRemoved':
+            path, interfaces = message.body
+            if self.DEVICE_INTERFACE in interfaces:
+                self.devices.pop(path, None)
+            elif self.BATTERY_INTERFACE in interfaces and path in self.devices:
+                self.devices[path].pop('bat_level', None)
+        else:
+            return
+        self._update_state()
 
-                    common.log.info(id, message)
-
-                    if 'pulseaudio' in id:
-                        bat_lvl_array = re.findall('Battery Level: ([0-9]+)%', message)
-                        if bat_lvl_array:
-                            self.bat_level = int(bat_lvl_array[0]) / 100
-                            self.connected = True
-                            common.log.info('bt device bat lvl', self.bat_level)
-                    elif 'bluetoothd' in id:
-                        if 'disconnected' in message:
-                            self.connected = False
-                            common.log.info('disconnected bt device')
-                        elif 'ready' in message:
-                            self.connected = True
-                            common.log.info('connected bt device')
+    def _update_device(self, path: str, interfaces: typing.Dict[str, typing.Dict[str, typing.Tuple[str, typing.Any]]]):
+        # property values are variants: (signature, value)
+        device_properties = interfaces.get(self.DEVICE_INTERFACE, {})
+        battery_properties = interfaces.get(self.BATTERY_INTERFACE, {})
+        if not device_properties and not battery_properties:
+            return
 
-            except Exception as e:
-                common.log.error(e)
+        device = self.devices.setdefault(path, {'connected': False})
+        if 'Connected' in device_properties:
+            device['connected'] = bool(device_properties['Connected'][1])
+            common.log.info('connected' if device['connected'] else 'disconnected', 'bt device', path)
+        if 'Percentage' in battery_properties:
+            device['bat_level'] = battery_properties['Percentage'][1] / 100
+            common.log.debug('bt device bat lvl', path, device['bat_level'])
+
+    def _update_state(self):
+        connected = [device for device in self.devices.values() if device['connected']]
+        self.bat_level = next((device['bat_level'] for device in connected if 'bat_level' in device), 0.0)
+        self.connected = bool(connected)
 
     def is_connected(self) -> bool:
         return self.connected
@@ -186,16 +142,97 @@ class Bluetooth:
         return self.bat_level
 
     def stop(self):
+        # the listener wakes up on the receive timeout
         self.stopping.set()
+        self.theead.join()
+
+
+class ProtocolHealth:
+    FILES = (PROC_NET_PATH / 'snmp', PROC_NET_PATH / 'netstat')
+
+    def __init__(self):
+        self.files = common.OpenFiles()
+        self.keys = [key for counters in PROTOCOL_RATES.values() for key in counters]
+        # positions of the counters in the value tokens of every file and the header lines they were found in,
+        # the kernel inserts IcmpMsg lines and columns when an ICMP type is first seen
+        self.positions: typing.Dict[pathlib.Path, typing.List[typing.Tuple[int, int]]] = {}
+        self.headers: typing.Dict[pathlib.Path, typing.List[str]] = {}
+        self.counters: typing.Optional[typing.List[int]] = None
+        self.counters_time = time.monotonic()
+
+        for attr in PROTOCOL_RATES:
+            setattr(self, attr, 0.0)
+        self.retrans_percent = 0.0
+
+    def _index(self, path: pathlib.Path, lines: typing.List[str]) -> typing.List[typing.Tuple[int, int]]:
+        # "Tcp: RtoAlgorithm RtoMin ..." header line followed by "Tcp: 1 200 ..." value line
+        names = {}
+        offset = 0
+        for header, values in zip(lines[0::2], lines[1::2]):
+            header_tokens = header.split()
+            proto = header_tokens[0].rstrip(':')
+            for i, name in enumerate(header_tokens[1:]):
+                names[(proto, name)] = offset + i
+            offset += len(header_tokens) - 1
+        positions = [(k, names[key]) for k, key in enumerate(self.keys) if key in names]
+        common.log.debug('protocol counters', path, len(positions))
+        return positions
+
+    def _read_counters(self) -> typing.List[int]:
+        counters = [0] * len(self.keys)
+        for path in self.FILES:
+            data = self.files.read(path, PROC_NET_READ_SIZE)
+            if not data:
+                continue
+            lines = data.splitlines()
+            headers = lines[0::2]
+            if headers != self.headers.get(path):
+                self.headers[path] = headers
+                self.positions[path] = self._index(path, lines)
+            tokens = [token for line in lines[1::2] for token in line.split()[1:]]
+            for k, position in self.positions[path]:
+                counters[k] = int(tokens[position])
+        return counters
+
+    def calculate(self, now: float):
+        counters_prev = self.counters
+        counters_time_prev = self.counters_time
+
+        self.counters = self._read_counters()
+        self.counters_time = now
+
+        time_diff = self.counters_time - counters_time_prev
+        if counters_prev is None or time_diff <= 0:
+            return
+
+        deltas = [max(next - prev, 0) for next, prev in zip(self.counters, counters_prev)]
+        k = 0
+        for attr, counters in PROTOCOL_RATES.items():
+            setattr(self, attr, sum(deltas[k:k + len(counters)]) / time_diff)
+            k += len(counters)
+
+        self.retrans_percent = self.retrans_per_s / self.out_segs_per_s * 100 if self.out_segs_per_s else 0.0
+
+    def stop(self):
+        self.files.close()
+
+    def __str__(self):
+        return '[{} R% {} LO {} UE {} RS]'.format(
+            common.convert_4(self.retrans_percent),
+            common.convert_4(self.listen_overflows_per_s),
+            common.convert_4(self.udp_rcvbuf_errors_per_s + self.udp_errors_per_s),
+            common.convert_4(self.resets_per_s),
+        )
 
 
 class WlanDevice:
     SIOCGIWRATE = 0x8B21  # get default bit rate (bps)
     IFNAMSIZE = 16
 
-    def __init__(self, iface: str):
+    def __init__(self, iface: str, sockfd: socket.socket):
         self.iface = iface
-        self.sockfd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # ioctl socket of Wlan, a socket per probed interface was a socket per tick without wlan
+        self.sockfd = sockfd
         self.fmt = "ibbH"
 
     def iw_get_bitrate(self) -> typing.Optional[int]:
@@ -243,13 +280,14 @@ class Wlan:
     def __init__(self):
         self.device = None
         self.bitrate_mbitps = None
+        self.sockfd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
     def calculate_wlan_bitrate(self):
         if self._calculate_wlan_bitrate_for_iface():
             return
 
-        for iface in netifaces.interfaces():
-            self.device = WlanDevice(iface)
+        for iface in common.import_module('netifaces').interfaces():
+            self.device = WlanDevice(iface, self.sockfd)
             if self._calculate_wlan_bitrate_for_iface():
                 common.log.info('found wlan divece', self.device)
                 return
@@ -263,25 +301,30 @@ class Wlan:
                 return True
         return False
 
+    def stop(self):
+        self.sockfd.close()
+
 
 class Network:
-    def __init__(self, period_s: float):
+    def __init__(self, period_s: float, ping: bool = True, wlan: bool = True):
         self.net_counters = psutil.net_io_counters()
-        self.counters_time = time.time()
+        self.counters_time = time.monotonic()
 
         self.ping_ms = None
         self.period_s = period_s
         self.stopping = threading.Event()
-        self.ping_theead = threading.Thread(target=self._ping_loop)
-        self.ping_theead.start()
+        self.ping_theead = threading.Thread(target=self._ping_loop) if ping else None
+        if self.ping_theead:
+            self.ping_theead.start()
 
         self.recv_mbps = 0
         self.send_mbps = 0
 
-        self.wlan = Wlan()
+        self.wlan = Wlan() if wlan else None
 
     def _ping_loop(self):
         timeout = 5
+        ping3 = common.import_module('ping3')
 
         while not self.stopping.is_set():
             try:
@@ -289,29 +332,35 @@ class Network:
             except Exception as e:
                 common.log.debug('ping error', e)
                 self.ping_ms = None
-            time.sleep(self.period_s)
+            self.stopping.wait(self.period_s)
 
-    def calculate(self):
+    def calculate(self, now: float):
         net_counters_prev = self.net_counters
         counters_time_prev = self.counters_time
 
         self.net_counters = psutil.net_io_counters()
-        self.counters_time = time.time()
+        self.counters_time = now
 
         time_diff = self.counters_time - counters_time_prev
 
         self.recv_mbps = (self.net_counters.bytes_recv - net_counters_prev.bytes_recv) / time_diff / 1024 / 1024
         self.send_mbps = (self.net_counters.bytes_sent - net_counters_prev.bytes_sent) / time_diff / 1024 / 1024
 
-        self.wlan.calculate_wlan_bitrate()
+        if self.wlan:
+            self.wlan.calculate_wlan_bitrate()
 
     def stop(self):
         self.stopping.set()
+        if self.ping_theead:
+            # at most the ping timeout
+            self.ping_theead.join()
+        if self.wlan:
+            self.wlan.stop()
 
     def __str__(self):
         return '[{} MB/s {} MB/s {:4} ms {:3} WF]'.format(
             common.convert_4(self.recv_mbps),
             common.convert_4(self.send_mbps),
             round(self.ping_ms) if self.ping_ms else '****',
-            round(self.wlan.bitrate_mbitps) if self.wlan.bitrate_mbitps else '***'
+            round(self.wlan.bitrate_mbitps) if self.wlan and self.wlan.bitrate_mbitps else '***'
         )
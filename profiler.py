@@ -0,0 +1,162 @@
+import collections
+import os
+import pathlib
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+import typing
+
+import common
+
+# sampling period of the thread stacks, a sample of 10 threads costs about 100 us
+SAMPLE_INTERVAL_S = 0.005
+TOP_SIZE = 30
+TRACE_FRAMES = 10
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+TASK_PATH = pathlib.Path('/proc/self/task')
+
+
+def get_thread_cpu_s() -> typing.Dict[int, float]:
+    """User and system time of every thread of the process by native id."""
+    cpu = {}
+    for task in TASK_PATH.iterdir():
+        try:
+            # comm can contain spaces, the fields after it are split from the closing bracket
+            fields = (task / 'stat').read_text().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        cpu[int(task.name)] = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    return cpu
+
+
+def format_frame(code, line: typing.Optional[int] = None) -> str:
+    name = '{}:{}'.format(os.path.basename(code.co_filename), code.co_name)
+    return name if line is None else '{}:{}'.format(name, line)
+
+
+class Profiler:
+    """
+    On demand profiling of a running process.
+    SIGUSR1 samples the stacks of all threads for duration_s in a background thread, cProfile would only see the
+    thread it is enabled in. SIGUSR2 starts tracemalloc, then writes the top allocations against the previous
+    SIGUSR2 snapshot. Reports are written next to the savefile, collection goes on meanwhile.
+    """
+
+    def __init__(self, savefile: pathlib.Path, duration_s: float):
+        self.savefile = savefile
+        self.duration_s = duration_s
+        self.sampler: typing.Optional[threading.Thread] = None
+        self.heap_lock = threading.Lock()
+        self.heap_snapshot: typing.Optional[tracemalloc.Snapshot] = None
+
+    def install(self):
+        # called from the main thread, handlers only start threads
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.start_profile())
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self.start_heap_dump())
+        common.log.info('profiler signals', os.getpid(), profile='SIGUSR1', heap='SIGUSR2')
+
+    def get_path(self, kind: str, suffix: str) -> pathlib.Path:
+        return self.savefile.with_name('{}.{}.{}{}'.format(
+            self.savefile.stem, kind, time.strftime('%Y%m%d-%H%M%S'), suffix))
+
+    def start_profile(self):
+        if self.sampler and self.sampler.is_alive():
+            common.log.info('profile already running')
+            return
+        self.sampler = threading.Thread(target=self._profile, name='profiler', daemon=True)
+        self.sampler.start()
+
+    def start_heap_dump(self):
+        threading.Thread(target=self._heap_dump, name='heap dump', daemon=True).start()
+
+    def _profile(self):
+        common.log.info('profile started', self.duration_s)
+        own = threading.get_ident()
+        # thread name, then frames from the outermost
+        stacks: typing.Counter[typing.Tuple[str, ...]] = collections.Counter()
+        # leaf line per thread, the self time
+        lines: typing.Dict[str, typing.Counter[str]] = collections.defaultdict(collections.Counter)
+        samples = 0
+        cpu_start = get_thread_cpu_s()
+        process_start = time.process_time()
+        start = time.monotonic()
+        end = start + self.duration_s
+        while time.monotonic() < end:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                name = names.get(ident, str(ident))
+                lines[name][format_frame(frame.f_code, frame.f_lineno)] += 1
+                stack = []
+                while frame is not None:
+                    stack.append(format_frame(frame.f_code))
+                    frame = frame.f_back
+                stacks[(name,) + tuple(reversed(stack))] += 1
+            samples += 1
+            time.sleep(SAMPLE_INTERVAL_S)
+        elapsed_s = time.monotonic() - start
+        process_s = time.process_time() - process_start
+        cpu_end = get_thread_cpu_s()
+
+        native_names = {thread.native_id: thread.name for thread in threading.enumerate()}
+        thread_cpu = sorted(
+            ((cpu_end[tid] - cpu_start.get(tid, 0), native_names.get(tid, str(tid))) for tid in cpu_end), reverse=True)
+
+        report = ['profile {:.1f} s, {} samples every {:.0f} ms, process cpu {:.2f} s (sampler included)'.format(
+            elapsed_s, samples, SAMPLE_INTERVAL_S * 1000, process_s), '', 'thread cpu s:']
+        report += ['{:8.2f}  {}'.format(cpu_s, name) for cpu_s, name in thread_cpu]
+        report += ['', 'top lines per thread, blocked threads are sampled on their waiting line:']
+        for name, counter in sorted(lines.items()):
+            report.append(name)
+            report += ['{:8} {:6.1%}  {}'.format(count, count / samples, line)
+                       for line, count in counter.most_common(TOP_SIZE // 3)]
+
+        path = self.get_path('profile', '.txt')
+        folded_path = path.with_suffix('.folded')
+        try:
+            path.write_text('\n'.join(report) + '\n')
+            # flamegraph.pl and speedscope input
+            folded_path.write_text(''.join(
+                '{} {}\n'.format(';'.join(stack), count) for stack, count in stacks.most_common()))
+        except OSError as e:
+            common.log.error('profile write error', path, e)
+            return
+        common.log.info('profile written', path, folded_path)
+
+    def _heap_dump(self):
+        with self.heap_lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACE_FRAMES)
+                self.heap_snapshot = None
+                common.log.info('tracemalloc started, the next SIGUSR2 writes the diff')
+                return
+
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            size, peak = tracemalloc.get_traced_memory()
+            report = ['traced {:.1f} MB, peak {:.1f} MB, tracemalloc overhead {:.1f} MB'.format(
+                size / 2 ** 20, peak / 2 ** 20, tracemalloc.get_tracemalloc_memory() / 2 ** 20), '']
+            if self.heap_snapshot is None:
+                report.append('top allocations since tracing started:')
+                report += [str(stat) for stat in snapshot.statistics('lineno')[:TOP_SIZE]]
+            else:
+                report.append('top allocation changes since the previous dump:')
+                report += [str(stat) for stat in snapshot.compare_to(self.heap_snapshot, 'lineno')[:TOP_SIZE]]
+                report += ['', 'tracebacks of the top growth:']
+                for stat in snapshot.compare_to(self.heap_snapshot, 'traceback')[:TOP_SIZE // 10]:
+                    report.append('{:+.1f} kB in {:+} blocks'.format(stat.size_diff / 1024, stat.count_diff))
+                    report += stat.traceback.format()
+            self.heap_snapshot = snapshot
+
+            path = self.get_path('heap', '.txt')
+            try:
+                path.write_text('\n'.join(report) + '\n')
+            except OSError as e:
+                common.log.error('heap dump write error', path, e)
+                return
+            common.log.info('heap dump written', path)
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import math
+import os
+import pathlib
+import socket
+import struct
+import threading
+import time
+import typing
+
+import numpy as np
+
+import common
+import tsdb
+
+SOCKET_MODE = 0o660
+
+# little endian length of the json header, the header, then the float64 payload
+HEADER_SIZE = struct.Struct('<I')
+PAYLOAD_DTYPE = '<f8'
+MAX_POINTS = 100000
+# 80 MB of float64, longer raw ranges are to be downsampled
+MAX_RAW_VALUES = 10000000
+
+DOWNSAMPLE_AGGREGATES = ('min', 'max', 'avg', 'count')
+
+
+class QueryError(Exception):
+    pass
+
+
+def get_aggregate(values: np.ndarray, name: str) -> float:
+    # values are one field, nan ticks are the ones the field was not collected
+    values = values[~np.isnan(values)]
+    if name == 'count':
+        return float(len(values))
+    if not len(values):
+        return float('nan')
+    if name == 'min':
+        return float(values.min())
+    if name == 'max':
+        return float(values.max())
+    if name == 'avg':
+        return float(values.mean())
+    if name.startswith('p') and name[1:].replace('.', '', 1).isdigit() and float(name[1:]) <= 100:
+        return float(np.percentile(values, float(name[1:])))
+    raise QueryError('unknown aggregate {}'.format(name))
+
+
+def downsample(times: np.ndarray, values: np.ndarray, start_s: float, end_s: float, points: int,
+               aggregates: typing.Sequence[str]) -> np.ndarray:
+    """Row of bucket centers then a row per field and aggregate, empty buckets are nan."""
+    bucket_s = (end_s - start_s) / points
+    buckets = np.clip(((times - start_s) / bucket_s).astype(np.int64), 0, points - 1)
+    rows = [start_s + (np.arange(points) + 0.5) * bucket_s]
+    for field_values in values:
+        valid = ~np.isnan(field_values)
+        field_buckets = buckets[valid]
+        field_values = field_values[valid]
+        count = np.bincount(field_buckets, minlength=points).astype(float)
+        for name in aggregates:
+            if name == 'count':
+                rows.append(count)
+                continue
+            if name == 'avg':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    row = np.bincount(field_buckets, weights=field_values, minlength=points) / count
+            else:
+                row = np.full(points, np.inf if name == 'min' else -np.inf)
+                (np.minimum if name == 'min' else np.maximum).at(row, field_buckets, field_values)
+            row[count == 0] = np.nan
+            rows.append(row)
+    return np.array(rows)
+
+
+class QueryServer:
+    """
+    Range queries to the collector history over a unix socket.
+    A request is a json line:
+        {"fields": ["cpu.temp_c"], "start": -3600, "end": null, "mode": "aggregate", "aggregates": ["max", "p95"]}
+    start and end are monotonic seconds, negative are relative to now, start 0 is since boot.
+    Modes:
+        raw: rows are times then a row per field, at most MAX_RAW_VALUES values
+        downsample: "points" buckets, rows are bucket centers then a row per field and aggregate of min/max/avg/count
+        aggregate: a row per field with a column per aggregate of min/max/avg/count/pNN
+    A reply is a little endian uint32 length of a json header with "shape" or "error" and the float64 payload:
+        np.frombuffer(payload, header['dtype']).reshape(header['shape'])
+    """
+
+    def __init__(self, history: tsdb.History, path: pathlib.Path):
+        self.history = history
+        self.path = path
+        self.loop = asyncio.new_event_loop()
+        self.server: typing.Optional[asyncio.AbstractServer] = None
+        self.thread = threading.Thread(target=self._run, name='query')
+        self.started = threading.Event()
+
+    def start(self):
+        self.thread.start()
+        self.started.wait()
+
+    def stop(self):
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            if self.path.is_socket():
+                self.path.unlink()
+            self.server = self.loop.run_until_complete(asyncio.start_unix_server(self._serve, str(self.path)))
+            os.chmod(self.path, SOCKET_MODE)
+            common.log.info('query socket', self.path)
+        except OSError as e:
+            common.log.error('query socket error', self.path, e)
+            self.started.set()
+            return
+        self.started.set()
+
+        self.loop.run_forever()
+        self.server.close()
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.run_until_complete(self.loop.shutdown_default_executor())
+        self.path.unlink(missing_ok=True)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError as e:
+                    # a line over the stream limit, the rest of it can't be told from the next request
+                    await self._reply(writer, {'error': 'request too long: {}'.format(e)}, np.empty(0))
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    # decoding a long range takes a while, other clients are served meanwhile
+                    header, payload = await self.loop.run_in_executor(None, self.handle, request)
+                except (QueryError, ValueError, TypeError, KeyError, OverflowError) as e:
+                    header, payload = {'error': str(e)}, np.empty(0)
+                await self._reply(writer, header, payload)
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            common.log.debug('query client error', e)
+        except asyncio.CancelledError:
+            # server stop, the connection is closed below
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _reply(writer: asyncio.StreamWriter, header: dict, payload: np.ndarray):
+        data = json.dumps(header).encode()
+        writer.write(HEADER_SIZE.pack(len(data)) + data)
+        writer.write(payload.astype(PAYLOAD_DTYPE, copy=False).tobytes())
+        await writer.drain()
+
+    def handle(self, request: dict) -> typing.Tuple[dict, np.ndarray]:
+        fields = request['fields']
+        if isinstance(fields, str):
+            fields = [fields]
+        unknown = [field for field in fields if field not in self.history.index]
+        if unknown:
+            raise QueryError('unknown fields {}'.format(', '.join(unknown)))
+
+        now = time.monotonic()
+        start_s = float(request.get('start') or 0)
+        end_s = request.get('end')
+        end_s = now if end_s is None else float(end_s)
+        if not (math.isfinite(start_s) and math.isfinite(end_s)):
+            raise QueryError('start and end must be finite')
+        start_s = now + start_s if start_s < 0 else start_s
+        end_s = now + end_s if end_s < 0 else end_s
+        if end_s <= start_s:
+            raise QueryError('empty range')
+
+        times, values = self.history.get_range(fields, start_s, end_s)
+        mode = request.get('mode', 'raw')
+        aggregates = request.get('aggregates') or ['avg']
+        if mode == 'raw':
+            if len(times) * (len(fields) + 1) > MAX_RAW_VALUES:
+                raise QueryError('raw range of {} ticks is too long, use downsample'.format(len(times)))
+            payload = np.vstack([times, values])
+        elif mode == 'downsample':
+            points = int(request.get('points', 100))
+            if not 0 < points <= MAX_POINTS:
+                raise QueryError('points out of range')
+            unknown = [name for name in aggregates if name not in DOWNSAMPLE_AGGREGATES]
+            if unknown:
+                raise QueryError('unknown downsample aggregates {}'.format(', '.join(unknown)))
+            payload = downsample(times, values, start_s, end_s, points, aggregates)
+        elif mode == 'aggregate':
+            payload = np.array([[get_aggregate(field_values, name) for name in aggregates] for field_values in values])
+            payload = payload.reshape(len(fields), len(aggregates))
+        else:
+            raise QueryError('unknown mode {}'.format(mode))
+
+        header = {
+            'fields': fields,
+            'mode': mode,
+            'aggregates': aggregates if mode != 'raw' else [],
+            'start': start_s,
+            'end': end_s,
+            'ticks': len(times),
+            'dtype': PAYLOAD_DTYPE,
+            'shape': payload.shape,
+        }
+        return header, payload
+
+
+def query(request: dict, path: pathlib.Path = common.QUERY_SOCKET) -> typing.Tuple[dict, np.ndarray]:
+    """Client of QueryServer, one request per connection."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(path))
+        client.sendall(json.dumps(request).encode() + b'\n')
+        stream = client.makefile('rb')
+        size, = HEADER_SIZE.unpack(stream.read(HEADER_SIZE.size))
+        header = json.loads(stream.read(size))
+        if 'error' in header:
+            raise QueryError(header['error'])
+        shape = header['shape']
+        payload = stream.read(int(np.prod(shape)) * np.dtype(header['dtype']).itemsize)
+        return header, np.frombuffer(payload, header['dtype']).reshape(shape)
@@ -0,0 +1,153 @@
+import math
+import operator
+import typing
+
+import common
+
+
+Metric = typing.Union[str, typing.Callable[[typing.Any], typing.Optional[float]]]
+
+
+def get_metric(info, metric: Metric) -> typing.Optional[float]:
+    # metric is a dotted attribute path of HardMonitorInfo like 'cpu.temp_c' or a callable
+    try:
+        if callable(metric):
+            return metric(info)
+        return operator.attrgetter(metric)(info)
+    except (AttributeError, TypeError, ZeroDivisionError):
+        return None
+
+
+class Slope:
+    """Exponentially weighted least squares slope. O(1) state and work per sample."""
+
+    def __init__(self, window_s: float):
+        self.window_s = window_s
+        self.last_time: typing.Optional[float] = None
+        # weighted sums with time origin moved to the last sample
+        self.s_w = 0.0
+        self.s_t = 0.0
+        self.s_v = 0.0
+        self.s_tt = 0.0
+        self.s_tv = 0.0
+
+    def add(self, value: float, now: float) -> typing.Optional[float]:
+        if self.last_time is not None:
+            d = now - self.last_time
+            if d <= 0:
+                return None
+            decay = math.exp(-d / self.window_s)
+            # shift origin to now, then decay old samples
+            self.s_tt = (self.s_tt - 2 * d * self.s_t + d * d * self.s_w) * decay
+            self.s_tv = (self.s_tv - d * self.s_v) * decay
+            self.s_t = (self.s_t - d * self.s_w) * decay
+            self.s_v *= decay
+            self.s_w *= decay
+        self.last_time = now
+
+        self.s_w += 1
+        self.s_v += value
+
+        denominator = self.s_w * self.s_tt - self.s_t * self.s_t
+        if denominator <= 0:
+            return None
+        return (self.s_w * self.s_tv - self.s_t * self.s_v) / denominator
+
+
+class Rule:
+    def __init__(
+            self,
+            name: str,
+            metric: Metric,
+            limit: typing.Union[float, Metric],
+            hysteresis: float = 0.0,
+            for_s: float = 0.0,
+            clear_for_s: float = 0.0,
+            rate_window_s: typing.Optional[float] = None,
+            rate_unit_s: float = 1.0,
+            message: str = '{name} {value:.1f}/{limit:.1f}'):
+        """
+        Fire when the metric value is >= limit for for_s seconds.
+        Clear when the value is < limit - hysteresis for clear_for_s seconds.
+        With rate_window_s the value is the rate of change of the metric per rate_unit_s.
+        The message gets the name, the current value and limit, the peak and the total of the values while active,
+        a value held by clear_for_s can already be back to normal.
+        """
+        self.name = name
+        self.metric = metric
+        self.limit = limit
+        self.hysteresis = hysteresis
+        self.for_s = for_s
+        self.clear_for_s = clear_for_s
+        self.rate_unit_s = rate_unit_s
+        self.slope = Slope(rate_window_s) if rate_window_s else None
+        self.message = message
+
+        self.active = False
+        self.pending_since: typing.Optional[float] = None
+        self.value = 0.0
+        self.current_limit = 0.0
+        self.peak = 0.0
+        self.total = 0.0
+
+    def evaluate(self, info, now: float) -> typing.Optional[common.Alarm]:
+        value = get_metric(info, self.metric)
+        limit = self.limit if isinstance(self.limit, (int, float)) else get_metric(info, self.limit)
+        if value is None or limit is None:
+            return self._alarm()
+
+        if self.slope:
+            slope = self.slope.add(value, now)
+            if slope is None:
+                return self._alarm()
+            value = slope * self.rate_unit_s
+
+        self.value = value
+        self.current_limit = limit
+
+        if self.active:
+            crossed, duration_s = value < limit - self.hysteresis, self.clear_for_s
+        else:
+            crossed, duration_s = value >= limit, self.for_s
+
+        if not crossed:
+            self.pending_since = None
+        else:
+            if self.pending_since is None:
+                self.pending_since = now
+            if now - self.pending_since >= duration_s:
+                self.active = not self.active
+                self.pending_since = None
+                if self.active:
+                    self.peak = value
+                    self.total = 0.0
+
+        if self.active:
+            self.peak = max(self.peak, value)
+            self.total += value
+        return self._alarm()
+
+    def _alarm(self) -> typing.Optional[common.Alarm]:
+        if self.active:
+            return common.Alarm(self.name, self.message.format(
+                name=self.name, value=self.value, limit=self.current_limit, peak=self.peak, total=self.total))
+        return None
+
+
+class RuleEngine:
+    def __init__(self, rules: typing.Iterable[Rule]):
+        self.rules = list(rules)
+
+    def add(self, rule: Rule):
+        self.rules.append(rule)
+
+    def remove(self, rule: Rule):
+        self.rules.remove(rule)
+
+    def evaluate(self, info, now: float) -> typing.List[common.Alarm]:
+        alarms = []
+        for rule in self.rules:
+            alarm = rule.evaluate(info, now)
+            if alarm:
+                alarms.append(alarm)
+        return alarms
@@ -0,0 +1,170 @@
+import pathlib
+import time
+import typing
+
+import common
+import rules
+import watchdog
+
+BOOT_ID_PATH = pathlib.Path('/proc/sys/kernel/random/boot_id')
+# difference of CLOCK_BOOTTIME and CLOCK_MONOTONIC growth between ticks which counts as suspend
+SUSPEND_MIN_S = 1.0
+
+
+class AdaptivePeriod:
+    """
+    Collection period shrunk while the values change or when an alarm is raised, kept at the base period under a steady
+    load and stretched only while the machine is idle, further when discharging.
+    Alarms held for a while and stale sources don't shrink the period, a faster tick shows nothing new about them.
+    """
+    MIN_FACTOR = 0.5
+    IDLE_MAX_FACTOR = 2
+    DISCHARGING_MAX_FACTOR = 4
+    STRETCH_FACTOR = 1.5
+    IDLE_TICKS = 5
+
+    # changes between ticks which count as activity
+    CPU_LOAD_DELTA = 0.3  # cores
+    DISK_DELTA_MBPS = 2
+    NETWORK_DELTA_MBPS = 0.2
+    # levels which are not idle even when flat, a steady full load is what the user is watching
+    CPU_BUSY_LOAD = 1.0  # cores
+    DISK_BUSY_MBPS = 10
+    NETWORK_BUSY_MBPS = 1
+
+    def __init__(self, base_period_s: float):
+        self.base_period_s = base_period_s
+        self.period_s = base_period_s
+        self.idle_ticks = 0
+        self.prev_values: typing.Optional[typing.Tuple[float, float, float]] = None
+        self.prev_alarms: typing.Set[str] = set()
+
+    def _get_values(self, info) -> typing.Tuple[float, float, float]:
+        return (
+            get_metric_or_zero(info, 'cpu.loadavg_current'),
+            get_metric_or_zero(info, 'disk.read_mbps') + get_metric_or_zero(info, 'disk.write_mbps'),
+            get_metric_or_zero(info, 'network.recv_mbps') + get_metric_or_zero(info, 'network.send_mbps'),
+        )
+
+    def update(self, info) -> float:
+        values = self._get_values(info)
+        prev_values = self.prev_values or values
+        self.prev_values = values
+
+        deltas = [abs(value - prev) for value, prev in zip(values, prev_values)]
+        active = (
+            deltas[0] > self.CPU_LOAD_DELTA or
+            deltas[1] > self.DISK_DELTA_MBPS or
+            deltas[2] > self.NETWORK_DELTA_MBPS
+        )
+        busy = (
+            values[0] >= self.CPU_BUSY_LOAD or
+            values[1] >= self.DISK_BUSY_MBPS or
+            values[2] >= self.NETWORK_BUSY_MBPS
+        )
+
+        alarms = {alarm.name for alarm in info.alarms if not alarm.name.startswith(watchdog.STALE_ALARM_PREFIX)}
+        raised = alarms - self.prev_alarms
+        self.prev_alarms = alarms
+
+        prev_period_s = self.period_s
+        if raised or active:
+            self.idle_ticks = 0
+            self.period_s = self.base_period_s * self.MIN_FACTOR
+        elif busy:
+            self.idle_ticks = 0
+            self.period_s = self.base_period_s
+        else:
+            self.idle_ticks += 1
+            charge_status = rules.get_metric(info, 'battery.charge_status')
+            discharging = charge_status is not None and not charge_status
+            max_factor = self.DISCHARGING_MAX_FACTOR if discharging else self.IDLE_MAX_FACTOR
+            if self.period_s < self.base_period_s:
+                # back to normal rate right after activity
+                self.period_s = self.base_period_s
+            elif self.idle_ticks >= self.IDLE_TICKS:
+                self.period_s = min(self.period_s * self.STRETCH_FACTOR, self.base_period_s * max_factor)
+            else:
+                self.period_s = min(self.period_s, self.base_period_s * max_factor)
+
+        if self.period_s != prev_period_s:
+            common.log.debug('period', round(self.period_s, 2), active=active, busy=busy, raised=sorted(raised))
+        return self.period_s
+
+
+def get_metric_or_zero(info, metric: rules.Metric) -> float:
+    value = rules.get_metric(info, metric)
+    return value if value is not None else 0.0
+
+
+def get_suspended_s() -> float:
+    # CLOCK_BOOTTIME keeps counting in suspend, CLOCK_MONOTONIC stops
+    try:
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - time.monotonic()
+    except (AttributeError, OSError):
+        return 0.0
+
+
+def monotonic_to_wall(monotonic_s: float) -> float:
+    return time.time() - (time.monotonic() - monotonic_s)
+
+
+def wall_to_monotonic(wall_s: float) -> float:
+    return time.monotonic() - (time.time() - wall_s)
+
+
+def get_boot_id() -> str:
+    # hardware counters start over on boot, saved counter values are only valid in the boot they were read in
+    try:
+        return BOOT_ID_PATH.read_text().strip()
+    except OSError:
+        return ''
+
+
+class Ticker:
+    """
+    Absolute tick deadlines on the monotonic clock, so collection time doesn't add up to the period.
+    Ticks missed under load are skipped instead of run back to back, missed ticks and suspend gaps are counted.
+    """
+    # timers can fire a bit before the deadline
+    EARLY_S = 0.005
+
+    def __init__(self, period_s: float):
+        self.period_s = period_s
+        self.deadline = time.monotonic()
+        self.suspended_s = get_suspended_s()
+
+        self.skipped_ticks = 0
+        self.suspend_gap_s = 0.0
+
+    def set_period(self, period_s: float):
+        # the next deadline is one new period after the last tick
+        self.deadline += period_s - self.period_s
+        self.period_s = period_s
+
+    def tick(self) -> float:
+        """Timestamp of this tick for all collectors."""
+        now = time.monotonic()
+
+        suspended_s = get_suspended_s()
+        gap_s = suspended_s - self.suspended_s
+        self.suspended_s = suspended_s
+        if gap_s >= SUSPEND_MIN_S:
+            self.suspend_gap_s += gap_s
+            common.log.info('suspend gap', round(gap_s, 1), total_s=round(self.suspend_gap_s, 1))
+
+        if now + self.EARLY_S < self.deadline:
+            # wakeup between ticks keeps the deadlines
+            return now
+
+        late_s = now - self.deadline
+        if late_s >= self.period_s:
+            skipped = int(late_s // self.period_s)
+            self.skipped_ticks += skipped
+            self.deadline += skipped * self.period_s
+            common.log.info('skipped ticks', skipped, late_s=round(late_s, 3), total=self.skipped_ticks)
+        self.deadline += self.period_s
+        return now
+
+    def get_timeout(self) -> float:
+        return max(self.deadline - time.monotonic(), 0.0)
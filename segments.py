@@ -0,0 +1,68 @@
+import typing
+
+# log10 ranges of the rate graphs
+NETWORK_LOG_RANGE = (-1, 1.3)  # 0.1 - 20 mbps
+DISK_LOG_RANGE = (0, 2)  # 1 - 100 mbps
+
+
+class Series:
+    def __init__(self, name: str, metric: str,
+                 y_max: typing.Optional[str] = None,
+                 log_range: typing.Optional[typing.Tuple[float, float]] = None):
+        # without y_max and log_range the history maximum is the top of the sparkline
+        self.name = name
+        self.metric = metric
+        self.y_max = y_max
+        self.log_range = log_range
+
+
+class Segment:
+    def __init__(self, name: str, fields: typing.Sequence[str] = (), series: typing.Sequence[Series] = ()):
+        # name of the HardMonitorInfo attribute, its numeric fields and the series drawn by the terminal front end
+        self.name = name
+        self.fields = tuple('{}.{}'.format(name, field) for field in fields)
+        self.series = tuple(series)
+
+
+# every HardMonitorInfo segment in panel order, other info attributes are not shown
+SEGMENTS = (
+    Segment('cpu', ('loadavg_current', 'loadavg_1m', 'temp_c', 'power_w', 'cpu_count'), (
+        Series('load', 'cpu.loadavg_current', y_max='cpu.cpu_count'),
+        Series('temp', 'cpu.temp_c'))),
+    Segment('throttle', ('events_per_s', 'cap_ratio', 'crit_alarms'), (
+        Series('events', 'throttle.events_per_s'),)),
+    Segment('memory', ('used_gb', 'total_gb', 'swap_gb'), (
+        Series('used', 'memory.used_gb', y_max='memory.total_gb'),
+        Series('swap', 'memory.swap_gb'))),
+    Segment('pressure', (
+        'cpu_some_avg10', 'memory_some_avg10', 'memory_full_avg10', 'io_some_avg10', 'io_full_avg10', 'stall_events'), (
+        Series('cpu', 'pressure.cpu_some_avg10'),
+        Series('memory', 'pressure.memory_some_avg10'),
+        Series('io', 'pressure.io_some_avg10'))),
+    Segment('gpu', ('busy_percent', 'power_w', 'power_cap_w', 'temp_c', 'temp_crit_c'), (
+        Series('power', 'gpu.power_w', y_max='gpu.power_cap_w'),
+        Series('busy', 'gpu.busy_percent'))),
+    Segment('network', ('recv_mbps', 'send_mbps', 'ping_ms'), (
+        Series('recv', 'network.recv_mbps', log_range=NETWORK_LOG_RANGE),
+        Series('send', 'network.send_mbps', log_range=NETWORK_LOG_RANGE))),
+    Segment('protocol', (
+        'retrans_percent', 'resets_per_s', 'listen_overflows_per_s', 'udp_rcvbuf_errors_per_s', 'udp_errors_per_s'), (
+        Series('retrans', 'protocol.retrans_percent'),
+        Series('resets', 'protocol.resets_per_s'))),
+    Segment('disk', ('read_mbps', 'write_mbps', 'temp_c'), (
+        Series('write', 'disk.write_mbps', log_range=DISK_LOG_RANGE),
+        Series('read', 'disk.read_mbps', log_range=DISK_LOG_RANGE))),
+    Segment('battery', ('power_w', 'charge_now_wh', 'charge_full_wh', 'charge_status'), (
+        Series('charge', 'battery.charge_now_wh', y_max='battery.charge_full_wh'),)),
+    Segment('energy', ('core_w', 'uncore_w', 'dram_w', 'psys_w', 'total_wh'), (
+        Series('core', 'energy.core_w'),
+        Series('dram', 'energy.dram_w'))),
+    Segment('common'),
+    Segment('top_process'),
+    Segment('top_cgroup'),
+    Segment('top_network'),
+)
+
+NAMES = tuple(segment.name for segment in SEGMENTS)
+# numeric fields of all segments, the order is the layout of the snapshot value array
+FIELDS = tuple(field for segment in SEGMENTS for field in segment.fields)
@@ -0,0 +1,224 @@
+import math
+import mmap
+import pathlib
+import struct
+import time
+import typing
+import zlib
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import common
+import rules
+import segments
+
+
+# the field order is the layout of the value array, text of each segment is stored as is
+FIELDS = segments.FIELDS
+SEGMENTS = segments.NAMES
+
+TEXT_SIZE = 256
+ALARMS_SIZE = 1024
+STALE_PERIODS = 5
+
+# seq, layout id, monotonic tick time, period. CLOCK_MONOTONIC is the same for all processes
+HEADER = struct.Struct('<QQdd')
+LAYOUT_ID = zlib.crc32(' '.join(FIELDS + SEGMENTS).encode()) | TEXT_SIZE << 32 | ALARMS_SIZE << 48
+VALUES_OFFSET = HEADER.size
+TEXTS_OFFSET = VALUES_OFFSET + len(FIELDS) * 8
+ALARMS_OFFSET = TEXTS_OFFSET + len(SEGMENTS) * TEXT_SIZE
+SIZE = ALARMS_OFFSET + ALARMS_SIZE
+
+SHM_PATH = pathlib.Path('/dev/shm')
+
+
+def _write_text(buffer: memoryview, offset: int, size: int, text: str):
+    # u16 length prefix and utf-8 text cut to the slot size
+    data = text.encode('utf-8')[:size - 2]
+    buffer[offset:offset + 2] = struct.pack('<H', len(data))
+    buffer[offset + 2:offset + 2 + len(data)] = data
+
+
+def _read_text(buffer: memoryview, offset: int) -> str:
+    length, = struct.unpack_from('<H', buffer, offset)
+    return bytes(buffer[offset + 2:offset + 2 + length]).decode('utf-8', errors='ignore')
+
+
+class SnapshotWriter:
+    """Publish every tick into a fixed layout shared memory segment protected by a seqlock."""
+
+    def __init__(self, name: str, period_s: float):
+        try:
+            old = shared_memory.SharedMemory(name=name)
+            old.close()
+            old.unlink()
+            common.log.info('removed old snapshot', name)
+        except FileNotFoundError:
+            pass
+
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=SIZE)
+        self.buffer = self.shm.buf
+        self.seq = np.ndarray((1,), dtype=np.uint64, buffer=self.buffer, offset=0)
+        self.values = np.ndarray((len(FIELDS),), dtype=np.float64, buffer=self.buffer, offset=VALUES_OFFSET)
+        self.period_s = period_s
+        HEADER.pack_into(self.buffer, 0, 0, LAYOUT_ID, 0, period_s)
+        common.log.info('snapshot created', name, size=SIZE)
+
+    def publish(self, info):
+        values = [rules.get_metric(info, field) for field in FIELDS]
+
+        # odd seq means write in progress
+        self.seq[0] += 1
+        self.values[:] = [math.nan if value is None else value for value in values]
+        for i, segment in enumerate(SEGMENTS):
+            value = getattr(info, segment, None)
+            _write_text(self.buffer, TEXTS_OFFSET + i * TEXT_SIZE, TEXT_SIZE, '' if value is None else str(value))
+        _write_text(self.buffer, ALARMS_OFFSET, ALARMS_SIZE,
+                    '\n'.join('{}\t{}'.format(alarm.name, alarm.message) for alarm in info.alarms))
+        struct.pack_into('<dd', self.buffer, 16, info.get_time(), self.period_s)
+        self.seq[0] += 1
+
+    def close(self):
+        del self.seq
+        del self.values
+        self.buffer = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class Segment:
+    def __init__(self, text: str):
+        self.text = text
+
+    def __str__(self):
+        return self.text
+
+
+class SnapshotInfo:
+    def __init__(self, time_s: float, values: typing.Sequence[float], texts: typing.Sequence[str], alarms: str):
+        for segment, text in zip(SEGMENTS, texts):
+            setattr(self, segment, Segment(text) if text else None)
+        for field, value in zip(FIELDS, values):
+            segment, attr = field.split('.')
+            if getattr(self, segment) is not None:
+                setattr(getattr(self, segment), attr, None if math.isnan(value) else value)
+
+        self.alarms: typing.List[common.Alarm] = [
+            common.Alarm(*line.split('\t', 1)) for line in alarms.splitlines() if '\t' in line]
+        self.time_s = time_s
+
+    def get_time(self) -> float:
+        return self.time_s
+
+    def __str__(self):
+        return ' '.join(
+            str(value) for attr, value in self.__dict__.items() if attr in SEGMENTS and value is not None)
+
+
+class SnapshotReader:
+    """Read-only mapping of the collector snapshot. Has the HardMonitor interface used by ui.py and main.py."""
+    # a publish takes microseconds, the retries give up after ~10 ms of a writer stuck in the middle of one
+    RETRY_COUNT = 100
+    RETRY_SLEEP_S = 0.0001
+
+    def __init__(self, name: str):
+        self.path = SHM_PATH / name
+        self.mmap: typing.Optional[mmap.mmap] = None
+        self.rules = rules.RuleEngine([])
+
+    def _open(self) -> bool:
+        if self.mmap is not None:
+            return True
+        try:
+            with self.path.open('rb') as file:
+                self.mmap = mmap.mmap(file.fileno(), SIZE, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            common.log.debug('snapshot open error', self.path, e)
+            return False
+
+        buffer = memoryview(self.mmap)
+        _, layout_id, _, _ = HEADER.unpack_from(buffer, 0)
+        if layout_id != LAYOUT_ID:
+            common.log.error('snapshot layout mismatch', self.path, layout_id, LAYOUT_ID)
+            buffer.release()
+            self.close()
+            return False
+
+        self.buffer = buffer
+        self.seq = np.frombuffer(buffer, dtype=np.uint64, count=1, offset=0)
+        self.values = np.frombuffer(buffer, dtype=np.float64, count=len(FIELDS), offset=VALUES_OFFSET)
+        common.log.info('snapshot opened', self.path)
+        return True
+
+    def read_values(self, fields: typing.Sequence[str] = FIELDS) -> typing.Optional[typing.Tuple[float, np.ndarray]]:
+        """Consistent copy of the tick time and only the requested fields."""
+        if not self._open():
+            return None
+        index = [FIELDS.index(field) for field in fields]
+
+        def read():
+            return HEADER.unpack_from(self.buffer, 0)[2], self.values[index]
+        return self._read_consistent(read)
+
+    def _read_consistent(self, read: typing.Callable[[], typing.Any]) -> typing.Any:
+        # an odd seq is a write in progress, a changed seq a torn read
+        for _ in range(self.RETRY_COUNT):
+            seq = int(self.seq[0])
+            if not seq & 1:
+                result = read()
+                if int(self.seq[0]) == seq:
+                    return result
+            # the writer is another process, give it the cpu to finish
+            time.sleep(self.RETRY_SLEEP_S)
+        return None
+
+    def _read(self) -> typing.Optional[SnapshotInfo]:
+        if not self._open():
+            return None
+
+        def read():
+            texts = [_read_text(self.buffer, TEXTS_OFFSET + i * TEXT_SIZE) for i in range(len(SEGMENTS))]
+            _, _, time_s, period_s = HEADER.unpack_from(self.buffer, 0)
+            return time_s, period_s, self.values.copy(), texts, _read_text(self.buffer, ALARMS_OFFSET)
+        result = self._read_consistent(read)
+        if result is None:
+            return None
+
+        time_s, period_s, values, texts, alarms = result
+        info = SnapshotInfo(time_s, values, texts, alarms)
+        if time.monotonic() - time_s > period_s * STALE_PERIODS:
+            info.alarms.append(common.Alarm('Collector', 'collector stale'))
+            # remap on next read, a restarted collector creates a new segment
+            self.close()
+        return info
+
+    def get_info(self, now: typing.Optional[float] = None) -> SnapshotInfo:
+        info = self._read()
+        if info is None:
+            info = SnapshotInfo(now or time.monotonic(), [math.nan] * len(FIELDS), [''] * len(SEGMENTS), '')
+            info.alarms.append(common.Alarm('Collector', 'collector not running'))
+        info.alarms += self.rules.evaluate(info, info.get_time())
+        return info
+
+    def update_counters(self, now: typing.Optional[float] = None):
+        pass
+
+    def add_wakeup_listener(self, listener: typing.Callable[[], None]):
+        pass
+
+    def load_json(self, file: pathlib.Path) -> bool:
+        return True
+
+    def save_json(self, file: pathlib.Path) -> None:
+        pass
+
+    def stop(self):
+        self.close()
+
+    def close(self):
+        if self.mmap is not None:
+            self.seq = None
+            self.values = None
+            self.buffer = None
+            self.mmap = None
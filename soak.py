@@ -0,0 +1,161 @@
+import argparse
+import csv
+import pathlib
+import sys
+import tempfile
+import time
+import typing
+
+import numpy as np
+import psutil
+
+# sets the offscreen Qt platform before the Qt import
+import bench_ui
+from PyQt5.QtWidgets import QApplication
+
+import common
+import graph
+import hard_monitor
+import strip
+
+RESOURCES = ('rss_mb', 'fds', 'threads', 'children')
+# growth over the measured part of the run which fails the soak
+LIMITS = {'rss_mb': 16, 'fds': 1, 'threads': 1, 'children': 1}
+
+
+def get_resources(process: psutil.Process) -> typing.Tuple[float, int, int, int]:
+    # os threads, the qt and collector threads included
+    return (process.memory_info().rss / 2 ** 20, process.num_fds(), process.num_threads(),
+            len(process.children(recursive=True)))
+
+
+def get_growth(ticks: np.ndarray, values: np.ndarray) -> float:
+    """Growth of the least squares line over the ticks, transient spikes average out."""
+    if len(ticks) < 2:
+        return 0.0
+    slope = np.polyfit(ticks, values, 1)[0]
+    return float(slope * (ticks[-1] - ticks[0]))
+
+
+class Soak:
+    """
+    Weeks of ticks in minutes: sources and graphs are driven by a virtual clock advancing period_s per tick,
+    with no sleep between ticks. Threads of the collectors still run on real time.
+    """
+
+    def __init__(self, args, savefile: pathlib.Path):
+        self.args = args
+        if args.source == 'monitor':
+            self.monitor = hard_monitor.HardMonitor(
+                args.period, disabled=args.disable, savefile=savefile, source_timeout_s=args.source_timeout)
+        else:
+            self.monitor = None
+        self.synthetic = bench_ui.SyntheticMonitor(args.period, args.cores)
+        self.start_s = time.monotonic()
+
+        self.app = QApplication(sys.argv) if args.renderer != 'none' else None
+        self.graph_list = None
+        self.widget = None
+        if self.app:
+            config = graph.GraphConfig(period_s=args.period, graph_height=args.graph_height,
+                                       total_time_s=args.graph_time, cpu_heatmap=args.cpu_heatmap)
+            self.graph_list = strip.StripList(config) if args.renderer == 'strip' else graph.GraphList(config)
+            self.widget = graph.create_widget()
+            self.widget.setLayout(self.graph_list.graph_layout)
+            self.widget.show()
+
+    def tick(self, i: int):
+        now = self.start_s + i * self.args.period
+        if self.monitor:
+            info = self.monitor.get_info(now)
+        else:
+            info = self.synthetic.get_info()
+        if self.graph_list:
+            self.graph_list.update(info)
+            if i % self.args.paint_every == 0:
+                self.app.processEvents()
+
+    def stop(self):
+        if self.monitor:
+            self.monitor.stop()
+        if self.widget:
+            self.widget.close()
+            self.app.processEvents()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='soak', description='Accelerated soak test of HardMonitor and the graphs for resource leaks')
+    parser.add_argument('--source', type=str, default='monitor', choices=('monitor', 'synthetic'),
+                        help='Real collectors with a virtual clock, or synthetic snapshots only.')
+    parser.add_argument('--renderer', type=str, default='plot', choices=('plot', 'strip', 'none'))
+    parser.add_argument('-p', '--period', type=float, default=2.0, help='Virtual time of a tick.')
+    parser.add_argument('--days', type=float, default=14, help='Virtual time of the run.')
+    parser.add_argument('--max-ticks', type=int, default=None, help='Limit of ticks regardless of --days.')
+    parser.add_argument('--samples', type=int, default=200, help='Resource samples over the run.')
+    parser.add_argument('--warmup', type=float, default=0.2,
+                        help='Part of the run not measured: caches and graph history fill up.')
+    parser.add_argument('--paint-every', type=int, default=10, help='Ticks between Qt event processing.')
+    parser.add_argument('-g', '--graph_height', type=int, default=17)
+    parser.add_argument('-t', '--graph_time', type=int, default=600)
+    parser.add_argument('--cpu-heatmap', action='store_true')
+    parser.add_argument('--cores', type=int, default=16, help='Cores of the synthetic heatmap.')
+    parser.add_argument('--disable', type=str, nargs='*', default=[], choices=common.OPTIONAL_SOURCES)
+    parser.add_argument('--source-timeout', type=float, default=None)
+    parser.add_argument('-o', '--output', type=str, default=None, help='Resource samples as csv.')
+    parser.add_argument('-l', '--log', type=str, default='ERROR', help='Log level.')
+    args = parser.parse_args()
+    common.log.init(args.log, None)
+    bench_ui.qInstallMessageHandler(bench_ui.on_qt_message)
+
+    ticks = int(args.days * 24 * 3600 / args.period)
+    if args.max_ticks:
+        ticks = min(ticks, args.max_ticks)
+    sample_every = max(ticks // args.samples, 1)
+
+    process = psutil.Process()
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        soak = Soak(args, pathlib.Path(directory) / 'soak.json')
+        start = time.monotonic()
+        try:
+            for i in range(ticks):
+                soak.tick(i)
+                if i % sample_every == 0 or i == ticks - 1:
+                    rows.append((i, i * args.period / 3600) + get_resources(process))
+                    print('\r{:6.1%} {:7.1f} h virtual {:6.0f} s real  '
+                          'rss {:6.1f} MB fds {:4} threads {:3} children {:2}'.format(
+                              i / ticks, *rows[-1][1:2], time.monotonic() - start, *rows[-1][2:]),
+                          end='', flush=True)
+        except KeyboardInterrupt:
+            print('\ninterrupted at tick', i)
+        finally:
+            soak.stop()
+    print()
+
+    if args.output:
+        with open(args.output, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(('tick', 'virtual_h') + RESOURCES)
+            writer.writerows(rows)
+
+    table = np.array(rows, dtype=float)
+    measured = table[table[:, 0] >= table[-1, 0] * args.warmup]
+    failed = []
+    for i, name in enumerate(RESOURCES):
+        values = measured[:, 2 + i]
+        growth = get_growth(measured[:, 0], values)
+        status = 'FAIL' if growth >= LIMITS[name] else 'ok'
+        if status == 'FAIL':
+            failed.append(name)
+        print('{:10} start {:8.1f} end {:8.1f} max {:8.1f} trend {:+8.2f} limit {:4}  {}'.format(
+            name, values[0], values[-1], values.max(), growth, LIMITS[name], status))
+    print('{} ticks, {:.1f} virtual days in {:.0f} s'.format(
+        int(table[-1, 0]) + 1, table[-1, 1] / 24, time.monotonic() - start))
+    if failed:
+        print('upward trend:', ' '.join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+import collections
+import typing
+
+from PyQt5.QtCore import Qt, QRect
+from PyQt5.QtWidgets import QWidget, QHBoxLayout
+from PyQt5.QtGui import QFont, QFontMetrics, QColor, QBrush, QPainter, QPaintEvent
+
+import numpy as np
+import pyqtgraph as pg
+
+import graph
+import hard_monitor
+import labels
+
+TEXT_COLOR = QColor('lightgreen')
+BACKGROUND_COLOR = QColor(0, 0, 0, round(255 * graph.TRANSPARENCY))
+
+
+class Series:
+    """
+    Filled max and mean envelope drawn as two QPolygonF.
+    Points are written through numpy views of the polygons, no QPointF per point.
+    """
+
+    def __init__(self, cell: 'Cell', config: graph.GraphConfig, color, fill_level):
+        self.cell = cell
+        self.envelope = graph.Envelope(config.y_min, config.total_time_s)
+        # samples that arrive before the cell is laid out, written on the first resize
+        self.pending: typing.Deque[typing.Tuple[float, float]] = collections.deque()
+        # fill level is in view coordinates as in pyqtgraph, log10 of the value for log cells
+        self.fill_level = fill_level
+        self.mean_brush = QBrush(QColor(*color, round(255 * graph.GRAPH_TR)))
+        # peaks are drawn with half of the mean transparency
+        self.peak_brush = QBrush(QColor(*color, round(255 * graph.GRAPH_TR / 2)))
+
+        self.max_polygon = pg.functions.create_qpolygonf(0)
+        self.mean_polygon = pg.functions.create_qpolygonf(0)
+        self.max_points = pg.functions.ndarray_from_qpolygonf(self.max_polygon)
+        self.mean_points = pg.functions.ndarray_from_qpolygonf(self.mean_polygon)
+
+    def resize(self, columns: int):
+        self.envelope.resize(columns)
+        # the first and last point close the fill at the fill level
+        self.max_polygon = pg.functions.create_qpolygonf(columns + 2)
+        self.mean_polygon = pg.functions.create_qpolygonf(columns + 2)
+        self.max_points = pg.functions.ndarray_from_qpolygonf(self.max_polygon)
+        self.mean_points = pg.functions.ndarray_from_qpolygonf(self.mean_polygon)
+        while self.pending:
+            self.envelope.add_value(*self.pending.popleft())
+
+    def add_value(self, value, t: float):
+        if not self.cell.graph_rect.width():
+            self.pending.append((value, t))
+            # a cell is laid out once it has a text, until then keep one graph time span
+            while t - self.pending[0][1] > self.envelope.total_time_s:
+                self.pending.popleft()
+        elif self.envelope.add_value(value, t):
+            self.cell.dirty = True
+
+    def override_all_y(self, y_value):
+        self.pending.clear()
+        self.envelope.override_all_y(y_value, max(self.cell.graph_rect.width(), 1))
+        self.cell.dirty = True
+
+    def set_fill_level(self, fill_level):
+        self.fill_level = fill_level
+        self.cell.dirty = True
+
+    def render(self, cell: 'Cell'):
+        columns = self.envelope.get_columns()
+        x = np.arange(cell.graph_rect.left(), cell.graph_rect.left() + columns, dtype=float)
+        fill_y = cell.to_y(self.fill_level)
+        for points, y in ((self.max_points, self.envelope.y_high), (self.mean_points, self.envelope.get_mean())):
+            points[1:-1, 0] = x
+            points[1:-1, 1] = cell.to_y(np.log10(y) if cell.log else y)
+            points[0] = (x[0], fill_y)
+            points[-1] = (x[-1], fill_y)
+
+
+class Cell:
+    def __init__(self, widget: 'StripWidget', config: graph.GraphConfig):
+        self.widget = widget
+        self.config = config
+        self.text = ''
+        self.rect = QRect()
+        self.graph_rect = QRect()
+        self.series: typing.List[Series] = []
+
+        self.y_range_min = None
+        self.y_range_max = None
+        self.log = False
+        self.dirty = True
+
+    def create_series(self, color=(255, 0, 0), fill_level=0) -> Series:
+        series = Series(self, self.config, color, fill_level)
+        if self.graph_rect.width():
+            series.resize(self.graph_rect.width())
+        self.series.append(series)
+        return series
+
+    def set_rect(self, rect: QRect):
+        self.rect = rect
+        self.graph_rect = QRect(rect.left(), rect.top(), rect.width(), self.config.graph_height)
+        for series in self.series:
+            series.resize(rect.width())
+        self.dirty = True
+
+    def update_y_range(self, y_min, y_max):
+        if self.y_range_min != y_min or self.y_range_max != y_max:
+            self.y_range_min = y_min
+            self.y_range_max = y_max
+            self.dirty = True
+            return True
+        return False
+
+    def set_log_mode(self, y: bool):
+        self.log = y
+        self.dirty = True
+
+    def update(self, text: str):
+        if self.text != text:
+            self.text = text
+            self.dirty = True
+
+    def create_heatmap(self) -> None:
+        # the strip has no per core heatmap
+        return None
+
+    def to_y(self, values):
+        y_min = self.y_range_min or 0
+        y_max = self.y_range_max or 0
+        ratio = (values - y_min) / (y_max - y_min) if y_max > y_min else values * 0
+        return self.graph_rect.bottom() + 1 - np.clip(ratio, 0, 1) * self.graph_rect.height()
+
+    def render(self):
+        if self.graph_rect.width():
+            for series in self.series:
+                series.render(self)
+        self.dirty = False
+
+
+class StripWidget(QWidget):
+    """
+    All labels with their graphs painted by one widget instead of a PlotWidget per label.
+    Only the cells with a new text or a finished graph column are repainted.
+    """
+
+    def __init__(self, config: graph.GraphConfig):
+        super().__init__()
+        self.config = config
+        self.font = QFont('Monospace', graph.FONT_SIZE)
+        self.metrics = QFontMetrics(self.font)
+        self.gap = self.metrics.horizontalAdvance(' ')
+        self.cells: typing.List[Cell] = []
+
+    def create_cell(self, config: graph.GraphConfig, after: typing.Optional[Cell] = None) -> Cell:
+        """Cells are painted in creation order, a cell created after another one is painted right after it."""
+        cell = Cell(self, config)
+        self.cells.insert(self.cells.index(after) + 1 if after else len(self.cells), cell)
+        return cell
+
+    def flush(self):
+        x = 0
+        height = self.config.graph_height
+        for cell in self.cells:
+            if not cell.text:
+                continue
+            size = self.metrics.size(0, cell.text)
+            rect = QRect(x, 0, size.width(), max(size.height(), cell.config.graph_height))
+            if rect != cell.rect:
+                cell.set_rect(rect)
+            x += rect.width() + self.gap
+            height = max(height, rect.height())
+
+        width = max(x - self.gap, 1)
+        if self.width() != width or self.height() != height:
+            self.setFixedSize(width, height)
+            self.update()
+
+        for cell in self.cells:
+            if cell.dirty:
+                cell.render()
+                self.update(cell.rect)
+
+    def paintEvent(self, event: QPaintEvent):
+        painter = QPainter(self)
+        painter.setFont(self.font)
+        for cell in self.cells:
+            if not cell.text or not cell.rect.intersects(event.rect()):
+                continue
+            painter.fillRect(cell.rect, BACKGROUND_COLOR)
+            painter.setPen(Qt.NoPen)
+            for series in cell.series:
+                painter.setBrush(series.peak_brush)
+                painter.drawPolygon(series.max_polygon)
+                painter.setBrush(series.mean_brush)
+                painter.drawPolygon(series.mean_polygon)
+            painter.setPen(TEXT_COLOR)
+            painter.drawText(cell.rect, Qt.AlignLeft | Qt.AlignTop, cell.text)
+        painter.end()
+
+
+class StripList:
+    """
+    Same labels as graph.GraphList painted into one StripWidget.
+    """
+
+    def __init__(self, config: graph.GraphConfig):
+        self.config = config
+        self.widget = StripWidget(config)
+
+        self.graph_layout = QHBoxLayout()
+        self.graph_layout.setSpacing(0)
+        self.graph_layout.setContentsMargins(0, 0, 0, 0)
+        self.graph_layout.setAlignment(Qt.AlignLeft | Qt.AlignTop)
+        self.graph_layout.addWidget(self.widget, alignment=Qt.AlignLeft | Qt.AlignTop)
+
+        self.labels = labels.create_labels(self, config)
+
+    def create_view(self, config: graph.GraphConfig, after: typing.Optional[Cell] = None) -> Cell:
+        return self.widget.create_cell(config, after)
+
+    def update(self, info: hard_monitor.HardMonitorInfo):
+        labels.update_labels(self.labels, info)
+        self.widget.flush()
@@ -0,0 +1,5 @@
+import pathlib
+import sys
+
+# modules of the repository are imported by name, as the entry points do
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
@@ -0,0 +1,87 @@
+import pytest
+
+import alarm
+import common
+
+
+class Notifier:
+    def __init__(self):
+        self.sent = []
+
+    def notify(self, summary: str, critical: bool, replaces_id: int = 0) -> int:
+        self.sent.append((summary, critical, replaces_id))
+        return len(self.sent)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(alarm.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def notifier():
+    return Notifier()
+
+
+@pytest.fixture
+def dispatcher(notifier):
+    return alarm.AlarmDispatcher(notifier)
+
+
+def raise_alarm(message: str = 'CPU crit t 96/95 °C'):
+    return [common.Alarm('CPU', message)]
+
+
+def test_raise_repeat_clear(clock, notifier, dispatcher):
+    events = []
+    dispatcher.add_listener(lambda alarm, cleared: events.append((str(alarm), cleared)))
+
+    dispatcher.update(raise_alarm())
+    clock[0] += 10
+    dispatcher.update(raise_alarm('CPU crit t 97/95 °C'))
+    assert notifier.sent == [('CPU crit t 96/95 °C', True, 0)]
+    assert [str(alarm) for alarm in dispatcher.get_active()] == ['CPU crit t 97/95 °C']
+
+    clock[0] += alarm.AlarmDispatcher.REPEAT_PERIOD_S
+    dispatcher.update(raise_alarm())
+    clock[0] += 10
+    dispatcher.update([])
+    assert notifier.sent[1:] == [('CPU crit t 96/95 °C', True, 1), ('CPU crit t 96/95 °C cleared', False, 2)]
+    assert events == [('CPU crit t 96/95 °C', False), ('CPU crit t 96/95 °C cleared', True)]
+    assert dispatcher.get_active() == []
+
+
+def test_flapping_alarm_is_notified_once_per_period(clock, notifier, dispatcher):
+    events = []
+    dispatcher.add_listener(lambda alarm, cleared: events.append(cleared))
+
+    for _ in range(10):
+        dispatcher.update(raise_alarm())
+        clock[0] += 10
+        dispatcher.update([])
+        clock[0] += 10
+    # the first raise and its clear, the front end still sees every change
+    assert [critical for summary, critical, replaces_id in notifier.sent] == [True, False]
+    assert events == [False, True] * 10
+
+    clock[0] += alarm.AlarmDispatcher.REPEAT_PERIOD_S
+    dispatcher.update(raise_alarm())
+    assert notifier.sent[-1] == ('CPU crit t 96/95 °C', True, 2)
+
+
+def test_flapping_alarm_lasting_is_notified_again(clock, notifier, dispatcher):
+    dispatcher.update(raise_alarm())
+    clock[0] += 10
+    dispatcher.update([])
+    clock[0] += 10
+    dispatcher.update(raise_alarm())
+    assert len(notifier.sent) == 2
+
+    clock[0] += alarm.AlarmDispatcher.REPEAT_PERIOD_S
+    dispatcher.update(raise_alarm())
+    assert notifier.sent[-1] == ('CPU crit t 96/95 °C', True, 2)
@@ -0,0 +1,105 @@
+import random
+import time
+import types
+
+import pytest
+
+import anomaly
+
+STEP_S = 60
+HOUR_S = 3600
+DAY_S = 24 * HOUR_S
+
+
+@pytest.fixture(autouse=True)
+def wall_clock(monkeypatch):
+    # sample times are wall clock times, so the hour slot is known
+    monkeypatch.setattr(anomaly.sampling, 'monotonic_to_wall', lambda monotonic_s: monotonic_s)
+
+
+@pytest.fixture
+def detector():
+    return anomaly.Detector([('CPU temp', 'cpu.temp_c', 5)])
+
+
+def create_info(temp_c):
+    return types.SimpleNamespace(cpu=types.SimpleNamespace(temp_c=temp_c))
+
+
+def get_midnight() -> float:
+    return time.mktime((2026, 1, 5, 0, 0, 0, 0, 0, -1))
+
+
+def feed(detector, start: float, end: float, get_value):
+    rng = random.Random(start)
+    alarms = []
+    t = start
+    while t < end:
+        alarms = detector.update(create_info(get_value(t) + rng.gauss(0, 0.5)), t)
+        t += STEP_S
+    return alarms
+
+
+def test_first_sample_seeds_level(detector):
+    t = get_midnight()
+    assert detector.update(create_info(50), t) == []
+    metric = detector.metrics[0]
+    assert metric.level == 50
+    assert metric.baseline.weight == 0
+    assert all(slot.weight == 0 for slot in metric.slots)
+
+    detector.update(create_info(50), t + STEP_S)
+    assert metric.baseline.mean == pytest.approx(50)
+    assert metric.slots[0].weight > 0
+    assert metric.slots[1].weight == 0
+
+
+def test_missing_sample_keeps_state(detector):
+    t = get_midnight()
+    detector.update(create_info(50), t)
+    detector.update(create_info(None), t + STEP_S)
+    detector.update(types.SimpleNamespace(cpu=None), t + 2 * STEP_S)
+    assert detector.metrics[0].level == 50
+    assert detector.update(create_info(float('nan')), t + 3 * STEP_S) == []
+
+
+def test_hour_slot_baseline(detector):
+    def get_daily(t: float) -> float:
+        return 40 if time.localtime(t).tm_hour < 12 else 70
+
+    start = get_midnight()
+    feed(detector, start, start + 7 * DAY_S, get_daily)
+    metric = detector.metrics[0]
+    assert metric.slots[3].mean == pytest.approx(40, abs=1)
+    assert metric.slots[15].mean == pytest.approx(70, abs=1)
+
+    # the usual afternoon value is an anomaly at night
+    night = start + 7 * DAY_S + 3 * HOUR_S
+    assert feed(detector, night - HOUR_S, night, get_daily) == []
+    # the last sample was in the 2 am slot, the whole day baseline still remembers the evening
+    assert metric.expected == pytest.approx(metric.slots[2].mean, abs=0.5)
+    assert metric.baseline.mean > metric.expected + 5
+    alarms = feed(detector, night, night + HOUR_S, lambda t: 70)
+    assert [alarm.name for alarm in alarms] == ['Anomaly CPU temp']
+
+
+def test_min_delta_suppression(detector):
+    start = get_midnight()
+    feed(detector, start, start + DAY_S, lambda t: 50)
+    metric = detector.metrics[0]
+
+    # many sigmas off but under the 5 °C minimal delta
+    end = start + DAY_S + 2 * HOUR_S
+    assert feed(detector, start + DAY_S, end, lambda t: 54) == []
+    assert metric.z == 0
+
+    alarms = feed(detector, end, end + HOUR_S, lambda t: 62)
+    assert [alarm.name for alarm in alarms] == ['Anomaly CPU temp']
+
+
+def test_dump_load(detector):
+    start = get_midnight()
+    feed(detector, start, start + 2 * HOUR_S, lambda t: 50)
+    loaded = anomaly.Detector([('CPU temp', 'cpu.temp_c', 5)])
+    loaded.load(detector.dump())
+    assert loaded.dump() == detector.dump()
@@ -0,0 +1,162 @@
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+import pytest
+
+jeepney = pytest.importorskip('jeepney')
+from jeepney.bus_messages import message_bus
+from jeepney.io.blocking import open_dbus_connection
+
+import common
+import network
+
+DEVICE_PATH = '/org/bluez/hci0/dev_AA_BB_CC_DD_EE_FF'
+PERIOD_S = 0.2
+TIMEOUT_S = 5
+
+BUS_CONFIG = '''<!DOCTYPE busconfig PUBLIC "-//freedesktop//DTD D-Bus Bus Configuration 1.0//EN"
+ "http://www.freedesktop.org/standards/dbus/1.0/busconfig.dtd">
+<busconfig>
+  <type>session</type>
+  <listen>unix:path={path}</listen>
+  <auth>EXTERNAL</auth>
+  <policy context="default">
+    <allow send_destination="*" eavesdrop="true"/>
+    <allow eavesdrop="true"/>
+    <allow own="*"/>
+  </policy>
+</busconfig>
+'''
+
+
+@pytest.fixture
+def bus(tmp_path):
+    if not shutil.which('dbus-daemon'):
+        pytest.skip('dbus-daemon not installed')
+    config = tmp_path / 'bus.conf'
+    config.write_text(BUS_CONFIG.format(path=tmp_path / 'bus'))
+    daemon = subprocess.Popen(['dbus-daemon', '--config-file', str(config), '--nofork', '--print-address'],
+                              stdout=subprocess.PIPE, text=True)
+    address = daemon.stdout.readline().strip()
+    yield address
+    daemon.terminate()
+    daemon.wait()
+
+
+class MockBluez:
+    """org.bluez on a test bus: GetManagedObjects of the given objects and signals sent on request."""
+
+    def __init__(self, address: str, objects: dict):
+        self.objects = objects
+        self.signals: queue.SimpleQueue = queue.SimpleQueue()
+        self.stopping = threading.Event()
+        # the connection is used from the serving thread only
+        self.connection = open_dbus_connection(bus=address)
+        self.connection.send_and_get_reply(message_bus.RequestName(network.Bluetooth.BLUEZ_SERVICE))
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def emit(self, path: str, interface: str, member: str, signature: str, body: tuple):
+        self.signals.put((path, interface, member, signature, body))
+
+    def properties_changed(self, interface: str, changed: dict):
+        self.emit(DEVICE_PATH, network.Bluetooth.PROPERTIES_INTERFACE, 'PropertiesChanged', 'sa{sv}as',
+                  (interface, changed, []))
+
+    def _serve(self):
+        while not self.stopping.is_set():
+            try:
+                message = self.connection.receive(timeout=0.05)
+            except TimeoutError:
+                message = None
+            if (message and message.header.message_type == jeepney.MessageType.method_call
+                    and message.header.fields.get(jeepney.HeaderFields.member) == 'GetManagedObjects'):
+                self.connection.send(jeepney.new_method_return(message, 'a{oa{sa{sv}}}', (self.objects,)))
+            while not self.signals.empty():
+                path, interface, member, signature, body = self.signals.get()
+                self.connection.send(jeepney.new_signal(jeepney.DBusAddress(path, interface=interface),
+                                                        member, signature, body))
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        self.connection.close()
+
+
+def wait_for(predicate) -> bool:
+    end = time.monotonic() + TIMEOUT_S
+    while time.monotonic() < end:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+@pytest.fixture
+def bluetooth(bus):
+    common.log.init('ERROR', None)
+    sources = []
+
+    def create(objects: dict):
+        bluez = MockBluez(bus, objects)
+        source = network.Bluetooth(PERIOD_S, bus=bus)
+        sources.append((bluez, source))
+        return bluez, source
+
+    yield create
+    for bluez, source in sources:
+        source.stop()
+        bluez.stop()
+
+
+def test_initial_state(bluetooth):
+    _, source = bluetooth({DEVICE_PATH: {
+        network.Bluetooth.DEVICE_INTERFACE: {'Connected': ('b', True)},
+        network.Bluetooth.BATTERY_INTERFACE: {'Percentage': ('y', 80)},
+    }})
+    assert wait_for(source.is_connected)
+    assert source.get_bat_level() == pytest.approx(0.8)
+
+
+def test_signals(bluetooth):
+    bluez, source = bluetooth({DEVICE_PATH: {network.Bluetooth.DEVICE_INTERFACE: {'Connected': ('b', False)}}})
+    # the initial state is read after the subscription, signals from here on are not lost
+    assert wait_for(lambda: DEVICE_PATH in source.devices)
+    assert not source.is_connected()
+
+    bluez.properties_changed(network.Bluetooth.DEVICE_INTERFACE, {'Connected': ('b', True)})
+    assert wait_for(source.is_connected)
+    assert source.get_bat_level() == 0
+
+    bluez.emit('/', network.Bluetooth.OBJECT_MANAGER_INTERFACE, 'InterfacesAdded', 'oa{sa{sv}}',
+               (DEVICE_PATH, {network.Bluetooth.BATTERY_INTERFACE: {'Percentage': ('y', 77)}}))
+    assert wait_for(lambda: source.get_bat_level() == pytest.approx(0.77))
+
+    bluez.properties_changed(network.Bluetooth.BATTERY_INTERFACE, {'Percentage': ('y', 60)})
+    assert wait_for(lambda: source.get_bat_level() == pytest.approx(0.6))
+
+    bluez.properties_changed(network.Bluetooth.DEVICE_INTERFACE, {'Connected': ('b', False)})
+    assert wait_for(lambda: not source.is_connected())
+    assert source.get_bat_level() == 0
+
+
+def test_device_removed(bluetooth):
+    bluez, source = bluetooth({DEVICE_PATH: {network.Bluetooth.DEVICE_INTERFACE: {'Connected': ('b', True)}}})
+    assert wait_for(source.is_connected)
+
+    bluez.emit('/', network.Bluetooth.OBJECT_MANAGER_INTERFACE, 'InterfacesRemoved', 'oas',
+               (DEVICE_PATH, [network.Bluetooth.DEVICE_INTERFACE, network.Bluetooth.BATTERY_INTERFACE]))
+    assert wait_for(lambda: not source.is_connected())
+    assert DEVICE_PATH not in source.devices
+
+
+def test_stop_without_bluez(bus):
+    common.log.init('ERROR', None)
+    source = network.Bluetooth(PERIOD_S, bus=bus)
+    start = time.monotonic()
+    source.stop()
+    assert not source.theead.is_alive()
+    assert time.monotonic() - start < PERIOD_S * 5
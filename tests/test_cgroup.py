@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+import cgroup
+
+GB = 1024 * 1024 * 1024
+MB = 1024 * 1024
+# monotonic time of the first tick, the first calculate scans the tree
+NOW = 1000.0
+
+
+def write_unit(path, usage_usec=0, memory=0, io_bytes=0, cpu_max='max 100000', avg10=0.0):
+    path.mkdir(parents=True, exist_ok=True)
+    (path / 'cpu.stat').write_text('usage_usec {}\nuser_usec 0\n'.format(usage_usec))
+    (path / 'cpu.max').write_text(cpu_max + '\n')
+    (path / 'memory.current').write_text('{}\n'.format(memory))
+    (path / 'io.stat').write_text('8:0 rbytes={} wbytes=0 rios=0 wios=0\n'.format(io_bytes))
+    (path / 'memory.pressure').write_text(
+        'some avg10={:.2f} avg60=0.00 avg300=0.00 total=0\nfull avg10=0.00 avg60=0.00 avg300=0.00 total=0\n'.format(
+            avg10))
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    (tmp_path / 'cgroup.controllers').write_text('cpu io memory\n')
+    monkeypatch.setattr(cgroup, 'CGROUP_PATH', tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def cgroups(root):
+    cgroups = cgroup.Cgroups(cpu_count=8)
+    yield cgroups
+    cgroups.stop()
+
+
+def test_cpu_limit_of_parents(root, cgroups):
+    write_unit(root / 'limited.slice', cpu_max='200000 100000')
+    write_unit(root / 'limited.slice' / 'tight.service', cpu_max='50000 100000')
+    write_unit(root / 'limited.slice' / 'loose.service', cpu_max='400000 100000')
+    write_unit(root / 'limited.slice' / 'free.service')
+    write_unit(root / 'system.slice' / 'free.service')
+    cgroups.calculate(NOW)
+
+    limits = {str(path.relative_to(root)): unit.cpu_limit_cores for path, unit in cgroups.units.items()}
+    assert limits == {
+        'limited.slice': 2,
+        'limited.slice/tight.service': 0.5,
+        'limited.slice/loose.service': 2,
+        'limited.slice/free.service': 2,
+        'system.slice': None,
+        'system.slice/free.service': None,
+    }
+
+    # 1.8 of the 2 cores allowed by the slice
+    write_unit(root / 'limited.slice' / 'free.service', usage_usec=1800000)
+    cgroups.calculate(NOW + 1)
+    unit = cgroups.units[root / 'limited.slice' / 'free.service']
+    assert cgroups.get_utilisation(unit) == pytest.approx(0.9)
+
+
+def test_files_fit_open_files(root, cgroups, monkeypatch):
+    for i in range(cgroup.MAX_GROUPS * 2):
+        write_unit(root / 'system.slice' / 'unit{}.service'.format(i), memory=i * MB)
+    cgroups.calculate(NOW)
+    assert len(cgroups.units) <= cgroup.MAX_GROUPS
+
+    opens = []
+    os_open = os.open
+    monkeypatch.setattr(os, 'open', lambda *args: opens.append(args[0]) or os_open(*args))
+    for t in range(1, 4):
+        cgroups.calculate(NOW + t)
+    # every file is read through an fd kept open
+    assert opens == []
+    assert len(cgroups.files.fds) <= cgroups.files.max_open
+
+
+def test_detail_units(root, cgroups, monkeypatch):
+    monkeypatch.setattr(cgroup, 'DETAIL_SIZE', 1)
+    busy = root / 'system.slice' / 'busy.service'
+    idle = root / 'system.slice' / 'idle.service'
+    write_unit(busy)
+    write_unit(idle, memory=GB)
+    cgroups.calculate(NOW)
+    # the busiest unit becomes the detail unit, its first io.stat read is the baseline
+    write_unit(busy, usage_usec=1000000)
+    cgroups.calculate(NOW + 1)
+    write_unit(busy, usage_usec=2000000, io_bytes=10 * MB, avg10=20.0)
+    write_unit(idle, memory=GB, io_bytes=8 * MB)
+    cgroups.calculate(NOW + 3)
+
+    assert [unit.name for unit in cgroups.detail_units] == ['busy']
+    assert cgroups.top_io.name == 'busy'
+    assert cgroups.top_io.io_mbps == pytest.approx(5)
+    assert cgroups.top_pressure.memory_some_avg10 == 20
+    assert cgroups.top_memory.name == 'idle'
+    assert cgroups.units[idle].io_mbps == 0
+    assert str(cgroups).count('busy') == 3
@@ -0,0 +1,74 @@
+import math
+
+import numpy as np
+import pytest
+
+import query
+import tsdb
+
+START_S = 1000.0
+TICKS = 100
+
+
+@pytest.fixture
+def path(tmp_path):
+    # x is the tick index, y has a sample every other tick
+    history = tsdb.History(('a.x', 'a.y'), retention_s=3600)
+    for i in range(TICKS):
+        history.append(START_S + i, [float(i), float(i) if i % 2 == 0 else math.nan])
+    path = tmp_path / 'query.sock'
+    server = query.QueryServer(history, path)
+    server.start()
+    yield path
+    server.stop()
+
+
+def test_aggregate(path):
+    header, payload = query.query({
+        'fields': ['a.x', 'a.y'], 'start': START_S, 'end': START_S + TICKS - 1,
+        'mode': 'aggregate', 'aggregates': ['min', 'max', 'avg', 'count', 'p50']}, path)
+    assert header['ticks'] == TICKS
+    assert header['shape'] == [2, 5]
+    assert payload.tolist() == [[0, 99, 49.5, 100, 49.5], [0, 98, 49, 50, 49]]
+
+
+def test_downsample(path):
+    header, payload = query.query({
+        'fields': ['a.x', 'a.y'], 'start': START_S, 'end': START_S + TICKS,
+        'mode': 'downsample', 'points': 10, 'aggregates': ['min', 'max', 'avg', 'count']}, path)
+    buckets = np.arange(10) * 10
+    assert header['shape'] == [9, 10]
+    assert payload[0].tolist() == (START_S + buckets + 5).tolist()
+    assert payload[1:5].tolist() == [buckets.tolist(), (buckets + 9).tolist(), (buckets + 4.5).tolist(), [10] * 10]
+    assert payload[5:9].tolist() == [buckets.tolist(), (buckets + 8).tolist(), (buckets + 4).tolist(), [5] * 10]
+
+
+def test_raw(path):
+    header, payload = query.query({'fields': 'a.x', 'start': START_S + 10, 'end': START_S + 19}, path)
+    assert payload.tolist() == [(START_S + np.arange(10, 20)).tolist(), list(range(10, 20))]
+
+
+@pytest.mark.parametrize('request_, error', [
+    ({'fields': ['a.z']}, 'unknown fields a.z'),
+    ({'fields': ['a.x'], 'start': START_S, 'end': START_S}, 'empty range'),
+    ({'fields': ['a.x'], 'start': math.nan}, 'start and end must be finite'),
+    ({'fields': ['a.x'], 'start': START_S, 'end': math.inf}, 'start and end must be finite'),
+    ({'fields': ['a.x'], 'mode': 'downsample', 'points': 0}, 'points out of range'),
+    ({'fields': ['a.x'], 'mode': 'downsample', 'aggregates': ['p95']}, 'unknown downsample aggregates p95'),
+    ({'fields': ['a.x'], 'mode': 'aggregate', 'aggregates': ['p101']}, 'unknown aggregate p101'),
+    ({'fields': ['a.x'], 'mode': 'sum'}, 'unknown mode sum'),
+])
+def test_error(path, request_, error):
+    with pytest.raises(query.QueryError, match=error):
+        query.query(request_, path)
+
+
+def test_oversized_raw_range(path, monkeypatch):
+    monkeypatch.setattr(query, 'MAX_RAW_VALUES', TICKS)
+    with pytest.raises(query.QueryError, match='raw range of {} ticks is too long'.format(TICKS)):
+        query.query({'fields': ['a.x'], 'start': START_S, 'end': START_S + TICKS}, path)
+
+
+def test_long_line(path):
+    with pytest.raises(query.QueryError, match='request too long'):
+        query.query({'fields': ['a.x' * 30000]}, path)
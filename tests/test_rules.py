@@ -0,0 +1,79 @@
+import types
+
+import pytest
+
+import rules
+
+STEP_S = 1.0
+
+
+def create_info(value):
+    return types.SimpleNamespace(sensor=types.SimpleNamespace(value=value, limit=50))
+
+
+def run(rule: rules.Rule, values, start: float = 0.0):
+    """Alarm messages per tick, None while inactive."""
+    alarms = [rule.evaluate(create_info(value), start + i * STEP_S) for i, value in enumerate(values)]
+    return [str(alarm) if alarm else None for alarm in alarms]
+
+
+def test_raise_and_clear_without_delays():
+    rule = rules.Rule('T', 'sensor.value', 50, message='{name} {value:.0f}')
+    assert run(rule, [49, 50, 60, 49]) == [None, 'T 50', 'T 60', None]
+
+
+def test_raise_after_for_s():
+    rule = rules.Rule('T', 'sensor.value', 50, for_s=3, message='{name} {value:.0f}')
+    # a dip under the limit starts the wait over
+    assert run(rule, [60, 60, 40, 60, 60, 60, 61, 62]) == [None] * 6 + ['T 61', 'T 62']
+
+
+def test_clear_after_clear_for_s_with_hysteresis():
+    rule = rules.Rule('T', 'sensor.value', 50, hysteresis=5, clear_for_s=2, message='{name} {value:.0f}')
+    alarms = run(rule, [50, 47, 44, 44, 50, 44, 44, 44])
+    # 47 is inside the hysteresis, 50 restarts the clear wait
+    assert alarms == ['T 50', 'T 47', 'T 44', 'T 44', 'T 50', 'T 44', 'T 44', None]
+
+
+def test_limit_metric_and_missing_value():
+    rule = rules.Rule('T', 'sensor.value', 'sensor.limit', message='{name} {value:.0f}/{limit:.0f}')
+    assert run(rule, [55]) == ['T 55/50']
+    # a missing value keeps the state and the last message
+    assert rule.evaluate(types.SimpleNamespace(sensor=None), STEP_S) is not None
+    assert str(rule.evaluate(create_info(None), 2 * STEP_S)) == 'T 55/50'
+
+
+def test_held_alarm_reports_the_alarm_window():
+    rule = rules.Rule('PSI', 'sensor.value', 1, clear_for_s=3, message='{name} {value:.0f} {peak:.0f} {total:.0f}')
+    alarms = run(rule, [0, 2, 5, 0, 0, 0, 0, 3])
+    assert alarms == [None, 'PSI 2 2 2', 'PSI 5 5 7', 'PSI 0 5 7', 'PSI 0 5 7', 'PSI 0 5 7', None, 'PSI 3 3 3']
+
+
+@pytest.mark.parametrize('times', [
+    [i * 2.0 for i in range(20)],
+    [0, 1, 1.5, 4, 4.2, 9, 10, 15, 15.1, 20],
+])
+def test_slope_of_a_line(times):
+    slope = rules.Slope(30)
+    results = [slope.add(3 + 0.5 * t, t) for t in times]
+    assert results[0] is None
+    assert results[-1] == pytest.approx(0.5)
+
+
+def test_slope_ignores_repeated_times_and_follows_a_change():
+    slope = rules.Slope(10)
+    slope.add(0, 0)
+    slope.add(1, 1)
+    assert slope.add(5, 1) is None
+    for t in range(2, 100):
+        result = slope.add(100 - 2 * t, t)
+    # old samples fade out with the window
+    assert result == pytest.approx(-2, abs=0.01)
+
+
+def test_rate_rule():
+    rule = rules.Rule('Swap', 'sensor.value', 0.1, for_s=2, rate_window_s=60, rate_unit_s=60,
+                      message='{name} {value:.2f}/min')
+    # 0.002 per second is 0.12 per minute
+    alarms = run(rule, [1 + 0.002 * i for i in range(5)])
+    assert alarms == [None, None, None, 'Swap 0.12/min', 'Swap 0.12/min']
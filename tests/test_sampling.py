@@ -0,0 +1,43 @@
+import types
+
+import common
+import sampling
+
+BASE_PERIOD_S = 2.0
+
+
+def create_info(load: float = 0.0, alarms=()):
+    return types.SimpleNamespace(
+        cpu=types.SimpleNamespace(loadavg_current=load),
+        disk=types.SimpleNamespace(read_mbps=0.0, write_mbps=0.0),
+        network=types.SimpleNamespace(recv_mbps=0.0, send_mbps=0.0),
+        battery=None,
+        alarms=[common.Alarm(name, name) for name in alarms],
+    )
+
+
+def test_steady_load_keeps_base_period():
+    period = sampling.AdaptivePeriod(BASE_PERIOD_S)
+    assert [period.update(create_info(4.0)) for _ in range(10)] == [BASE_PERIOD_S] * 10
+
+
+def test_idle_stretches_and_change_shrinks():
+    period = sampling.AdaptivePeriod(BASE_PERIOD_S)
+    for _ in range(20):
+        period.update(create_info())
+    assert period.period_s == BASE_PERIOD_S * period.IDLE_MAX_FACTOR
+    assert period.update(create_info(2.0)) == BASE_PERIOD_S * period.MIN_FACTOR
+
+
+def test_raised_alarm_shrinks_once():
+    period = sampling.AdaptivePeriod(BASE_PERIOD_S)
+    periods = [period.update(create_info(4.0, alarms=['PSI'])) for _ in range(3)]
+    assert periods == [BASE_PERIOD_S * period.MIN_FACTOR, BASE_PERIOD_S, BASE_PERIOD_S]
+    # raised again after a clear
+    period.update(create_info(4.0))
+    assert period.update(create_info(4.0, alarms=['PSI'])) == BASE_PERIOD_S * period.MIN_FACTOR
+
+
+def test_stale_alarm_is_ignored():
+    period = sampling.AdaptivePeriod(BASE_PERIOD_S)
+    assert period.update(create_info(4.0, alarms=['Stale battery'])) == BASE_PERIOD_S
@@ -0,0 +1,104 @@
+import os
+import time
+import types
+
+import pytest
+
+import segments
+import snapshot
+
+FIELDS = ('cpu.temp_c', 'memory.used_gb', 'disk.read_mbps')
+
+
+def create_info(value: float, time_s: float):
+    # every field of every segment is the value, a torn read mixes two values
+    info = types.SimpleNamespace(alarms=[], get_time=lambda: time_s)
+    for segment in segments.SEGMENTS:
+        fields = {field.split('.')[1]: value for field in segment.fields}
+        setattr(info, segment.name, types.SimpleNamespace(**fields))
+    return info
+
+
+@pytest.fixture
+def writer():
+    writer = snapshot.SnapshotWriter('hard_monitor_test_{}'.format(os.getpid()), period_s=1)
+    yield writer
+    writer.close()
+
+
+@pytest.fixture
+def reader(writer):
+    reader = snapshot.SnapshotReader('hard_monitor_test_{}'.format(os.getpid()))
+    assert reader._open()
+    yield reader
+    reader.close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(snapshot.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+class TornValues:
+    """Values of the reader that run a write right after they are copied."""
+
+    def __init__(self, values, write):
+        self.values = values
+        self.write = write
+
+    def __getitem__(self, index):
+        values = self.values[index]
+        if self.write:
+            self.write()
+            self.write = None
+        return values
+
+
+def test_read(writer, reader, sleeps):
+    now = time.monotonic()
+    writer.publish(create_info(1.0, now))
+    time_s, values = reader.read_values(FIELDS)
+    assert time_s == now
+    assert values.tolist() == [1.0] * len(FIELDS)
+
+    info = reader.get_info()
+    assert info.memory.used_gb == 1.0
+    assert info.alarms == []
+    assert sleeps == []
+
+
+def test_write_in_progress(writer, reader, sleeps, monkeypatch):
+    writer.publish(create_info(1.0, time.monotonic()))
+    # the writer is stopped in the middle of the next publish until the reader sleeps
+    writer.seq[0] += 1
+    writer.values[:2] = 2.0
+
+    def finish(seconds):
+        sleeps.append(seconds)
+        writer.values[:] = 2.0
+        writer.seq[0] += 1
+    monkeypatch.setattr(snapshot.time, 'sleep', finish)
+    _, values = reader.read_values(FIELDS)
+    assert values.tolist() == [2.0] * len(FIELDS)
+    assert sleeps == [reader.RETRY_SLEEP_S]
+
+
+def test_torn_read(writer, reader, sleeps):
+    writer.publish(create_info(1.0, time.monotonic()))
+    reader.values = TornValues(reader.values, lambda: writer.publish(create_info(2.0, time.monotonic())))
+    _, values = reader.read_values(FIELDS)
+    assert values.tolist() == [2.0] * len(FIELDS)
+    assert sleeps == [reader.RETRY_SLEEP_S]
+
+
+def test_stuck_writer(writer, reader, sleeps, monkeypatch):
+    monkeypatch.setattr(reader, 'RETRY_COUNT', 3)
+    writer.publish(create_info(1.0, time.monotonic()))
+    writer.seq[0] += 1
+    assert reader.read_values(FIELDS) is None
+    assert sleeps == [reader.RETRY_SLEEP_S] * 3
+
+    info = reader.get_info()
+    assert [alarm.message for alarm in info.alarms] == ['collector not running']
@@ -0,0 +1,82 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+import tsdb
+
+SPECIAL_VALUES = (
+    math.nan, -0.0, 0.0, 1e308, -1e308, 5e-324, math.inf, -math.inf, 2.0 ** 53 + 1, 50.0, 50.0, 0.1)
+# on time ticks, timer jitter, a slow period, suspends of minutes and days
+TIME_STEPS_MS = (1000, 1000, 1001, 999, 1300, 5000, 10 ** 6, 3 * 86400 * 1000)
+
+
+def get_bits(values) -> list:
+    # nan and -0.0 are compared by their bits
+    return np.asarray(values, dtype=np.float64).view(np.uint64).tolist()
+
+
+@pytest.fixture
+def rng():
+    return random.Random(0)
+
+
+def test_values_round_trip(rng):
+    values = [rng.choice(SPECIAL_VALUES + (rng.random(), round(rng.gauss(50, 5), 1))) for _ in range(5000)]
+    encoder = tsdb.ValueEncoder(values[0])
+    for value in values[1:]:
+        encoder.append(value)
+    decoded = tsdb.decode_values(encoder.writer.getvalue(), len(values))
+    assert get_bits(decoded) == get_bits(values)
+
+
+def test_times_round_trip(rng):
+    times = [-5000]
+    for _ in range(5000):
+        times.append(times[-1] + rng.choice(TIME_STEPS_MS))
+    encoder = tsdb.TimeEncoder(times[0])
+    for t_ms in times[1:]:
+        encoder.append(t_ms)
+    assert tsdb.decode_times(encoder.writer.getvalue(), times[0], len(times)).tolist() == times
+
+
+def test_history_round_trip(rng):
+    history = tsdb.History(('a', 'b'), retention_s=10 ** 12)
+    times = []
+    rows = []
+    t = 100.0
+    for _ in range(3 * tsdb.CHUNK_SIZE):
+        # a gap over the 32 bit delta of delta starts a new chunk
+        t += rng.choice(TIME_STEPS_MS + (60 * 86400 * 1000,)) / 1000
+        row = [rng.choice(SPECIAL_VALUES), rng.gauss(0, 1e300)]
+        history.append(t, row)
+        times.append(t)
+        rows.append(row)
+    assert len(history.chunks) > 3
+
+    # stored times are rounded to ms
+    decoded_times, values = history.get_range(['b', 'a'], times[0] - 1, times[-1] + 1)
+    assert decoded_times.tolist() == pytest.approx(times, abs=1e-3)
+    assert get_bits(values[0]) == get_bits([row[1] for row in rows])
+    assert get_bits(values[1]) == get_bits([row[0] for row in rows])
+
+    # sealed chunks come from the decode cache the second time
+    assert history.decoded
+    _, again = history.get_range(['b', 'a'], times[0] - 1, times[-1] + 1)
+    assert get_bits(again) == get_bits(values)
+
+    start = times[len(times) // 2] - 0.01
+    part_times, part = history.get_range(['a'], start, times[-1] + 1)
+    assert part_times[0] == pytest.approx(start + 0.01, abs=1e-3)
+    assert get_bits(part[0]) == get_bits([row[0] for row in rows[len(rows) // 2:]])
+
+
+def test_decode_cache_budget(monkeypatch):
+    monkeypatch.setattr(tsdb, 'DECODE_CACHE_BYTES', tsdb.CHUNK_SIZE * 8 * 3)
+    history = tsdb.History(('a',), retention_s=10 ** 9)
+    for i in range(4 * tsdb.CHUNK_SIZE):
+        history.append(float(i), [float(i)])
+    history.get_range(['a'], 0, 4 * tsdb.CHUNK_SIZE)
+    assert history.decoded_bytes <= tsdb.DECODE_CACHE_BYTES
+    assert history.decoded_bytes == sum(array.nbytes for array in history.decoded.values())
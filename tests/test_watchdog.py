@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+import watchdog
+
+TIMEOUT_S = 0.2
+
+
+@pytest.fixture
+def sources():
+    sources = watchdog.Watchdog(TIMEOUT_S)
+    yield sources
+    sources.stop()
+
+
+def test_good_source(sources):
+    sources.add('good', lambda value: value * 2)
+    assert sources.call_all([('good', (2,))]) == {'good': 4}
+    assert sources.get_alarms(time.monotonic()) == []
+
+
+def test_source_without_data_is_dropped(sources):
+    def missing():
+        raise FileNotFoundError('/sys/class/power_supply/BAT1')
+
+    sources.add('battery', missing)
+    assert sources.call_all([('battery', ())]) == {}
+    assert 'battery' not in sources.sources
+    assert sources.get_alarms(time.monotonic()) == []
+    # later ticks skip it
+    assert sources.call('battery') is None
+    assert sources.get_alarms(time.monotonic()) == []
+
+
+def test_source_failing_after_data_is_stale(sources):
+    values = [1]
+
+    def flaky():
+        if not values:
+            raise OSError('read error')
+        return values.pop()
+
+    sources.add('flaky', flaky)
+    assert sources.call('flaky') == 1
+    assert sources.call('flaky') == 1
+    alarms = sources.get_alarms(time.monotonic())
+    assert [alarm.name for alarm in alarms] == ['Stale flaky']
+    assert 'flaky' in sources.sources
+
+
+def test_timeout_without_data_is_stale(sources):
+    release = threading.Event()
+    sources.add('hung', release.wait)
+    assert sources.call('hung') is None
+    assert [alarm.message for alarm in sources.get_alarms(time.monotonic())] == ['hung stale no data']
+    release.set()
+
+
+def test_sources_are_polled_concurrently(sources):
+    release = threading.Event()
+    for name in ('hung1', 'hung2', 'hung3'):
+        sources.add(name, release.wait)
+    sources.add('good', lambda: 1)
+
+    start = time.monotonic()
+    values = sources.call_all([('hung1', ()), ('hung2', ()), ('hung3', ()), ('good', ())])
+    # one deadline for the tick, not one per hung source
+    assert time.monotonic() - start < TIMEOUT_S * 2
+    assert values['good'] == 1
+    assert sorted(sources.get_stale_list()) == ['hung1', 'hung2', 'hung3']
+    release.set()
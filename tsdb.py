@@ -0,0 +1,326 @@
+import collections
+import struct
+import threading
+import typing
+
+import numpy as np
+
+# samples per chunk, a chunk is decoded as a whole
+CHUNK_SIZE = 1024
+# decoded chunks kept for repeated look-back queries, a week at 1 s of the times and a dozen fields
+DECODE_CACHE_BYTES = 64 * 1024 * 1024
+
+# delta of delta buckets of the timestamps in ms: prefix, prefix bits, value bits
+TIME_BUCKETS = (
+    (0b10, 2, 7),
+    (0b110, 3, 9),
+    (0b1110, 4, 12),
+)
+TIME_LARGE_PREFIX = 0b1111
+TIME_LARGE_BITS = 32
+# longest code of a sample, decoders refill their bit accumulator by REFILL_BITS to hold one
+TIME_MAX_BITS = 4 + TIME_LARGE_BITS
+VALUE_MAX_BITS = 2 + 5 + 6 + 64
+REFILL_BITS = 64
+
+FLOAT = struct.Struct('<d')
+UINT = struct.Struct('<Q')
+
+
+def float_to_bits(value: float) -> int:
+    return UINT.unpack(FLOAT.pack(value))[0]
+
+
+def bits_to_float(bits: int) -> float:
+    return FLOAT.unpack(UINT.pack(bits))[0]
+
+
+class BitWriter:
+    def __init__(self):
+        self.data = bytearray()
+        # bits not yet flushed to data
+        self.acc = 0
+        self.count = 0
+
+    def write(self, value: int, bits: int):
+        self.acc = (self.acc << bits) | (value & ((1 << bits) - 1))
+        self.count += bits
+        while self.count >= 8:
+            self.count -= 8
+            self.data.append(self.acc >> self.count)
+            self.acc &= (1 << self.count) - 1
+
+    def getvalue(self) -> bytes:
+        if self.count:
+            return bytes(self.data) + bytes([self.acc << (8 - self.count)])
+        return bytes(self.data)
+
+    def get_size_bytes(self) -> int:
+        return len(self.data) + (1 if self.count else 0)
+
+
+class TimeEncoder:
+    """
+    Delta of delta of ms timestamps, a tick on time costs 1 bit, timer jitter 9 to 12 bits.
+    """
+
+    def __init__(self, t_ms: int):
+        self.writer = BitWriter()
+        self.prev_ms = t_ms
+        self.prev_delta_ms = 0
+
+    @staticmethod
+    def fits(delta_of_delta: int) -> bool:
+        return -(1 << (TIME_LARGE_BITS - 1)) < delta_of_delta < 1 << (TIME_LARGE_BITS - 1)
+
+    def append(self, t_ms: int):
+        delta_ms = t_ms - self.prev_ms
+        delta_of_delta = delta_ms - self.prev_delta_ms
+        self.prev_ms = t_ms
+        self.prev_delta_ms = delta_ms
+
+        if delta_of_delta == 0:
+            self.writer.write(0, 1)
+            return
+        for prefix, prefix_bits, bits in TIME_BUCKETS:
+            # signed range -(2^(n-1) - 1)..2^(n-1) stored with an offset
+            if -(1 << (bits - 1)) < delta_of_delta <= 1 << (bits - 1):
+                self.writer.write(prefix, prefix_bits)
+                self.writer.write(delta_of_delta + (1 << (bits - 1)) - 1, bits)
+                return
+        self.writer.write(TIME_LARGE_PREFIX, 4)
+        self.writer.write(delta_of_delta, TIME_LARGE_BITS)
+
+
+def decode_times(data: bytes, start_ms: int, count: int) -> np.ndarray:
+    # the bit reader is inlined, a method call per code costs more than the decoding
+    data += bytes(REFILL_BITS // 8)
+    delta_of_deltas = [0] * count
+    acc = 0
+    acc_bits = 0
+    pos = 0
+    for i in range(1, count):
+        if acc_bits < TIME_MAX_BITS:
+            acc = (acc & ((1 << acc_bits) - 1)) << REFILL_BITS | int.from_bytes(data[pos:pos + REFILL_BITS // 8], 'big')
+            pos += REFILL_BITS // 8
+            acc_bits += REFILL_BITS
+        acc_bits -= 1
+        if not acc >> acc_bits & 1:
+            continue
+        for prefix, prefix_bits, bits in TIME_BUCKETS:
+            acc_bits -= 1
+            if not acc >> acc_bits & 1:
+                acc_bits -= bits
+                delta_of_deltas[i] = (acc >> acc_bits & ((1 << bits) - 1)) - (1 << (bits - 1)) + 1
+                break
+        else:
+            acc_bits -= TIME_LARGE_BITS
+            delta_of_delta = acc >> acc_bits & ((1 << TIME_LARGE_BITS) - 1)
+            if delta_of_delta >= 1 << (TIME_LARGE_BITS - 1):
+                delta_of_delta -= 1 << TIME_LARGE_BITS
+            delta_of_deltas[i] = delta_of_delta
+    return start_ms + np.cumsum(np.cumsum(np.array(delta_of_deltas, dtype=np.int64)))
+
+
+class ValueEncoder:
+    """
+    XOR of the float64 bits with the previous value, an unchanged value costs 1 bit.
+    Changed bits inside the window of the previous change reuse its leading and trailing zero counts.
+    """
+
+    def __init__(self, value: float):
+        self.writer = BitWriter()
+        self.prev_bits = float_to_bits(value)
+        self.writer.write(self.prev_bits, 64)
+        self.leading = -1
+        self.trailing = 0
+
+    def append(self, value: float):
+        bits = float_to_bits(value)
+        xor = bits ^ self.prev_bits
+        self.prev_bits = bits
+        if xor == 0:
+            self.writer.write(0, 1)
+            return
+
+        # leading zeros are stored in 5 bits
+        leading = min(64 - xor.bit_length(), 31)
+        trailing = (xor & -xor).bit_length() - 1
+        if self.leading >= 0 and leading >= self.leading and trailing >= self.trailing:
+            self.writer.write(0b10, 2)
+            self.writer.write(xor >> self.trailing, 64 - self.leading - self.trailing)
+        else:
+            meaningful = 64 - leading - trailing
+            self.writer.write(0b11, 2)
+            self.writer.write(leading, 5)
+            self.writer.write(meaningful - 1, 6)
+            self.writer.write(xor >> trailing, meaningful)
+            self.leading = leading
+            self.trailing = trailing
+
+
+def decode_values(data: bytes, count: int) -> np.ndarray:
+    # the XORs are collected and accumulated by numpy, the bit reader is inlined as in decode_times
+    data += bytes(REFILL_BITS // 8)
+    xors = [0] * count
+    xors[0] = int.from_bytes(data[:8], 'big')
+    acc = 0
+    acc_bits = 0
+    pos = 8
+    trailing = 0
+    meaningful = 64
+    for i in range(1, count):
+        while acc_bits < VALUE_MAX_BITS:
+            acc = (acc & ((1 << acc_bits) - 1)) << REFILL_BITS | int.from_bytes(data[pos:pos + REFILL_BITS // 8], 'big')
+            pos += REFILL_BITS // 8
+            acc_bits += REFILL_BITS
+        acc_bits -= 1
+        if not acc >> acc_bits & 1:
+            continue
+        acc_bits -= 1
+        if acc >> acc_bits & 1:
+            acc_bits -= 11
+            meaningful = (acc >> acc_bits & 0x3f) + 1
+            trailing = 64 - (acc >> (acc_bits + 6) & 0x1f) - meaningful
+        acc_bits -= meaningful
+        xors[i] = (acc >> acc_bits & ((1 << meaningful) - 1)) << trailing
+    return np.bitwise_xor.accumulate(np.array(xors, dtype=np.uint64)).view(np.float64)
+
+
+class Chunk:
+    def __init__(self, t_ms: int, values: typing.Sequence[float]):
+        self.start_ms = t_ms
+        self.end_ms = t_ms
+        self.count = 1
+        self.times: typing.Optional[TimeEncoder] = TimeEncoder(t_ms)
+        self.values: typing.Optional[typing.List[ValueEncoder]] = [ValueEncoder(value) for value in values]
+        # encoded streams of a sealed chunk
+        self.times_data = b''
+        self.values_data: typing.List[bytes] = []
+
+    def is_full(self, t_ms: int) -> bool:
+        return self.count >= CHUNK_SIZE or not self.times.fits(t_ms - self.end_ms - self.times.prev_delta_ms)
+
+    def append(self, t_ms: int, values: typing.Sequence[float]):
+        self.times.append(t_ms)
+        for encoder, value in zip(self.values, values):
+            encoder.append(value)
+        self.end_ms = t_ms
+        self.count += 1
+
+    def seal(self):
+        # writers and encoder state are dropped, only the bytes are kept
+        self.times_data = self.times.writer.getvalue()
+        self.values_data = [encoder.writer.getvalue() for encoder in self.values]
+        self.times = None
+        self.values = None
+
+    def get_times_data(self) -> bytes:
+        return self.times.writer.getvalue() if self.times else self.times_data
+
+    def get_values_data(self, index: int) -> bytes:
+        return self.values[index].writer.getvalue() if self.values else self.values_data[index]
+
+    def get_size_bytes(self) -> int:
+        if self.times:
+            return self.times.writer.get_size_bytes() + sum(encoder.writer.get_size_bytes() for encoder in self.values)
+        return len(self.times_data) + sum(len(data) for data in self.values_data)
+
+
+class History:
+    """
+    Compressed in-memory history of every field, Gorilla style encoding in chunks of CHUNK_SIZE ticks.
+    All fields share the timestamps of a tick. Appending is O(1), ranges are decoded by chunks to numpy.
+    """
+
+    def __init__(self, fields: typing.Sequence[str], retention_s: float):
+        self.fields = tuple(fields)
+        self.index = {field: i for i, field in enumerate(self.fields)}
+        self.retention_ms = round(retention_s * 1000)
+        self.chunks: typing.Deque[Chunk] = collections.deque()
+        # appended by the collector loop, read by query threads
+        self.lock = threading.Lock()
+        # (chunk start, field index or -1 for times) to decoded array, sealed chunks only
+        self.decoded: typing.OrderedDict[typing.Tuple[int, int], np.ndarray] = collections.OrderedDict()
+        self.decoded_bytes = 0
+        self.decoded_lock = threading.Lock()
+
+    def append(self, t: float, values: typing.Sequence[float]):
+        with self.lock:
+            self._append(round(t * 1000), values)
+
+    def _append(self, t_ms: int, values: typing.Sequence[float]):
+        chunk = self.chunks[-1] if self.chunks else None
+        if chunk is not None and t_ms <= chunk.end_ms:
+            # tick from a restarted clock, keep the history ordered
+            return
+        if chunk is None or chunk.is_full(t_ms):
+            if chunk is not None:
+                chunk.seal()
+            self.chunks.append(Chunk(t_ms, values))
+        else:
+            chunk.append(t_ms, values)
+
+        while self.chunks[0].end_ms < t_ms - self.retention_ms:
+            self.chunks.popleft()
+
+    def _decode(self, key: typing.Tuple[int, int], sealed: bool,
+                decode: typing.Callable[[], np.ndarray]) -> np.ndarray:
+        with self.decoded_lock:
+            array = self.decoded.get(key)
+            if array is not None:
+                self.decoded.move_to_end(key)
+                return array
+
+        array = decode()
+        if sealed:
+            with self.decoded_lock:
+                if key not in self.decoded:
+                    self.decoded[key] = array
+                    self.decoded_bytes += array.nbytes
+                while self.decoded_bytes > DECODE_CACHE_BYTES:
+                    self.decoded_bytes -= self.decoded.popitem(last=False)[1].nbytes
+        return array
+
+    def get_range(self, fields: typing.Sequence[str], start_s: float,
+                  end_s: float) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """Times and values with a row per field of the ticks in [start_s, end_s]."""
+        indexes = [self.index[field] for field in fields]
+        start_ms = start_s * 1000
+        end_ms = end_s * 1000
+        # streams are taken under the lock and decoded outside of it, so append is never blocked by decoding
+        with self.lock:
+            parts = [
+                (chunk.start_ms, chunk.count, chunk.times is None, chunk.get_times_data(),
+                 [chunk.get_values_data(index) for index in indexes])
+                for chunk in self.chunks if chunk.end_ms >= start_ms and chunk.start_ms <= end_ms
+            ]
+
+        times = []
+        values = []
+        for chunk_start_ms, count, sealed, times_data, values_data in parts:
+            chunk_times = self._decode(
+                (chunk_start_ms, -1), sealed, lambda: decode_times(times_data, chunk_start_ms, count) / 1000)
+            mask = (chunk_times >= start_s) & (chunk_times <= end_s)
+            times.append(chunk_times[mask])
+            values.append([
+                self._decode((chunk_start_ms, index), sealed, lambda: decode_values(data, count))[mask]
+                for index, data in zip(indexes, values_data)
+            ])
+        if not times:
+            return np.empty(0), np.empty((len(indexes), 0))
+        return np.concatenate(times), np.concatenate(values, axis=1)
+
+    def get_sample_count(self) -> int:
+        with self.lock:
+            return sum(chunk.count for chunk in self.chunks)
+
+    def get_size_bytes(self) -> int:
+        with self.lock:
+            return sum(chunk.get_size_bytes() for chunk in self.chunks)
+
+    def __str__(self):
+        samples = self.get_sample_count() * len(self.fields)
+        size = self.get_size_bytes()
+        return '[{} ticks {} kB {:.2f} B/sample]'.format(
+            self.get_sample_count(), size // 1024, size / samples if samples else 0)
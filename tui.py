@@ -0,0 +1,361 @@
+import array
+import curses
+import locale
+import math
+import os
+import select
+import sys
+import time
+import typing
+
+import alarm
+import common
+import hard_monitor
+import profiler
+import rules
+import sampling
+import segments
+
+
+TUI_LOG_FILE = '/tmp/hard_monitor_tui.log'
+
+NAME_WIDTH = 9
+SPARK_CELLS = 24
+DETAIL_NAME_WIDTH = 7
+DETAIL_STATS_WIDTH = 22
+
+# 1/8 height steps, a missing sample is an empty cell
+SPARK_BLOCKS = '▁▂▃▄▅▆▇█'
+BRAILLE_BASE = 0x2800
+# dots of the left and right braille column from the bottom up
+BRAILLE_LEFT = (0x40, 0x04, 0x02, 0x01)
+BRAILLE_RIGHT = (0x80, 0x20, 0x10, 0x08)
+
+LOG_Y_MIN = 0.0001
+
+KEY_QUIT = (ord('q'), ord('Q'), 27)
+KEY_UP = (curses.KEY_UP, ord('k'), curses.KEY_BTAB)
+KEY_DOWN = (curses.KEY_DOWN, ord('j'), ord('\t'))
+KEY_FIRST = (curses.KEY_HOME, ord('g'))
+KEY_LAST = (curses.KEY_END, ord('G'))
+KEY_MODE = (ord('m'),)
+
+HELP = 'j/k select  g/G first/last  m block/braille  q quit'
+
+
+class History:
+    """
+    Ring of float32 samples, one per time bucket.
+    4 bytes per sample keep a full terminal width of every series in a few kB.
+    """
+
+    def __init__(self, size: int, bucket_s: float):
+        self.bucket_s = bucket_s
+        self.values = array.array('f', [math.nan]) * size
+        self.pos = 0
+        self.bucket: typing.Optional[int] = None
+        self.bucket_sum = 0.0
+        self.bucket_count = 0
+
+    def add_value(self, value: float, t: float):
+        bucket = int(t // self.bucket_s)
+        if self.bucket is not None and bucket > self.bucket:
+            # buckets without samples hold the last value
+            last = self.values[self.pos - 1]
+            for _ in range(min(bucket - self.bucket - 1, len(self.values))):
+                self._push(last)
+            self.bucket_sum = 0.0
+            self.bucket_count = 0
+            self.pos = (self.pos + 1) % len(self.values)
+        if self.bucket is None or bucket > self.bucket:
+            self.bucket = bucket
+        self.bucket_sum += value
+        self.bucket_count += 1
+        self.values[self.pos - 1] = self.bucket_sum / self.bucket_count
+
+    def _push(self, value: float):
+        self.values[self.pos] = value
+        self.pos = (self.pos + 1) % len(self.values)
+
+    def get_values(self, count: int) -> array.array:
+        # oldest first
+        ordered = self.values[self.pos:] + self.values[:self.pos]
+        return ordered[-count:] if count else array.array('f')
+
+    def resized(self, size: int, bucket_s: float) -> 'History':
+        history = History(size, bucket_s)
+        tail = self.get_values(min(size, len(self.values)))
+        history.values[size - len(tail):] = tail
+        history.bucket = self.bucket and int(self.bucket * self.bucket_s // bucket_s)
+        return history
+
+
+def render_sparkline(levels: typing.Sequence[float], braille: bool) -> str:
+    # levels are 0..1 or nan for missing samples, the lowest step is drawn for zero
+    if not braille:
+        return ''.join(
+            ' ' if math.isnan(level) else SPARK_BLOCKS[round(level * (len(SPARK_BLOCKS) - 1))]
+            for level in levels)
+
+    cells = []
+    for i in range(0, len(levels) - 1, 2):
+        left, right = levels[i], levels[i + 1]
+        if math.isnan(left) and math.isnan(right):
+            cells.append(' ')
+            continue
+        dots = 0
+        for level, column in ((left, BRAILLE_LEFT), (right, BRAILLE_RIGHT)):
+            if not math.isnan(level):
+                dots |= sum(column[:1 + round(level * (len(column) - 1))])
+        cells.append(chr(BRAILLE_BASE | dots))
+    return ''.join(cells)
+
+
+class SeriesView:
+    def __init__(self, series: segments.Series, history: History):
+        self.series = series
+        self.history = history
+        self.y_max = math.nan
+
+    def update(self, info, t: float):
+        value = rules.get_metric(info, self.series.metric)
+        if value is None or math.isnan(value):
+            return
+        self.history.add_value(value, t)
+        if self.series.y_max:
+            self.y_max = rules.get_metric(info, self.series.y_max) or math.nan
+
+    def get_levels(self, count: int) -> typing.List[float]:
+        values = self.history.get_values(count)
+        if self.series.log_range:
+            low, high = self.series.log_range
+            levels = [(math.log10(max(value, LOG_Y_MIN)) - low) / (high - low) for value in values]
+        else:
+            y_max = self.y_max
+            if math.isnan(y_max) or y_max <= 0:
+                y_max = max((value for value in values if not math.isnan(value)), default=0)
+            levels = [value / y_max if y_max > 0 else 0 for value in values]
+        return [level if math.isnan(level) else min(max(level, 0), 1) for level in levels]
+
+    def get_stats(self) -> str:
+        values = [value for value in self.history.values if not math.isnan(value)]
+        if not values:
+            return ''
+        return '{:.1f}/{:.1f}/{:.1f}'.format(min(values), sum(values) / len(values), max(values))
+
+
+class Screen:
+    """
+    Keeps the lines on the terminal and rewrites only the changed span of every line.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.lines: typing.List[typing.Tuple[str, int]] = []
+
+    def invalidate(self):
+        self.lines = []
+        self.window.erase()
+
+    def draw(self, lines: typing.List[typing.Tuple[str, int]]):
+        height, width = self.window.getmaxyx()
+        # the bottom right cell can't be written without scrolling
+        width -= 1
+        lines = [(text[:width].ljust(width), attr) for text, attr in lines[:height]]
+        lines += [(' ' * width, curses.A_NORMAL)] * (min(len(self.lines), height) - len(lines))
+
+        for y, (text, attr) in enumerate(lines):
+            old_text, old_attr = self.lines[y] if y < len(self.lines) else ('', None)
+            if text == old_text and attr == old_attr:
+                continue
+            start, end = 0, len(text)
+            if attr == old_attr and len(old_text) == len(text):
+                while text[start] == old_text[start]:
+                    start += 1
+                while text[end - 1] == old_text[end - 1]:
+                    end -= 1
+            self.window.addstr(y, start, text[start:end], attr)
+        self.lines = lines
+        self.window.noutrefresh()
+        curses.doupdate()
+
+
+class View:
+    def __init__(self, window, graph_time_s: float, braille: bool):
+        self.screen = Screen(window)
+        self.graph_time_s = graph_time_s
+        self.braille = braille
+
+        self.info = None
+        self.selected = segments.NAMES[0]
+        self.views: typing.Dict[str, typing.List[SeriesView]] = {}
+        self.history_size = 0
+        self._resize()
+
+    def _get_history_size(self) -> int:
+        _, width = self.screen.window.getmaxyx()
+        cells = max(width - DETAIL_NAME_WIDTH - DETAIL_STATS_WIDTH - 1, SPARK_CELLS)
+        # braille has 2 samples per cell, keep the same count in block mode to switch without loss
+        return cells * 2
+
+    def _resize(self):
+        size = self._get_history_size()
+        if size != self.history_size:
+            bucket_s = self.graph_time_s / size
+            for segment in segments.SEGMENTS:
+                views = self.views.get(segment.name)
+                self.views[segment.name] = [
+                    SeriesView(series, views[i].history.resized(size, bucket_s) if views else History(size, bucket_s))
+                    for i, series in enumerate(segment.series)
+                ]
+            self.history_size = size
+        self.screen.invalidate()
+
+    def _get_rows(self) -> typing.List[segments.Segment]:
+        if self.info is None:
+            return []
+        return [segment for segment in segments.SEGMENTS if getattr(self.info, segment.name, None) is not None]
+
+    def update(self, info):
+        self.info = info
+        t = info.get_time()
+        for row in self._get_rows():
+            for view in self.views[row.name]:
+                view.update(info, t)
+
+    def on_key(self, key: int) -> bool:
+        rows = [row.name for row in self._get_rows()]
+        index = rows.index(self.selected) if self.selected in rows else 0
+        if key in KEY_QUIT:
+            return False
+        elif key == curses.KEY_RESIZE:
+            self._resize()
+        elif not rows:
+            pass
+        elif key in KEY_UP:
+            self.selected = rows[(index - 1) % len(rows)]
+        elif key in KEY_DOWN:
+            self.selected = rows[(index + 1) % len(rows)]
+        elif key in KEY_FIRST:
+            self.selected = rows[0]
+        elif key in KEY_LAST:
+            self.selected = rows[-1]
+        elif key in KEY_MODE:
+            self.braille = not self.braille
+        return True
+
+    def _sparkline(self, view: SeriesView, cells: int) -> str:
+        samples = cells * 2 if self.braille else cells
+        return render_sparkline(view.get_levels(samples), self.braille).rjust(cells)
+
+    def draw(self):
+        lines = [(HELP, curses.A_DIM)]
+        if self.info is None:
+            self.screen.draw(lines + [('collecting...', curses.A_NORMAL)])
+            return
+
+        alarms = '  '.join(alarm_.message for alarm_ in self.info.alarms)
+        lines.append((alarms, curses.A_BOLD if alarms else curses.A_NORMAL))
+
+        selected = None
+        for row in self._get_rows():
+            views = self.views[row.name]
+            spark = self._sparkline(views[0], SPARK_CELLS) if views else ' ' * SPARK_CELLS
+            text = '{:<{}} {} {}'.format(row.name, NAME_WIDTH, spark, getattr(self.info, row.name))
+            attr = curses.A_NORMAL
+            if row.name == self.selected:
+                attr = curses.A_REVERSE
+                selected = row
+            lines.append((text, attr))
+
+        if selected:
+            _, width = self.screen.window.getmaxyx()
+            cells = width - DETAIL_NAME_WIDTH - DETAIL_STATS_WIDTH - 2
+            lines.append(('', curses.A_NORMAL))
+            lines.append((str(getattr(self.info, selected.name)), curses.A_BOLD))
+            for view in self.views[selected.name]:
+                lines.append(('{:<{}} {} {:>{}}'.format(
+                    view.series.name, DETAIL_NAME_WIDTH,
+                    self._sparkline(view, cells),
+                    view.get_stats(), DETAIL_STATS_WIDTH), curses.A_NORMAL))
+        self.screen.draw(lines)
+
+
+def run(window, args, monitor, ticker: sampling.Ticker):
+    try:
+        curses.curs_set(0)
+    except curses.error:
+        pass
+    window.nodelay(True)
+    window.keypad(True)
+
+    # a byte in the pipe wakes the select below on triggers from collector threads
+    wakeup_read, wakeup_write = os.pipe()
+    os.set_blocking(wakeup_write, False)
+
+    def wakeup():
+        try:
+            os.write(wakeup_write, b'\0')
+        except BlockingIOError:
+            pass
+
+    monitor.add_wakeup_listener(wakeup)
+    alarm_dispatcher = alarm.create_dispatcher(args)
+    adaptive_period = sampling.AdaptivePeriod(args.period) if args.adaptive else None
+    view = View(window, args.graph_time, args.sparkline == 'braille')
+
+    due = True
+    try:
+        while True:
+            if due:
+                info = monitor.get_info(ticker.tick())
+                if view.info is None:
+                    common.startup_profile.report('first output')
+                alarm_dispatcher.update(info.alarms)
+                view.update(info)
+                if adaptive_period:
+                    ticker.set_period(adaptive_period.update(info))
+            view.draw()
+
+            ready, _, _ = select.select([sys.stdin, wakeup_read], [], [], ticker.get_timeout())
+            due = not ticker.get_timeout()
+            if wakeup_read in ready:
+                os.read(wakeup_read, 64)
+                due = True
+            if sys.stdin in ready:
+                key = window.getch()
+                while key != -1:
+                    if not view.on_key(key):
+                        return
+                    key = window.getch()
+    finally:
+        alarm_dispatcher.close()
+        os.close(wakeup_read)
+        os.close(wakeup_write)
+
+
+def main():
+    args = common.init()
+    if args.logfile is None:
+        # log lines on stderr would be drawn over the screen
+        common.log.logger.handlers.clear()
+        common.log.init(args.log, TUI_LOG_FILE)
+    locale.setlocale(locale.LC_ALL, '')
+    profiler.Profiler(args.savefile, args.profile_s).install()
+
+    monitor = hard_monitor.create_monitor(args)
+    ticker = sampling.Ticker(args.period)
+    if not monitor.load_json(args.savefile):
+        monitor.update_counters(ticker.tick())
+        time.sleep(ticker.get_timeout())
+
+    try:
+        curses.wrapper(run, args, monitor, ticker)
+    except KeyboardInterrupt:
+        pass
+    monitor.save_json(args.savefile)
+    monitor.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,20 +2,28 @@ import os
 import signal
 import typing
 
-from PyQt5.QtCore import QTimer, QDateTime, QPoint, QRect
-from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import *
-from PyQt5.QtGui import QFont, QMouseEvent
+import common
+
+with common.startup_profile.measure('import PyQt5'):
+    from PyQt5.QtCore import QTimer, QDateTime, QPoint, QRect, QObject, pyqtSignal
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtWidgets import *
+    from PyQt5.QtGui import QFont, QMouseEvent
 
 import sys
+import alarm
+with common.startup_profile.measure('import graph'):
+    import graph
+    import strip
 import hard_monitor
-import graph
-import common
+import profiler
+import rules
+import sampling
 
 
 class Window(QMainWindow):
     """Main Window."""
-    def __init__(self, config: graph.GraphConfig):
+    def __init__(self, config: graph.GraphConfig, alarm_dispatcher: alarm.AlarmDispatcher, renderer: str = 'plot'):
         """Initializer."""
         super().__init__(None)
         self.setWindowTitle("Hw monitor")
@@ -42,7 +50,10 @@ class Window(QMainWindow):
         self.main_layout.setVerticalSpacing(0)
         self.central_widget.setLayout(self.main_layout)
 
-        self.graph_list = graph.GraphList(config)
+        if renderer == 'strip':
+            self.graph_list = strip.StripList(config)
+        else:
+            self.graph_list = graph.GraphList(config)
         self.main_layout.addRow(self.graph_list.graph_layout)
 
         self.notify_label = QLabel("")
@@ -52,33 +63,54 @@ class Window(QMainWindow):
         self.notify_label.setVisible(False)
         self.main_layout.addRow(self.notify_label)
 
-    def notify(self, text: typing.Optional[str]):
-        if not text:
-            text = ''
-        else:
-            common.log.info('alarm', text)
+        # the notify label shows the active alarms, the dispatcher sends the desktop notifications
+        self.alarm_dispatcher = alarm_dispatcher
+
+    def notify(self, alarms: typing.List[common.Alarm]):
+        self.alarm_dispatcher.update(alarms)
+
+        text = ' '.join(str(alarm) for alarm in self.alarm_dispatcher.get_active())
         self.notify_label.setVisible(True if text else False)
         self.notify_label.setText(text)
 
 
+class Waker(QObject):
+    # emitted from collector threads, delivered in the gui thread
+    wake = pyqtSignal()
+
+
 class Backend:
-    def __init__(self, window: Window, period_s: float, height: typing.Optional[int]):
+    def __init__(self, window: Window, args):
+        period_s = args.period
         self.window = window
-        self.height = height
+        self.height = args.height
         self.reset_geometry()
 
-        self.hard_monitor = hard_monitor.HardMonitor(period_s, force_reload_bt=True)
-        self.hard_monitor.update_counters()
+        with common.startup_profile.measure('init HardMonitor'):
+            self.hard_monitor = hard_monitor.create_monitor(args)
+            if not self.hard_monitor.load_json(args.savefile):
+                self.hard_monitor.update_counters()
+        self.first_print = True
+        self.adaptive_period = sampling.AdaptivePeriod(period_s) if args.adaptive else None
+        self.ticker = sampling.Ticker(period_s)
+        self.ticker.tick()
 
+        # single shot to the next absolute deadline, a repeating timer slips by the time of every print
         self.print_timer = QTimer()
+        self.print_timer.setSingleShot(True)
+        self.print_timer.setTimerType(Qt.PreciseTimer)
         self.print_timer.timeout.connect(self.print)
-        self.print_timer.start(round(period_s * 1000))
+        self.print_timer.start(round(self.ticker.get_timeout() * 1000))
+
+        self.waker = Waker()
+        self.waker.wake.connect(self.print)
+        self.hard_monitor.add_wakeup_listener(self.waker.wake.emit)
 
         self.test_notify_timer = QTimer()
         self.test_notify_timer.timeout.connect(self.test_notify)
         self.test_notify_timer.start(4500)
-        self.test_notify_temp_crit_c = hard_monitor.CPU_TEMP_CRIT_C
-        hard_monitor.CPU_TEMP_CRIT_C = 30
+        self.test_notify_rule = rules.Rule('CPU test', 'cpu.temp_c', 30, message=hard_monitor.TEMP_ALARM_MESSAGE)
+        self.hard_monitor.rules.add(self.test_notify_rule)
 
         #self.window.centralWidget().mousePressEvent = self.on_press_event
         #self.window.centralWidget().mouseDoubleClickEvent = self.on_double_click_event
@@ -107,18 +139,22 @@ class Backend:
             event.accept()
 
     def test_notify(self):
-        hard_monitor.CPU_TEMP_CRIT_C = self.test_notify_temp_crit_c
+        self.hard_monitor.rules.remove(self.test_notify_rule)
         self.test_notify_timer.stop()
 
     def print(self):
         self.reset_geometry()
-        info = self.hard_monitor.get_info()
+        info = self.hard_monitor.get_info(self.ticker.tick())
         self.window.graph_list.update(info)
 
-        if info.alarms:
-            self.window.notify(' '.join(info.alarms))
-        else:
-            self.window.notify(None)
+        self.window.notify(info.alarms)
+        if self.adaptive_period:
+            self.ticker.set_period(self.adaptive_period.update(info))
+        self.print_timer.start(round(self.ticker.get_timeout() * 1000))
+
+        if self.first_print:
+            common.startup_profile.report('first update')
+            self.first_print = False
 
     def reset_geometry(self):
         # 1 - show on upper monitor
@@ -133,6 +169,8 @@ class Backend:
 
 if __name__ == "__main__":
     args = common.init()
+    # python handlers run between Qt events, at the latest on the next tick
+    profiler.Profiler(args.savefile, args.profile_s).install()
 
     app = QApplication(sys.argv)
 
@@ -141,11 +179,20 @@ if __name__ == "__main__":
         graph_height=args.graph_height,
         total_time_s=args.graph_time,
         debug=args.graph_debug,
+        cpu_heatmap=args.cpu_heatmap,
     )
 
-    win = Window(default_graph_config)
+    with common.startup_profile.measure('init Window'):
+        win = Window(default_graph_config, alarm.create_dispatcher(args), args.renderer)
     win.show()
 
-    back = Backend(win, args.period, args.height)
+    # start collectors after the first frame is shown
+    backends = []
+
+    def start_backend():
+        common.startup_profile.report('first frame')
+        backends.append(Backend(win, args))
+
+    QTimer.singleShot(0, start_backend)
 
     sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,266 @@
+import multiprocessing
+import queue
+import threading
+import time
+import typing
+
+import common
+
+# consecutive missed deadlines before an isolatable source is moved to a worker process
+REPEAT_TIMEOUTS = 3
+# forkserver children don't inherit the threads, locks and open files of the monitor
+PROCESS_CONTEXT = 'forkserver'
+STOP_JOIN_S = 1
+STALE_ALARM_PREFIX = 'Stale '
+
+
+class SourceStats:
+    def __init__(self):
+        self.calls = 0
+        self.timeouts = 0
+        self.errors = 0
+        # ticks served with the last good value
+        self.stale = 0
+        self.restarts = 0
+
+    def __str__(self):
+        return '[calls {} timeouts {} errors {} stale {} restarts {}]'.format(
+            self.calls, self.timeouts, self.errors, self.stale, self.restarts)
+
+
+def _process_loop(connection):
+    while True:
+        try:
+            func, args = connection.recv()
+        except EOFError:
+            return
+        try:
+            connection.send((True, func(*args)))
+        except Exception as e:
+            # exceptions are not always picklable
+            connection.send((False, repr(e)))
+
+
+class Worker:
+    """
+    Process of an isolated source. It is killed on a missed deadline and started again by the next call.
+    The function and its result are pickled, so only stateless sources returning plain objects are isolated.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.process: typing.Optional[multiprocessing.Process] = None
+        self.connection = None
+
+    def call(self, func: typing.Callable, args: tuple):
+        # called from the source thread only, kill() is the only access from other threads
+        if self.process is None:
+            self._start()
+        try:
+            self.connection.send((func, args))
+            ok, value = self.connection.recv()
+        except (EOFError, OSError):
+            self._reap()
+            raise TimeoutError('worker {} killed'.format(self.name))
+        if not ok:
+            raise RuntimeError(value)
+        return value
+
+    def kill(self):
+        process = self.process
+        if process is not None:
+            process.kill()
+
+    def _start(self):
+        context = multiprocessing.get_context(PROCESS_CONTEXT)
+        self.connection, child = context.Pipe()
+        self.process = context.Process(
+            target=_process_loop, args=(child,), name='source {}'.format(self.name), daemon=True)
+        self.process.start()
+        child.close()
+        common.log.info('worker started', self.name, self.process.pid)
+
+    def _reap(self):
+        self.process.join()
+        self.connection.close()
+        self.process = None
+        self.connection = None
+
+
+class Call:
+    def __init__(self, args: tuple):
+        self.args = args
+        self.result = None
+        self.error: typing.Optional[Exception] = None
+        self.done = threading.Event()
+
+
+class Source:
+    """
+    One collector call per tick on a daemon thread of the source, waited for at most timeout_s.
+    A call that misses the deadline leaves the thread busy: until it returns every tick gets the last good value.
+    An isolatable source busy for REPEAT_TIMEOUTS ticks leaves the hung thread behind and goes to a worker process.
+    A source that fails before its first good value is failed, it is not expected to work on this machine.
+    """
+
+    def __init__(self, name: str, func: typing.Callable, timeout_s: float, isolate: bool):
+        self.name = name
+        self.func = func
+        self.timeout_s = timeout_s
+        self.isolate = isolate
+        self.worker: typing.Optional[Worker] = None
+        self.stats = SourceStats()
+
+        # last good value and its monotonic time
+        self.value = None
+        self.time: typing.Optional[float] = None
+        self.fresh = False
+        self.consecutive_timeouts = 0
+        # error of a source which never gave a good value
+        self.failed: typing.Optional[Exception] = None
+
+        self.pending: typing.Optional[Call] = None
+        # the call of this tick was started, otherwise the thread is still busy with an old one
+        self.submitted = False
+        self.requests: queue.SimpleQueue = queue.SimpleQueue()
+        self.thread = self._start_thread()
+
+    def call(self, *args):
+        self.submit(*args)
+        return self.wait(time.monotonic() + self.timeout_s)
+
+    def submit(self, *args):
+        self.fresh = False
+        self.submitted = False
+        if self.pending:
+            if not self.pending.done.is_set():
+                return
+            # late result of a missed deadline
+            self._collect()
+
+        self.stats.calls += 1
+        self.submitted = True
+        self.pending = Call(args)
+        self.requests.put(self.pending)
+
+    def wait(self, deadline: float):
+        if self.submitted and self.pending.done.wait(max(deadline - time.monotonic(), 0)):
+            self._collect()
+            self.consecutive_timeouts = 0
+        else:
+            self._timeout()
+        return self.value
+
+    def stop(self):
+        self.requests.put(None)
+        if self.worker:
+            self.worker.kill()
+        if not self.pending or self.pending.done.is_set():
+            self.thread.join(STOP_JOIN_S)
+
+    def _start_thread(self) -> threading.Thread:
+        thread = threading.Thread(
+            target=self._loop, args=(self.requests, self.worker), name='source {}'.format(self.name), daemon=True)
+        thread.start()
+        return thread
+
+    def _loop(self, requests: queue.SimpleQueue, worker: typing.Optional[Worker]):
+        while True:
+            call = requests.get()
+            if call is None:
+                return
+            try:
+                call.result = worker.call(self.func, call.args) if worker else self.func(*call.args)
+            except Exception as e:
+                call.error = e
+            call.done.set()
+
+    def _collect(self):
+        call = self.pending
+        self.pending = None
+        if isinstance(call.error, TimeoutError):
+            # killed worker, counted as a timeout already
+            return
+        if call.error:
+            self.stats.errors += 1
+            if self.time is None:
+                self.failed = call.error
+            else:
+                common.log.error('source error', self.name, call.error)
+            return
+        self.value = call.result
+        self.time = time.monotonic()
+        self.fresh = True
+
+    def _timeout(self):
+        self.stats.timeouts += 1
+        self.stats.stale += 1
+        self.consecutive_timeouts += 1
+        if self.consecutive_timeouts == 1:
+            common.log.error('source timeout', self.name, self.timeout_s, self.stats)
+        if self.worker:
+            # the source thread gets EOF and the next call starts a new process
+            self.worker.kill()
+            self.stats.restarts += 1
+        elif self.isolate and self.consecutive_timeouts >= REPEAT_TIMEOUTS:
+            common.log.error('source isolated', self.name)
+            # the hung thread exits when its call returns, its result is dropped
+            self.requests.put(None)
+            self.requests = queue.SimpleQueue()
+            self.worker = Worker(self.name)
+            self.pending = None
+            self.thread = self._start_thread()
+
+
+class Watchdog:
+    """
+    Deadline per collector source, so one hung device read or shell probe never stops the tick.
+    Sources of a tick are polled concurrently, so the tick waits for the slowest deadline only.
+    Overdue sources give their last good value and are reported as stale, failed sources are dropped.
+    """
+
+    def __init__(self, timeout_s: float):
+        self.timeout_s = timeout_s
+        self.sources: typing.Dict[str, Source] = {}
+
+    def add(self, name: str, func: typing.Callable, timeout_s: typing.Optional[float] = None, isolate: bool = False):
+        self.sources[name] = Source(name, func, timeout_s or self.timeout_s, isolate)
+
+    def call(self, name: str, *args):
+        return self.call_all([(name, args)]).get(name)
+
+    def call_all(self, calls: typing.Sequence[typing.Tuple[str, tuple]]) -> typing.Dict[str, typing.Any]:
+        """Values of the sources by name, the ones not added or dropped are left out."""
+        start = time.monotonic()
+        sources = [(name, self.sources[name]) for name, _ in calls if name in self.sources]
+        for name, args in calls:
+            if name in self.sources:
+                self.sources[name].submit(*args)
+        values = {name: source.wait(start + source.timeout_s) for name, source in sources}
+        for name, source in sources:
+            if source.failed:
+                common.log.error('source dropped, no data', name, source.failed)
+                source.stop()
+                del self.sources[name]
+                del values[name]
+        return values
+
+    def get_stale_list(self) -> typing.List[str]:
+        # failed sources are dropped, the rest timed out or lost their good value
+        return [name for name, source in self.sources.items() if not source.fresh]
+
+    def get_alarms(self, now: float) -> typing.List[common.Alarm]:
+        alarms = []
+        for name in self.get_stale_list():
+            source = self.sources[name]
+            age = '{:.0f} s'.format(now - source.time) if source.time is not None else 'no data'
+            alarms.append(common.Alarm(STALE_ALARM_PREFIX + name, '{} stale {}'.format(name, age)))
+        return alarms
+
+    def stop(self):
+        for source in self.sources.values():
+            source.stop()
+
+    def __str__(self):
+        return ' '.join('{} {}'.format(name, source.stats) for name, source in self.sources.items()
+                        if source.stats.timeouts or source.stats.errors)